@@ -7,6 +7,10 @@ def create_app(config_name='default'):
     """Application factory function."""
     app = Flask(__name__)
     
+    # Spool uploads to disk past UPLOAD_SPOOL_THRESHOLD, hashing them as they arrive
+    from app.services.uploads import SpoolingRequest
+    app.request_class = SpoolingRequest
+    
     # Load configuration
     app.config.from_object(config[config_name])
     
@@ -17,6 +21,11 @@ def create_app(config_name='default'):
     # Load prompts
     app.config['PROMPTS'] = load_prompts()
     
+    # Profile requests carrying the profiling token (no-op unless PROFILING_TOKEN is set)
+    from app.services.profiling import init_profiling, init_memory_tracking
+    init_profiling(app)
+    init_memory_tracking(app)
+    
     # Register blueprints
     from app.blueprints.main import main_bp
     app.register_blueprint(main_bp)
@@ -0,0 +1,487 @@
+"""
+Offline batch generation over many source documents.
+
+Runs the document generation pipeline directly, without the HTTP API, on
+every file in a directory or in a JSONL manifest, against one template.
+Each document is written to the output directory and recorded in
+results.jsonl. Finished document IDs are appended to a checkpoint file, so
+running the same command again skips them and resumes an interrupted run.
+
+Manifest lines are JSON objects:
+
+    {"id": "acme-q3", "source": "docs/acme.pdf", "context": ["notes/acme.md"]}
+
+"id" defaults to the source path and "context" is optional. Relative paths
+are resolved against the manifest's directory.
+
+With --mode bulk, the map, summarize and generate calls of every document
+are not made one by one but submitted through the OpenAI Batch API, one
+round per stage (see run_bulk). Batches are billed at a discount and have
+their own quota, but a round can take up to BULK_COMPLETION_WINDOW.
+
+Usage:
+    python -m app.batch --template template.docx --input sources/ --output out/
+    python -m app.batch --template template.docx --manifest jobs.jsonl --output out/ --workers 8 --executor process
+    python -m app.batch --template template.docx --input sources/ --output out/ --mode bulk
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+SOURCE_EXTENSIONS = ('.txt', '.md', '.docx', '.pdf')
+OUTPUT_FORMATS = ('md', 'docx', 'pdf')
+
+# Per-worker state, set up once by init_worker
+_worker = {}
+_worker_lock = threading.Lock()
+
+def read_source_file(path):
+    """
+    Extract the text of a file on disk with the same parsers used for uploads.
+
+    Args:
+        path (str): Path to a .txt, .md, .docx or .pdf file.
+
+    Returns:
+        str: The extracted text.
+    """
+    from werkzeug.datastructures import FileStorage
+    from app.services.file_processor import read_uploaded_file
+    with open(path, 'rb') as f:
+        return read_uploaded_file(FileStorage(stream=f, filename=os.path.basename(path)))
+
+def job_id_for(path, root):
+    """Derive a filesystem-safe job ID from a source path."""
+    relative = os.path.splitext(os.path.relpath(path, root))[0]
+    return re.sub(r"[^\w.-]+", "_", relative).strip("_") or "document"
+
+def discover_jobs(input_dir=None, manifest=None):
+    """
+    List the jobs of a run, from a directory of source files or a JSONL manifest.
+
+    Args:
+        input_dir (str, optional): Directory searched recursively for supported files.
+        manifest (str, optional): JSONL manifest path.
+
+    Returns:
+        list: Job dicts with 'id', 'source' and 'context' keys, in a stable order.
+    """
+    jobs = []
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'source' not in entry:
+                    raise ValueError(f"Manifest line {line_number} has no 'source'")
+                source = os.path.join(base, entry['source'])
+                jobs.append({
+                    'id': str(entry.get('id') or job_id_for(source, base)),
+                    'source': source,
+                    'context': [os.path.join(base, path) for path in entry.get('context', [])],
+                })
+    else:
+        for directory, _, filenames in os.walk(input_dir):
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() in SOURCE_EXTENSIONS:
+                    source = os.path.join(directory, filename)
+                    jobs.append({'id': job_id_for(source, input_dir), 'source': source, 'context': []})
+        jobs.sort(key=lambda job: job['source'])
+
+    seen = set()
+    for job in jobs:
+        if job['id'] in seen:
+            raise ValueError(f"Duplicate job ID: {job['id']}")
+        seen.add(job['id'])
+    return jobs
+
+def load_checkpoint(path):
+    """Return the set of job IDs already completed by earlier runs."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+def init_worker(config_name, template_text, shared_context, options):
+    """
+    Create the application and keep the run's shared inputs for this worker.
+
+    Used as the pool initializer; thread workers share one application.
+    """
+    with _worker_lock:
+        if 'app' in _worker:
+            return
+        load_dotenv()
+        from app import create_app
+        _worker.update(
+            app=create_app(config_name),
+            template_text=template_text,
+            shared_context=shared_context,
+            options=options,
+        )
+
+def write_output(document, path, output_format, renderer=None):
+    """Write a generated document atomically in the requested format, finishing renderer's file if given."""
+    from app.services.document_generator import generate_docx, generate_pdf
+    tmp_path = f"{path}.tmp"
+    if output_format == 'md':
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(document)
+    else:
+        if renderer is not None:
+            data = renderer.finish(document)[output_format]
+        else:
+            data = (generate_docx(document) if output_format == 'docx' else generate_pdf(document)).getvalue()
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+def run_job(job):
+    """
+    Generate the document for one job and write it to the output directory.
+
+    Args:
+        job (dict): A job from discover_jobs.
+
+    Returns:
+        dict: The result record for results.jsonl.
+    """
+    from app.services.document_generator import generate_document_from_texts, is_generation_error
+    from app.services.rate_limiter import request_priority
+    from app.services.rendering import new_renderer, rendering
+
+    options = _worker['options']
+    started = time.perf_counter()
+    record = {'id': job['id'], 'source': job['source']}
+    try:
+        # Batch runs leave the reserved share of the OpenAI quota to interactive requests
+        with _worker['app'].app_context(), request_priority('batch'):
+            info_text = read_source_file(job['source'])
+            context_texts = _worker['shared_context'] + [read_source_file(path) for path in job['context']]
+            # DOCX/PDF output is rendered from the completion as it streams in
+            renderer = new_renderer([options['output_format']]) if options['output_format'] != 'md' else None
+            with rendering(renderer):
+                document = generate_document_from_texts(
+                    _worker['template_text'], info_text, context_texts or None, options['retrieval_engine']
+                )
+            if is_generation_error(document):
+                raise RuntimeError(document)
+
+            output_path = os.path.join(options['output_dir'], f"{job['id']}.{options['output_format']}")
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            write_output(document, output_path, options['output_format'], renderer)
+        record.update(status='ok', output=output_path)
+    except Exception as e:
+        record.update(status='error', error=str(e))
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+def run_batch(jobs, template_text, output_dir, output_format='md', workers=4, executor='thread',
+              config_name='default', shared_context=None, retrieval_engine=None, checkpoint_path=None,
+              log=print):
+    """
+    Run the generation pipeline over jobs, skipping those already checkpointed.
+
+    Results are appended to output_dir/results.jsonl as they finish. Only
+    successful jobs are checkpointed, so failed ones are retried on the next run.
+
+    Args:
+        jobs (list): Jobs from discover_jobs.
+        template_text (str): The template text.
+        output_dir (str): Directory for generated documents, results and the checkpoint.
+        output_format (str): 'md', 'docx' or 'pdf'.
+        workers (int): Number of concurrent jobs.
+        executor (str): 'thread' or 'process'.
+        config_name (str): Application configuration name.
+        shared_context (list, optional): Context texts used by every job.
+        retrieval_engine (str, optional): Retrieval engine for context texts.
+        checkpoint_path (str, optional): Defaults to output_dir/checkpoint.txt.
+        log (callable): Progress logger.
+
+    Returns:
+        dict: Counts of 'ok', 'error' and 'skipped' jobs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = checkpoint_path or os.path.join(output_dir, 'checkpoint.txt')
+    completed = load_checkpoint(checkpoint_path)
+    pending = [job for job in jobs if job['id'] not in completed]
+    counts = {'ok': 0, 'error': 0, 'skipped': len(jobs) - len(pending)}
+    log(f"{len(jobs)} jobs, {counts['skipped']} already done, {len(pending)} to run with {workers} {executor} workers")
+
+    options = {'output_dir': output_dir, 'output_format': output_format, 'retrieval_engine': retrieval_engine}
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    pool = pool_class(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(config_name, template_text, shared_context or [], options)
+    )
+
+    started = time.perf_counter()
+    remaining = iter(pending)
+    in_flight = set()
+    with open(os.path.join(output_dir, 'results.jsonl'), 'a', encoding='utf-8') as results, \
+            open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+        try:
+            while True:
+                # Keep a bounded window of submitted jobs so huge runs stay cheap to cancel
+                while len(in_flight) < workers * 2:
+                    job = next(remaining, None)
+                    if job is None:
+                        break
+                    in_flight.add(pool.submit(run_job, job))
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    results.write(json.dumps(record) + "\n")
+                    results.flush()
+                    counts[record['status']] += 1
+                    if record['status'] == 'ok':
+                        checkpoint.write(record['id'] + "\n")
+                        checkpoint.flush()
+                        os.fsync(checkpoint.fileno())
+                    else:
+                        log(f"{record['id']}: {record['error']}")
+
+                finished = counts['ok'] + counts['error']
+                rate = finished / (time.perf_counter() - started)
+                log(f"{finished}/{len(pending)} done, {counts['error']} failed, {rate:.2f} docs/s")
+        except KeyboardInterrupt:
+            log("Interrupted; finished jobs are checkpointed and will be skipped on the next run")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    pool.shutdown()
+    return counts
+
+def prepare_bulk_job(job, template_text, shared_context, retrieval_engine):
+    """
+    Do the local work of a bulk job: extract its texts, reduce the document and retrieve context.
+
+    Args:
+        job (dict): A job from discover_jobs.
+        template_text (str): The template text.
+        shared_context (list): Context texts used by every job.
+        retrieval_engine (str, optional): Retrieval engine for context texts.
+
+    Returns:
+        dict: The job's state for the batch rounds. 'chunks' holds the map
+        stage inputs of a long document, otherwise 'summary_input' is the
+        text to summarize. 'error' is set if the job failed.
+    """
+    from app.services.chunking import split_views
+    from app.services.file_processor import retrieve_context_chunks
+    from app.services.document_generator import (
+        summary_strategy, extract_document, MAP_CHUNK_SIZE, MAP_CHUNK_OVERLAP
+    )
+    state = {'job': job, 'chunks': None, 'summary_input': None, 'context': None, 'error': None}
+    try:
+        info_text = read_source_file(job['source'])
+        strategy = summary_strategy(info_text)
+        if strategy == 'map_reduce':
+            state['chunks'] = split_views(info_text, chunk_size=MAP_CHUNK_SIZE, chunk_overlap=MAP_CHUNK_OVERLAP)
+        elif strategy == 'extractive':
+            state['summary_input'] = extract_document(info_text, template_text)
+        else:
+            state['summary_input'] = info_text
+
+        context_texts = shared_context + [read_source_file(path) for path in job['context']]
+        if context_texts:
+            state['context'] = retrieve_context_chunks(context_texts, template_text, engine=retrieval_engine)
+    except Exception as e:
+        state['error'] = str(e)
+    return state
+
+def run_bulk(jobs, template_text, output_dir, output_format='md', workers=4, config_name='default',
+             shared_context=None, retrieval_engine=None, checkpoint_path=None, poll_interval=None, log=print):
+    """
+    Run the generation pipeline over jobs as successive rounds of OpenAI Batch API requests.
+
+    Local work (text extraction, extractive reduction and context retrieval)
+    runs first on a thread pool. Then the map requests of every long
+    document go out as one round, the summary requests as a second and the
+    generation requests as a third, each round waiting for the previous one.
+    Round state is kept in output_dir/.bulk, so rerunning an interrupted run
+    resumes polling its batches; it is removed once a run has no failures.
+    Results and the checkpoint are written as in run_batch.
+
+    Args:
+        jobs (list): Jobs from discover_jobs.
+        template_text (str): The template text.
+        output_dir (str): Directory for generated documents, results and the checkpoint.
+        output_format (str): 'md', 'docx' or 'pdf'.
+        workers (int): Threads for the local work.
+        config_name (str): Application configuration name.
+        shared_context (list, optional): Context texts used by every job.
+        retrieval_engine (str, optional): Retrieval engine for context texts.
+        checkpoint_path (str, optional): Defaults to output_dir/checkpoint.txt.
+        poll_interval (float, optional): Seconds between batch status checks; defaults to BULK_POLL_INTERVAL.
+        log (callable): Progress logger.
+
+    Returns:
+        dict: Counts of 'ok', 'error' and 'skipped' jobs.
+    """
+    from app import create_app
+    from app.services.batch_api import BatchRound, chat_request
+    from app.services.concurrency import submit_with_context
+    from app.services.openai_service import get_openai_client
+    from app.services.rate_limiter import request_priority
+    from app.services.document_generator import (
+        build_map_messages, build_summary_messages, build_generation_messages, GENERATION_ERROR_PREFIX
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = checkpoint_path or os.path.join(output_dir, 'checkpoint.txt')
+    completed = load_checkpoint(checkpoint_path)
+    pending = [job for job in jobs if job['id'] not in completed]
+    counts = {'ok': 0, 'error': 0, 'skipped': len(jobs) - len(pending)}
+    log(f"{len(jobs)} jobs, {counts['skipped']} already done, {len(pending)} to run in bulk mode")
+    if not pending:
+        return counts
+
+    app = create_app(config_name)
+    config = app.config
+    state_dir = os.path.join(output_dir, '.bulk')
+    started = time.perf_counter()
+
+    with app.app_context(), request_priority('batch'):
+        client = get_openai_client()
+
+        def new_round(name):
+            return BatchRound(
+                client, name, state_dir,
+                max_requests=config.get('BULK_MAX_REQUESTS_PER_BATCH', 50000),
+                max_bytes=config.get('BULK_MAX_BATCH_BYTES', 200000000),
+                completion_window=config.get('BULK_COMPLETION_WINDOW', '24h'),
+                poll_interval=poll_interval if poll_interval is not None else config.get('BULK_POLL_INTERVAL', 30),
+                log=log,
+            )
+
+        # Context retrieval may embed chunks, which is done directly at batch priority
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [submit_with_context(pool, prepare_bulk_job, job, template_text, shared_context or [],
+                                           retrieval_engine) for job in pending]
+            states = [future.result() for future in futures]
+        live = [state for state in states if state['error'] is None]
+        log(f"Prepared {len(live)} jobs, {len(states) - len(live)} failed")
+
+        map_round = new_round('map')
+        for state in live:
+            for number, view in enumerate(state['chunks'] or []):
+                map_round.add(f"{state['job']['id']}:map:{number}",
+                              chat_request(build_map_messages(view.page_content), 'map', config))
+        map_results = map_round.run()
+        for state in live:
+            if state['chunks'] is None:
+                continue
+            results = [map_results[f"{state['job']['id']}:map:{number}"] for number in range(len(state['chunks']))]
+            failed = next((result for result in results if 'error' in result), None)
+            if failed is not None:
+                state['error'] = f"Chunk summary failed: {failed['error']}"
+            else:
+                state['summary_input'] = "\n".join(result['content'] for result in results)
+            state['chunks'] = None
+        live = [state for state in live if state['error'] is None]
+
+        summary_round = new_round('summarize')
+        for state in live:
+            summary_round.add(f"{state['job']['id']}:summarize",
+                              chat_request(build_summary_messages(template_text, state['summary_input']),
+                                           'summarize', config))
+        summary_results = summary_round.run()
+
+        generate_round = new_round('generate')
+        for state in live:
+            result = summary_results[f"{state['job']['id']}:summarize"]
+            if 'error' in result:
+                # Like summarize_document, a failed summary fails the job
+                state['error'] = f"Summary failed: {result['error']}"
+                continue
+            generate_round.add(f"{state['job']['id']}:generate",
+                               chat_request(build_generation_messages(template_text, result['content'], state['context']),
+                                            'generate', config))
+        generate_results = generate_round.run()
+
+        with open(os.path.join(output_dir, 'results.jsonl'), 'a', encoding='utf-8') as results, \
+                open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            for state in states:
+                job = state['job']
+                record = {'id': job['id'], 'source': job['source']}
+                try:
+                    if state['error'] is not None:
+                        raise RuntimeError(state['error'])
+                    result = generate_results[f"{job['id']}:generate"]
+                    if 'error' in result:
+                        raise RuntimeError(f"{GENERATION_ERROR_PREFIX}: {result['error']}")
+                    output_path = os.path.join(output_dir, f"{job['id']}.{output_format}")
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    write_output(result['content'], output_path, output_format)
+                    record.update(status='ok', output=output_path)
+                except Exception as e:
+                    record.update(status='error', error=str(e))
+                # Jobs finish together, so this is the time of the whole run
+                record['seconds'] = round(time.perf_counter() - started, 3)
+                results.write(json.dumps(record) + "\n")
+                counts[record['status']] += 1
+                if record['status'] == 'ok':
+                    checkpoint.write(record['id'] + "\n")
+                else:
+                    log(f"{record['id']}: {record['error']}")
+            results.flush()
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+    if not counts['error']:
+        shutil.rmtree(state_dir, ignore_errors=True)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--template', required=True, help="Template file")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="Directory of source documents")
+    source.add_argument('--manifest', help="JSONL manifest of jobs")
+    parser.add_argument('--output', required=True, help="Output directory")
+    parser.add_argument('--context', nargs='*', default=[], help="Context files used for every document")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='md')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--executor', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--retrieval-engine', choices=('auto', 'vector', 'lexical', 'hybrid'))
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: OUTPUT/checkpoint.txt)")
+    parser.add_argument('--config', default=os.getenv('FLASK_CONFIG', 'default'))
+    parser.add_argument('--mode', choices=('sync', 'bulk'), default='sync',
+                        help="sync calls the API per document; bulk submits each stage through the Batch API")
+    parser.add_argument('--poll-interval', type=float, help="Bulk mode: seconds between batch status checks")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    jobs = discover_jobs(input_dir=args.input, manifest=args.manifest)
+    options = dict(
+        template_text=read_source_file(args.template),
+        output_dir=args.output,
+        output_format=args.format,
+        workers=args.workers,
+        config_name=args.config,
+        shared_context=[read_source_file(path) for path in args.context],
+        retrieval_engine=args.retrieval_engine,
+        checkpoint_path=args.checkpoint,
+    )
+    if args.mode == 'bulk':
+        counts = run_bulk(jobs, poll_interval=args.poll_interval, **options)
+    else:
+        counts = run_batch(jobs, executor=args.executor, **options)
+    print(f"Finished: {counts['ok']} succeeded, {counts['error']} failed, {counts['skipped']} skipped")
+    return 1 if counts['error'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,20 @@
 import io
+import base64
 import os
 import json
-from flask import request, jsonify, current_app, send_file
+from flask import request, jsonify, current_app, send_file, url_for
 from werkzeug.utils import secure_filename
 from . import api_bp
-from app.services.file_processor import read_file_content, process_context_files
-from app.services.document_generator import generate_document, generate_docx, generate_pdf
+from app.services.file_processor import read_file_content, read_context_files, compute_file_digest
+from app.services.document_generator import generate_document_with_context, document_file
+from app.services.single_flight import fingerprint_request, get_single_flight
+from app.services.result_store import get_result_store
+from app.services.rendering import new_renderer, rendering
+from app.services.semantic_cache import run_with_semantic_cache
+from app.services.admission import get_admission_controller, AdmissionRejected
+from app.services.retrieval import RETRIEVAL_ENGINES
+from app.services.profiling import PROFILE_HEADER, profiling_authorized, load_profile, memory_stats
+from app.services.task_routing import TASK_PRIORITIES
 
 @api_bp.route('/health', methods=['GET'])
 def health_check():
@@ -13,7 +22,8 @@ def health_check():
     return jsonify({
         "status": "ok", 
         "message": "API is operational",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "startup": current_app.extensions.get('startup_report')
     })
 
 @api_bp.route('/generate', methods=['POST'])
@@ -25,7 +35,8 @@ def generate_document_api():
     {
         "template_text": "Text content of the template",
         "document_text": "Text content of the document to extract info from",
-        "output_format": "text|docx|pdf" (optional, defaults to "text")
+        "output_format": "text|docx|pdf" (optional, defaults to "text"),
+        "priority": "interactive|batch" (optional, defaults to "interactive")
     }
     
     Or multipart form data with:
@@ -33,15 +44,19 @@ def generate_document_api():
     - info_file: File upload for the document
     - context_files: (Optional) Additional context files
     - output_format: (Optional) "text", "docx", or "pdf"
+    - retrieval_engine: (Optional) "auto", "vector", "lexical" or "hybrid"
+    - priority: (Optional) "interactive" or "batch"
+    
+    Batch-priority requests are always queued on the batch Celery queues
+    and answered with 202 and a task ID, so bulk clients never take an
+    interactive generation slot.
     
     Returns:
     - JSON response with generated document text or
-    - File download for docx/pdf formats
+    - File download for docx/pdf formats or
+    - 429 with Retry-After when the instance is saturated, or 202 with a
+      task ID when saturated requests are diverted to Celery
     """
-    output_format = request.form.get('output_format', 'text')
-    if output_format not in ['text', 'docx', 'pdf']:
-        return jsonify({"error": "Invalid output format. Must be 'text', 'docx', or 'pdf'"}), 400
-    
     # Handle JSON payload
     if request.is_json:
         data = request.get_json()
@@ -49,28 +64,17 @@ def generate_document_api():
             return jsonify({"error": "Both template_text and document_text are required"}), 400
         
         template_text = data.get('template_text')
-        document_text = data.get('document_text')
+        info_text = data.get('document_text')
         output_format = data.get('output_format', 'text')
-        
-        # Generate document
-        try:
-            result = generate_document(template_text, document_text)
-            
-            if output_format == 'text':
-                return jsonify({"result": result})
-            elif output_format == 'docx':
-                docx_data = generate_docx(result)
-                return send_file_response(docx_data, 'generated_document.docx', 
-                                         'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-            elif output_format == 'pdf':
-                pdf_data = generate_pdf(result)
-                return send_file_response(pdf_data, 'generated_document.pdf', 'application/pdf')
-        except Exception as e:
-            current_app.logger.error(f"Error generating document: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+        retrieval_engine = data.get('retrieval_engine')
+        priority = data.get('priority') or 'interactive'
+        context_files = []
     
     # Handle form data with file uploads
     else:
+        output_format = request.form.get('output_format', 'text')
+        retrieval_engine = request.form.get('retrieval_engine') or None
+        priority = request.form.get('priority') or 'interactive'
         if 'template_file' not in request.files or 'info_file' not in request.files:
             return jsonify({"error": "Both template_file and info_file are required"}), 400
         
@@ -83,26 +87,165 @@ def generate_document_api():
         try:
             template_text = read_file_content(template_file)
             info_text = read_file_content(info_file)
-            
-            # Process additional context documents if provided
-            context_files = request.files.getlist('context_files')
-            retrieved_docs = process_context_files(context_files, template_text)
-            
-            # Generate document
-            result = generate_document(template_text, info_text, context_chunks=retrieved_docs)
-            
-            if output_format == 'text':
-                return jsonify({"result": result})
-            elif output_format == 'docx':
-                docx_data = generate_docx(result)
-                return send_file_response(docx_data, 'generated_document.docx', 
-                                         'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-            elif output_format == 'pdf':
-                pdf_data = generate_pdf(result)
-                return send_file_response(pdf_data, 'generated_document.pdf', 'application/pdf')
         except Exception as e:
             current_app.logger.error(f"Error processing files: {str(e)}")
             return jsonify({"error": str(e)}), 500
+        
+        # Additional context documents, if provided
+        context_files = request.files.getlist('context_files')
+    
+    if output_format not in ['text', 'docx', 'pdf']:
+        return jsonify({"error": "Invalid output format. Must be 'text', 'docx', or 'pdf'"}), 400
+    if retrieval_engine and retrieval_engine not in RETRIEVAL_ENGINES:
+        return jsonify({"error": f"Invalid retrieval engine. Must be one of: {', '.join(RETRIEVAL_ENGINES)}"}), 400
+    if priority not in TASK_PRIORITIES:
+        return jsonify({"error": f"Invalid priority. Must be one of: {', '.join(TASK_PRIORITIES)}"}), 400
+    
+    if priority == 'batch':
+        return queued_generation_response(template_text, info_text, context_files, retrieval_engine, priority)
+    
+    # Wait for a generation slot, or shed load if the instance is saturated
+    admission = get_admission_controller()
+    try:
+        slot = admission.acquire()
+    except AdmissionRejected as e:
+        return admission_overflow_response(e, template_text, info_text, context_files, retrieval_engine)
+    
+    try:
+        context_digests = [compute_file_digest(f) for f in context_files if f.filename]
+        
+        # Generate document, sharing the result of an identical in-flight request;
+        # a requested DOCX/PDF is rendered from the completion as it streams in
+        params = {'retrieval_engine': retrieval_engine}
+        key = fingerprint_request(template_text, info_text, context=context_digests, params=params)
+        renderer = new_renderer([output_format]) if output_format != 'text' else None
+        with rendering(renderer):
+            # Near-duplicates of earlier sources may be served from the semantic cache
+            result = run_with_semantic_cache(
+                template_text, info_text,
+                lambda: get_single_flight().run(
+                    key, generate_document_with_context, template_text, info_text, context_files, retrieval_engine
+                ),
+                context=context_digests, params=params
+            )
+        if renderer is not None:
+            return file_result(io.BytesIO(renderer.finish(result)[output_format]), output_format)
+        return render_result(result, output_format)
+    except Exception as e:
+        current_app.logger.error(f"Error generating document: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        admission.release(slot)
+
+@api_bp.route('/tasks/<task_id>', methods=['GET'])
+def task_status(task_id):
+    """
+    Report the progress of a background generation task.
+    
+    Once the task is done, the generated document is returned in the
+    format given by the optional output_format query parameter.
+    """
+    task = get_result_store().get(f"task:{task_id}")
+    if task is None:
+        return jsonify({"error": "Unknown or expired task ID"}), 404
+    
+    if task['status'] != 'done':
+        return jsonify({"task_id": task_id, "status": task['status'],
+                        "progress": task['progress'], "message": task['message']})
+    
+    result = get_result_store().get(task['result_id'])
+    if result is None:
+        return jsonify({"error": "The generated document has expired"}), 404
+    
+    output_format = request.args.get('output_format', 'text')
+    if output_format not in ['text', 'docx', 'pdf']:
+        return jsonify({"error": "Invalid output format. Must be 'text', 'docx', or 'pdf'"}), 400
+    return render_result(result, output_format, result_id=task['result_id'])
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Report operational metrics for this instance and the shared Celery queues."""
+    from app.services.task_routing import get_queue_metrics
+    from app.services.semantic_cache import get_semantic_cache
+    from app.services.model_routing import get_stage_metrics
+    try:
+        queues = get_queue_metrics().stats()
+    except Exception as e:
+        # Queue metrics live in Redis, which deployments without Celery may not run
+        current_app.logger.warning(f"Queue metrics unavailable: {e}")
+        queues = None
+    return jsonify({
+        "admission": get_admission_controller().stats(),
+        "queues": queues,
+        "memory": memory_stats(),
+        "models": get_stage_metrics().stats(),
+        "semantic_cache": get_semantic_cache().stats() if current_app.config.get('SEMANTIC_CACHE') else None
+    })
+
+@api_bp.route('/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """
+    Return a saved request or task profile.
+    
+    Requires the profiling token in the X-Profile-Token header. By default
+    the stage breakdown and the formatted cProfile table are returned as
+    JSON; with format=pstats the raw profile is downloaded for tools such as
+    snakeviz or pstats.
+    """
+    if not profiling_authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"error": "Profiling is disabled or the token is invalid"}), 403
+    
+    report = load_profile(profile_id)
+    if report is None:
+        return jsonify({"error": "Unknown or expired profile ID"}), 404
+    
+    if request.args.get('format') == 'pstats':
+        return send_file_response(io.BytesIO(base64.b64decode(report['pstats'])),
+                                  f"profile-{profile_id}.prof", 'application/octet-stream')
+    return jsonify({key: value for key, value in report.items() if key != 'pstats'})
+
+def admission_overflow_response(error, template_text, info_text, context_files, retrieval_engine=None):
+    """
+    Build the response for a request that could not be admitted.
+    
+    Depending on ADMISSION_OVERFLOW, the request is either rejected with
+    429 and a Retry-After header, or queued on Celery and answered with
+    202 and the task ID to poll.
+    """
+    if current_app.config.get('ADMISSION_OVERFLOW') == 'celery':
+        get_admission_controller().record_diverted()
+        return queued_generation_response(template_text, info_text, context_files, retrieval_engine)
+    
+    response = jsonify({"error": str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def queued_generation_response(template_text, info_text, context_files, retrieval_engine=None, priority='interactive'):
+    """Queue the generation as a Celery task and answer 202 with the task ID to poll."""
+    from app.tasks import enqueue_generation
+    context_texts = read_context_files(context_files)
+    task_id = enqueue_generation(template_text, info_text, context_texts, priority=priority,
+                                 retrieval_engine=retrieval_engine)
+    
+    status_url = url_for('api.task_status', task_id=task_id)
+    response = jsonify({"task_id": task_id, "status_url": status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+def render_result(result, output_format, result_id=None):
+    """Return the generated document as JSON text or as a DOCX/PDF download."""
+    if output_format in ('docx', 'pdf'):
+        return file_result(document_file(result, output_format, result_id), output_format)
+    return jsonify({"result": result})
+
+def file_result(file_data, output_format):
+    """Send a rendered DOCX or PDF file as a download."""
+    if output_format == 'docx':
+        return send_file_response(file_data, 'generated_document.docx', 
+                                 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+    return send_file_response(file_data, 'generated_document.pdf', 'application/pdf')
 
 def send_file_response(file_data, filename, mimetype):
     """Helper function to send file as response from the API."""
@@ -1,16 +1,35 @@
 import io
-from flask import render_template, request, redirect, url_for, flash, session, send_file, current_app
+from flask import render_template, request, redirect, url_for, flash, session, send_file, current_app, jsonify
 from werkzeug.utils import secure_filename
 
 from . import main_bp
-from app.services.file_processor import read_uploaded_file, process_context_files
-from app.services.document_generator import generate_document, generate_docx, generate_pdf
-# At the top of the routes.py file, with other imports
-import threading
-import uuid
+from app.services.file_processor import read_uploaded_file, read_context_files, compute_file_digest
+from app.services.document_generator import generate_document_with_context, document_file
+from app.services.result_store import get_result_store
+from app.services.rendering import new_renderer, rendering, save_renditions
+from app.services.semantic_cache import run_with_semantic_cache
+from app.services.single_flight import fingerprint_request, get_single_flight
+from app.services.admission import get_admission_controller, AdmissionRejected
+from app.services.retrieval import RETRIEVAL_ENGINES
 
-# Define the dictionary to store background tasks
-background_tasks = {}
+def load_task(task_id):
+    """
+    Load a background task record from the shared result store.
+
+    Task records hold the task status and, once finished, the result ID of the
+    generated document rather than the document itself.
+
+    Args:
+        task_id (str): The background task ID.
+
+    Returns:
+        dict: The task record, or None if it is unknown or expired.
+    """
+    return get_result_store().get(f"task:{task_id}")
+
+def load_task_document(task):
+    """Return the generated document referenced by a finished task record."""
+    return get_result_store().get(task.get('result_id'))
 
 @main_bp.route('/')
 def index():
@@ -43,32 +62,104 @@ def generate():
 
     # Process additional context documents if provided
     context_files = request.files.getlist('context_files')
-    retrieved_docs = process_context_files(context_files, template_text)
+    retrieval_engine = request.form.get('retrieval_engine') or None
+    if retrieval_engine and retrieval_engine not in RETRIEVAL_ENGINES:
+        flash("Invalid retrieval engine requested.")
+        return redirect(url_for('main.index'))
     
-    # Generate the final document using the provided files and any retrieved context
-    final_document = generate_document(template_text, info_text, context_chunks=retrieved_docs)
+    # Wait for a generation slot, or shed load if the instance is saturated
+    admission = get_admission_controller()
+    try:
+        slot = admission.acquire()
+    except AdmissionRejected as e:
+        return admission_overflow_response(e, template_text, info_text, context_files, retrieval_engine)
+    
+    try:
+        context_digests = [compute_file_digest(f) for f in context_files if f.filename]
+        
+        # Generate the final document using the provided files and any retrieved context;
+        # identical submissions already in flight share that generation's result.
+        # The download files are rendered from the completion as it streams in.
+        params = {'retrieval_engine': retrieval_engine}
+        key = fingerprint_request(template_text, info_text, context=context_digests, params=params)
+        renderer = new_renderer()
+        with rendering(renderer):
+            # Near-duplicates of earlier sources may be served from the semantic cache
+            final_document = run_with_semantic_cache(
+                template_text, info_text,
+                lambda: get_single_flight().run(
+                    key, generate_document_with_context, template_text, info_text, context_files, retrieval_engine
+                ),
+                context=context_digests, params=params
+            )
+    except Exception as e:
+        current_app.logger.error(f"Error generating document: {str(e)}")
+        flash(f"Error generating document: {str(e)}")
+        return redirect(url_for('main.index'))
+    finally:
+        admission.release(slot)
 
-    # Store the generated document in session for download
-    session['final_document'] = final_document
+    # Store the generated document server-side and keep only its ID in the session
+    session['result_id'] = get_result_store().put(final_document)
+    if renderer is not None:
+        save_renditions(session['result_id'], renderer.finish(final_document))
     return render_template('result.html', document=final_document)
 
+def admission_overflow_response(error, template_text, info_text, context_files, retrieval_engine=None):
+    """
+    Build the response for a generation that could not be admitted.
+    
+    Depending on ADMISSION_OVERFLOW, the request is either rejected with 503
+    and a Retry-After header, or queued on Celery and redirected to the
+    status page.
+    """
+    if current_app.config.get('ADMISSION_OVERFLOW') == 'celery':
+        from app.tasks import enqueue_generation
+        context_texts = read_context_files(context_files)
+        task_id = enqueue_generation(template_text, info_text, context_texts, retrieval_engine=retrieval_engine)
+        get_admission_controller().record_diverted()
+        return redirect(url_for('main.generation_status', task_id=task_id))
+    
+    message = f"{error} Please try again in {error.retry_after} seconds."
+    return message, 503, {'Retry-After': str(error.retry_after)}
+
+@main_bp.route('/status/<task_id>')
+def generation_status(task_id):
+    """Show the progress page for a background generation task."""
+    if load_task(task_id) is None:
+        flash("Invalid task ID or task has expired.")
+        return redirect(url_for('main.index'))
+    return render_template('status.html', task_id=task_id)
+
+@main_bp.route('/status/<task_id>/poll')
+def task_status(task_id):
+    """Report the progress of a background generation task as JSON for the status page."""
+    task = load_task(task_id)
+    if task is None:
+        return jsonify({'status': 'error', 'progress': 100, 'message': "Invalid task ID or task has expired."})
+    
+    response = {'status': task['status'], 'progress': task['progress'], 'message': task['message']}
+    if task['status'] == 'done':
+        response['redirect_url'] = url_for('main.display_result', task_id=task_id)
+    return jsonify(response)
+
 @main_bp.route('/download')
 def download():
     """
     Download the generated document as either a DOCX file or a PDF file.
     """
     filetype = request.args.get('filetype', 'docx').lower()
-    final_document = session.get('final_document')
+    final_document = get_result_store().get(session.get('result_id'))
     if not final_document:
         flash("No document available for download.")
         return redirect(url_for('main.index'))
     
     if filetype == 'docx':
-        file_data = generate_docx(final_document)
+        file_data = document_file(final_document, 'docx', session.get('result_id'))
         return send_file(file_data, as_attachment=True, download_name="generated_document.docx", 
                          mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
     elif filetype == 'pdf':
-        file_data = generate_pdf(final_document)
+        file_data = document_file(final_document, 'pdf', session.get('result_id'))
         return send_file(file_data, as_attachment=True, download_name="generated_document.pdf", 
                          mimetype="application/pdf")
     else:
@@ -78,40 +169,45 @@ def download():
 @main_bp.route('/result/<task_id>')
 def display_result(task_id):
     """Display the result of a completed document generation task."""
-    if task_id not in background_tasks:
+    task = load_task(task_id)
+    if task is None:
         flash("Invalid task ID or task has expired.")
         return redirect(url_for('main.index'))
     
-    task = background_tasks[task_id]
     if task['status'] != 'done':
         return redirect(url_for('main.generation_status', task_id=task_id))
     
-    # Store the final document in session for download
-    session['final_document'] = task['result']
+    final_document = load_task_document(task)
+    if final_document is None:
+        flash("The generated document has expired.")
+        return redirect(url_for('main.index'))
+    
+    # Keep only the result ID in the session for download
+    session['result_id'] = task['result_id']
     
-    return render_template('result.html', document=task['result'])
+    return render_template('result.html', document=final_document)
 
 @main_bp.route('/download/<task_id>')
 def download_result(task_id):
     """Download the generated document for a specific task."""
-    if task_id not in background_tasks:
+    task = load_task(task_id)
+    if task is None:
         flash("Invalid task ID or task has expired.")
         return redirect(url_for('main.index'))
     
-    task = background_tasks[task_id]
-    if task['status'] != 'done' or not task['result']:
+    final_document = load_task_document(task) if task['status'] == 'done' else None
+    if not final_document:
         flash("Document generation is not complete.")
         return redirect(url_for('main.generation_status', task_id=task_id))
     
     filetype = request.args.get('filetype', 'docx').lower()
-    final_document = task['result']
     
     if filetype == 'docx':
-        file_data = generate_docx(final_document)
+        file_data = document_file(final_document, 'docx', task['result_id'])
         return send_file(file_data, as_attachment=True, download_name="generated_document.docx", 
                          mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
     elif filetype == 'pdf':
-        file_data = generate_pdf(final_document)
+        file_data = document_file(final_document, 'pdf', task['result_id'])
         return send_file(file_data, as_attachment=True, download_name="generated_document.pdf", 
                          mimetype="application/pdf")
     else:
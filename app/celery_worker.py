@@ -1,6 +1,8 @@
 from celery import Celery
+from kombu import Queue
 import os
 from dotenv import load_dotenv
+from app.services.task_routing import GENERATION_QUEUES, DEFAULT_GENERATION_QUEUE
 
 # Load environment variables
 load_dotenv()
@@ -29,7 +31,12 @@ def make_celery(app_name=__name__):
         result_expires=3600,  # Results expire after 1 hour
         task_acks_late=True,  # Tasks acknowledged after execution
         task_time_limit=600,  # 10 minutes timeout
-        worker_prefetch_multiplier=1  # Prefetch one task at a time
+        task_soft_time_limit=570,  # Leaves time to checkpoint and retry before the hard limit
+        task_reject_on_worker_lost=True,  # Redeliver tasks whose worker died; they resume from checkpoints
+        worker_prefetch_multiplier=1,  # Prefetch one task at a time
+        # Generations are routed by priority and size; run a worker pool per queue (see Procfile)
+        task_queues=[Queue(name) for name in GENERATION_QUEUES],
+        task_default_queue=DEFAULT_GENERATION_QUEUE
     )
     
     return celery
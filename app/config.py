@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,11 +9,148 @@ class Config:
     """Base configuration class."""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your_secret_key')
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # e.g. a local stub server for load tests
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # Increased to 50MB max upload size
+    UPLOAD_SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 1024 * 1024))  # Larger uploads are spooled to UPLOAD_FOLDER
     SESSION_TYPE = 'filesystem'
     SESSION_PERMANENT = False
     PERMANENT_SESSION_LIFETIME = 1800  # 30 minutes
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    # Generated documents live in a shared result store; sessions only keep the result ID
+    RESULT_STORE_BACKEND = os.environ.get('RESULT_STORE_BACKEND', 'filesystem')  # 'filesystem' or 'redis'
+    RESULT_STORE_DIR = os.environ.get('RESULT_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results'))
+    RESULT_TTL = int(os.environ.get('RESULT_TTL', 1800))  # 30 minutes
+    RESULT_COMPRESSION_LEVEL = 6
+    RESULT_PURGE_INTERVAL = int(os.environ.get('RESULT_PURGE_INTERVAL', 600))  # Seconds between purges of expired files; 0 disables
+    # Celery task inputs are passed as references to compressed blobs; the directory must be shared with the workers
+    BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blobs'))
+    BLOB_TTL = int(os.environ.get('BLOB_TTL', 86400))
+    BLOB_COMPRESSION_LEVEL = 6
+    BLOB_PURGE_INTERVAL = int(os.environ.get('BLOB_PURGE_INTERVAL', 3600))  # Seconds between purges of expired blobs; 0 disables
+    # Identical concurrent generations share one computation, across every worker when Redis is configured
+    SINGLE_FLIGHT_BACKEND = os.environ.get('SINGLE_FLIGHT_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')  # 'local' or 'redis'
+    SINGLE_FLIGHT_LOCK_TTL = 900  # Longer than the Celery task time limit
+    SINGLE_FLIGHT_RESULT_TTL = 60
+    SINGLE_FLIGHT_POLL_INTERVAL = 0.5
+    # Import the generation pipeline at startup instead of on the first request
+    WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'false').lower() == 'true'
+    # Admission control for generation requests, shared by all workers on this host
+    MAX_CONCURRENT_GENERATIONS = int(os.environ.get('MAX_CONCURRENT_GENERATIONS', 4))
+    MAX_QUEUED_GENERATIONS = int(os.environ.get('MAX_QUEUED_GENERATIONS', 8))
+    ADMISSION_QUEUE_TIMEOUT = int(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30))  # Seconds a request may wait for a slot
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 30))
+    ADMISSION_OVERFLOW = os.environ.get('ADMISSION_OVERFLOW', 'reject')  # 'reject' or 'celery'
+    ADMISSION_DIR = os.environ.get('ADMISSION_DIR', os.path.join(tempfile.gettempdir(), 'document-generator-admission'))
+    TASK_LONG_TOKENS = int(os.environ.get('TASK_LONG_TOKENS', 30000))  # Celery jobs above this go to the *_long queues
+    CHECKPOINT_TTL = int(os.environ.get('CHECKPOINT_TTL', 86400))  # Seconds task checkpoints are kept
+    TASK_MAX_RESUMES = int(os.environ.get('TASK_MAX_RESUMES', 5))  # Retries after the soft time limit
+    # Requests carrying this token in X-Profile-Token are profiled; unset disables profiling
+    PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')
+    PROFILE_TTL = int(os.environ.get('PROFILE_TTL', 86400))
+    # Per-stage peak memory with tracemalloc, reported by /api/metrics; slows generation, so for sizing runs
+    MEMORY_TRACKING = os.environ.get('MEMORY_TRACKING', 'false').lower() == 'true'
+    MEMORY_TRACKING_FRAMES = 1  # Traceback depth kept per allocation
+    # Near-duplicate source documents (MinHash similarity) share generated documents; off unless enabled
+    SEMANTIC_CACHE = os.environ.get('SEMANTIC_CACHE', 'false').lower() == 'true'
+    SEMANTIC_CACHE_TEMPLATES = [t for t in os.environ.get('SEMANTIC_CACHE_TEMPLATES', '').split(',') if t]  # Template IDs, or '*'
+    SEMANTIC_CACHE_BACKEND = os.environ.get('SEMANTIC_CACHE_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')  # 'local' or 'redis'
+    # Templates whose cached documents may be served as is; others only get them as a reference, since a
+    # near-duplicate source can still differ in a name or amount that the cached document would repeat
+    SEMANTIC_CACHE_SERVE_TEMPLATES = [t for t in os.environ.get('SEMANTIC_CACHE_SERVE_TEMPLATES', '').split(',') if t]
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95))  # Served as is at or above this
+    SEMANTIC_CACHE_SEED_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_SEED_THRESHOLD', 0.8))  # Offered as a reference above this
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 10000))  # Least recently used are evicted
+    SEMANTIC_CACHE_TTL = int(os.environ.get('SEMANTIC_CACHE_TTL', 604800))
+    SEMANTIC_CACHE_NUM_PERM = 128
+    SEMANTIC_CACHE_BANDS = 16  # 16 bands of 8 rows find pairs above ~0.7 similarity as candidates
+    # Download formats rendered while the document streams in; others are rendered on download.
+    # A PDF can only be laid out once the whole text is in, so adding 'pdf' moves its layout onto
+    # the end of every generation whether or not it is downloaded.
+    RENDER_FORMATS = [fmt for fmt in os.environ.get('RENDER_FORMATS', 'docx').split(',') if fmt]
+    # Chat model and sampling settings per pipeline stage. A stage's routes override its defaults
+    # for prompts of at least min_input_tokens (estimated); see route_model.
+    MODEL_ROUTES = {
+        # One call per chunk of a long document: many small, parallel calls
+        'map': {
+            'model': os.environ.get('MAP_MODEL', 'gpt-4o-mini'),
+            'temperature': 0.5,
+            'max_tokens': 1024,
+        },
+        'summarize': {
+            'model': os.environ.get('SUMMARIZE_MODEL', 'gpt-4o-mini'),
+            'temperature': 0.5,
+            'max_tokens': 2000,
+            'routes': [
+                {'min_input_tokens': int(os.environ.get('SUMMARIZE_LARGE_INPUT_TOKENS', 12000)),
+                 'model': os.environ.get('SUMMARIZE_LARGE_MODEL', 'gpt-4o')},
+            ],
+        },
+        'generate': {
+            'model': os.environ.get('GENERATE_MODEL', 'gpt-4o'),
+            'temperature': 0.7,
+            'max_tokens': 8192,
+        },
+    }
+    # Bulk mode of app.batch: each pipeline stage goes through the OpenAI Batch API as one round
+    BULK_MAX_REQUESTS_PER_BATCH = int(os.environ.get('BULK_MAX_REQUESTS_PER_BATCH', 50000))  # Batch API input limits
+    BULK_MAX_BATCH_BYTES = int(os.environ.get('BULK_MAX_BATCH_BYTES', 200000000))
+    BULK_POLL_INTERVAL = float(os.environ.get('BULK_POLL_INTERVAL', 30))  # Seconds between batch status checks
+    BULK_COMPLETION_WINDOW = '24h'  # The only window the Batch API accepts
+    # OpenAI quota shared by every web and Celery worker
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'redis' if os.environ.get('REDIS_URL') else 'local')  # 'local' or 'redis'
+    RATE_LIMITS = {
+        'chat': {
+            'rpm': int(os.environ.get('OPENAI_CHAT_RPM', 500)),
+            'tpm': int(os.environ.get('OPENAI_CHAT_TPM', 30000)),
+        },
+        'embeddings': {
+            'rpm': int(os.environ.get('OPENAI_EMBEDDING_RPM', 3000)),
+            'tpm': int(os.environ.get('OPENAI_EMBEDDING_TPM', 1000000)),
+        },
+    }
+    RATE_LIMIT_BATCH_RESERVE = 0.2  # Share of each bucket batch jobs must leave for interactive requests
+    RATE_LIMIT_MAX_WAIT = 120  # Seconds a call may wait for quota before failing
+    RATE_LIMIT_MAX_RETRIES = 3  # Retries after OpenAI answers 429
+    # Context retrieval: 'auto' searches small corpora locally and embeds larger ones
+    RETRIEVAL_ENGINE = os.environ.get('RETRIEVAL_ENGINE', 'auto')  # 'auto', 'vector', 'lexical' or 'hybrid'
+    LEXICAL_MAX_CHUNKS = int(os.environ.get('LEXICAL_MAX_CHUNKS', 50))  # Largest corpus 'auto' keeps local
+    HYBRID_VECTOR_WEIGHT = 0.5  # Vector share of the fused hybrid score
+    # Vector indexes are saved per corpus and memory-mapped by every worker that reuses them
+    VECTOR_INDEX_TYPE = os.environ.get('VECTOR_INDEX_TYPE', 'auto')  # 'auto', 'flat', 'hnsw' or 'ivfpq'
+    VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes'))
+    VECTOR_INDEX_CACHE_SIZE = 8  # Indexes each worker keeps loaded
+    VECTOR_INDEX_TTL = int(os.environ.get('VECTOR_INDEX_TTL', 604800))  # Index files unused this long are deleted
+    VECTOR_INDEX_MAX_BYTES = int(os.environ.get('VECTOR_INDEX_MAX_BYTES', 10 * 1024 ** 3))  # Least recently used beyond this are deleted
+    VECTOR_INDEX_PURGE_INTERVAL = int(os.environ.get('VECTOR_INDEX_PURGE_INTERVAL', 3600))  # Seconds between purges; 0 disables
+    HNSW_MIN_VECTORS = 10000  # 'auto' switches from flat to HNSW at this size
+    IVFPQ_MIN_VECTORS = 200000  # ... and from HNSW to IVF-PQ at this size
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = 64
+    IVF_NLIST = None  # Defaults to 4 * sqrt(number of vectors)
+    IVF_NPROBE = 16
+    IVFPQ_M = 64  # Sub-quantizers; lowered to a divisor of the embedding dimension
+    IVFPQ_NBITS = 8
+    IVF_TRAIN_SIZE = 100000
+    # Retrieved context is de-duplicated and merged into passages within a token budget
+    CONTEXT_PACKING = os.environ.get('CONTEXT_PACKING', 'true').lower() == 'true'
+    CONTEXT_FETCH_K = 20  # Candidate chunks retrieved before packing
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 2000))
+    CONTEXT_MMR_LAMBDA = 0.5  # 1 ranks purely by relevance, 0 purely by diversity
+    CONTEXT_DUPLICATE_THRESHOLD = 0.95  # Cosine similarity treated as a near-duplicate
+    CONTEXT_EXTRACT_WORKERS = int(os.environ.get('CONTEXT_EXTRACT_WORKERS', 4))  # Threads extracting context files
+    # PDF parsing processes per worker, leaving a core free for the worker itself; 0 parses PDFs on the threads
+    CONTEXT_PDF_PROCESSES = int(os.environ.get('CONTEXT_PDF_PROCESSES', min(4, (os.cpu_count() or 1) - 1)))
+    # Chunks are embedded in batches sized to the embeddings API input limits
+    EMBEDDING_BATCH_MAX_TOKENS = 100000
+    EMBEDDING_BATCH_MAX_INPUTS = 1000
+    EMBEDDING_MAX_IN_FLIGHT = int(os.environ.get('EMBEDDING_MAX_IN_FLIGHT', 4))
+    # Long documents up to EXTRACTIVE_MAX_TOKENS are reduced locally instead of map-reduce summarized
+    EXTRACTIVE_SUMMARY = os.environ.get('EXTRACTIVE_SUMMARY', 'true').lower() == 'true'
+    EXTRACTIVE_MAX_TOKENS = int(os.environ.get('EXTRACTIVE_MAX_TOKENS', 20000))
+    EXTRACTIVE_TOKEN_BUDGET = int(os.environ.get('EXTRACTIVE_TOKEN_BUDGET', 3000))
+    EXTRACTIVE_TEMPLATE_WEIGHT = 0.5  # Weight of template similarity against TextRank centrality
 
 
 class DevelopmentConfig(Config):
@@ -29,6 +167,8 @@ class TestingConfig(Config):
     TESTING = True
     # Use a separate upload folder for testing
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_uploads')
+    RESULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_results')
+    BLOB_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_blobs')
 
 
 class ProductionConfig(Config):
@@ -40,6 +180,7 @@ class ProductionConfig(Config):
     # Production server can bind to 0.0.0.0 for public access if needed
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = int(os.environ.get('PORT', 5001))
+    WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'true').lower() == 'true'
 
 
 # Configuration dictionary
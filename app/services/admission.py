@@ -0,0 +1,158 @@
+import os
+import time
+import fcntl
+import threading
+from flask import current_app
+
+class AdmissionRejected(Exception):
+    """Raised when a generation cannot be admitted because the instance is saturated."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Bound the number of concurrent generations on this instance.
+
+    Run and queue slots are lock files shared by every worker process on the
+    host. A slot is held with a non-blocking flock, so the kernel releases it
+    automatically if the holding worker dies. Requests take a run slot if
+    one is free, otherwise wait in one of a bounded number of queue slots,
+    and are rejected when both are full.
+    """
+
+    def __init__(self, directory, max_concurrent, max_queued, queue_timeout, retry_after=30, poll_interval=0.25):
+        self.directory = directory
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        # Counters are per worker process; slot occupancy is instance-wide
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0, 'diverted': 0}
+        self._counter_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _try_lock_single(self, kind, index):
+        fd = os.open(os.path.join(self.directory, f"{kind}-{index}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+    def _try_lock(self, kind, count):
+        for index in range(count):
+            fd = self._try_lock_single(kind, index)
+            if fd is not None:
+                return fd
+        return None
+
+    @staticmethod
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _count(self, name):
+        with self._counter_lock:
+            self.counters[name] += 1
+
+    def acquire(self):
+        """
+        Take a run slot, waiting in the queue if necessary.
+
+        Returns:
+            int: The slot handle to pass to release().
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait timed out.
+        """
+        slot = self._try_lock('run', self.max_concurrent)
+        if slot is not None:
+            self._count('admitted')
+            return slot
+
+        queue_slot = self._try_lock('queue', self.max_queued)
+        if queue_slot is None:
+            self._count('rejected')
+            raise AdmissionRejected("Too many document generations in progress.", self.retry_after)
+
+        self._count('queued')
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                slot = self._try_lock('run', self.max_concurrent)
+                if slot is not None:
+                    self._count('admitted')
+                    return slot
+        finally:
+            self._unlock(queue_slot)
+
+        self._count('timed_out')
+        raise AdmissionRejected("Timed out waiting for a free generation slot.", self.retry_after)
+
+    def release(self, slot):
+        """Give back a run slot obtained from acquire()."""
+        self._unlock(slot)
+
+    def record_diverted(self):
+        """Count a rejected request that was handed to the Celery path instead."""
+        self._count('diverted')
+
+    def _occupied(self, kind, count):
+        # Probe each slot; anything we cannot lock is held by some worker
+        occupied = 0
+        for index in range(count):
+            fd = self._try_lock_single(kind, index)
+            if fd is None:
+                occupied += 1
+            else:
+                self._unlock(fd)
+        return occupied
+
+    def stats(self):
+        """
+        Report slot occupancy for the instance and counters for this worker.
+
+        Returns:
+            dict: Admission metrics.
+        """
+        with self._counter_lock:
+            counters = dict(self.counters)
+        return {
+            'in_flight': self._occupied('run', self.max_concurrent),
+            'queue_depth': self._occupied('queue', self.max_queued),
+            'max_concurrent': self.max_concurrent,
+            'max_queued': self.max_queued,
+            'worker_pid': os.getpid(),
+            'worker_counters': counters,
+        }
+
+# Guards lazy creation so concurrent request threads share one controller
+_init_lock = threading.Lock()
+
+def get_admission_controller():
+    """
+    Return the admission controller for the current application.
+
+    Returns:
+        AdmissionController: The controller configured from the application config.
+    """
+    controller = current_app.extensions.get('admission')
+    if controller is None:
+        with _init_lock:
+            controller = current_app.extensions.get('admission')
+            if controller is None:
+                config = current_app.config
+                controller = AdmissionController(
+                    config['ADMISSION_DIR'],
+                    max_concurrent=config.get('MAX_CONCURRENT_GENERATIONS', 4),
+                    max_queued=config.get('MAX_QUEUED_GENERATIONS', 8),
+                    queue_timeout=config.get('ADMISSION_QUEUE_TIMEOUT', 30),
+                    retry_after=config.get('ADMISSION_RETRY_AFTER', 30)
+                )
+                current_app.extensions['admission'] = controller
+    return controller
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import hashlib
+from app.services.openai_service import estimate_tokens
+
+# Batch statuses after which OpenAI does no more work on a batch
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+CHAT_ENDPOINT = '/v1/chat/completions'
+
+def chat_request(messages, stage_name, config):
+    """
+    Build the body of a batched chat completion, routed like a direct call of the stage.
+
+    Args:
+        messages (list): Chat messages.
+        stage_name (str): Pipeline stage, one of MODEL_STAGES.
+        config (dict): Application configuration.
+
+    Returns:
+        dict: The request body.
+    """
+    from app.services.model_routing import route_model
+    route = route_model(stage_name, sum(estimate_tokens(m['content']) for m in messages), config)
+    return dict(route, messages=messages)
+
+def request_digest(body):
+    """Identify a request body, so saved results are only reused for identical requests."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _write_json(path, value):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def _error_message(line):
+    """Return the error of a failed batch output line."""
+    if line.get('error'):
+        return line['error'].get('message') or line['error'].get('code') or "Request failed"
+    response = line.get('response') or {}
+    error = (response.get('body') or {}).get('error') or {}
+    return error.get('message') or f"Request failed with status {response.get('status_code')}"
+
+class BatchRound:
+    """
+    A set of chat completions run together through the OpenAI Batch API.
+
+    add() the requests, then run() uploads them as JSONL batch files (split
+    by model and by the per-batch limits), creates a batch for each file,
+    polls until every batch has finished and downloads the results.
+
+    Submitted batch IDs and collected results are saved under state_dir as
+    <name>.batches.json and <name>.results.jsonl, so an interrupted run
+    picks up polling where it stopped instead of submitting (and paying for)
+    the requests again. Saved results are only reused for requests with the
+    same body; failed requests are submitted again.
+    """
+
+    def __init__(self, client, name, state_dir, max_requests=50000, max_bytes=200000000,
+                 completion_window='24h', poll_interval=30, log=print):
+        self.client = client
+        self.name = name
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+        self.log = log
+        self.requests = {}
+        self._batches_path = os.path.join(state_dir, f"{name}.batches.json")
+        self._results_path = os.path.join(state_dir, f"{name}.results.jsonl")
+        os.makedirs(state_dir, exist_ok=True)
+
+    def add(self, custom_id, body):
+        """Queue a chat completion request body under a custom ID unique within the round."""
+        self.requests[custom_id] = body
+
+    def run(self):
+        """
+        Run the queued requests to completion.
+
+        Returns:
+            dict: Custom ID to a dict with 'content' and 'usage' for successful
+            requests, or 'error' for failed ones.
+        """
+        if not self.requests:
+            return {}
+        digests = {custom_id: request_digest(body) for custom_id, body in self.requests.items()}
+        results = {}
+        for record in self._load_results():
+            if digests.get(record['custom_id']) == record['digest'] and 'error' not in record:
+                results[record['custom_id']] = record
+
+        batches = self._load_batches()
+        in_flight = {
+            custom_id
+            for batch in batches if not batch['collected']
+            for custom_id, digest in batch['requests'].items() if digests.get(custom_id) == digest
+        }
+        to_submit = [custom_id for custom_id in self.requests if custom_id not in results and custom_id not in in_flight]
+        self.log(f"Round {self.name}: {len(self.requests)} requests, {len(results)} already done, "
+                 f"{len(in_flight)} in submitted batches, {len(to_submit)} to submit")
+
+        for custom_ids in self._split(to_submit):
+            batches.append(self._submit(custom_ids, digests, len(batches)))
+            # Saved straight away, so a crash after this point resumes polling instead of paying again
+            _write_json(self._batches_path, batches)
+
+        outstanding = [batch for batch in batches if not batch['collected']]
+        while outstanding:
+            still_running = []
+            progress = {'completed': 0, 'failed': 0, 'total': 0}
+            for batch in outstanding:
+                remote = self.client.batches.retrieve(batch['id'])
+                if remote.status in TERMINAL_STATUSES:
+                    for record in self._collect(batch, remote):
+                        if digests.get(record['custom_id']) == record['digest']:
+                            results[record['custom_id']] = record
+                    batch['collected'] = True
+                    _write_json(self._batches_path, batches)
+                else:
+                    still_running.append(batch)
+                    counts = remote.request_counts
+                    if counts is not None:
+                        for key in progress:
+                            progress[key] += getattr(counts, key) or 0
+            outstanding = still_running
+            if outstanding:
+                self.log(f"Round {self.name}: {len(outstanding)} batches running, "
+                         f"{progress['completed'] + progress['failed']}/{progress['total']} requests processed")
+                time.sleep(self.poll_interval)
+
+        for custom_id in self.requests:
+            results.setdefault(custom_id, {'custom_id': custom_id, 'error': "No result returned by the batch"})
+        return {custom_id: results[custom_id] for custom_id in self.requests}
+
+    def _split(self, custom_ids):
+        """Group requests into batch files: one model per file, within the request and size limits."""
+        by_model = {}
+        for custom_id in custom_ids:
+            by_model.setdefault(self.requests[custom_id].get('model'), []).append(custom_id)
+        for group in by_model.values():
+            current, size = [], 0
+            for custom_id in group:
+                line_size = len(self._line(custom_id))
+                if current and (len(current) >= self.max_requests or size + line_size > self.max_bytes):
+                    yield current
+                    current, size = [], 0
+                current.append(custom_id)
+                size += line_size
+            if current:
+                yield current
+
+    def _line(self, custom_id):
+        return json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': CHAT_ENDPOINT,
+                           'body': self.requests[custom_id]}).encode('utf-8') + b"\n"
+
+    def _submit(self, custom_ids, digests, number):
+        data = b"".join(self._line(custom_id) for custom_id in custom_ids)
+        file = self.client.files.create(file=(f"{self.name}-{number}.jsonl", data), purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=file.id,
+            endpoint=CHAT_ENDPOINT,
+            completion_window=self.completion_window,
+            metadata={'round': self.name},
+        )
+        self.log(f"Round {self.name}: submitted batch {batch.id} with {len(custom_ids)} requests")
+        return {
+            'id': batch.id,
+            'requests': {custom_id: digests[custom_id] for custom_id in custom_ids},
+            'collected': False,
+        }
+
+    def _collect(self, batch, remote):
+        """Download a finished batch's output and error files and save its results."""
+        records = []
+        for file_id in (remote.output_file_id, remote.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                line = json.loads(line)
+                custom_id = line.get('custom_id')
+                if custom_id not in batch['requests']:
+                    continue
+                record = {'custom_id': custom_id, 'digest': batch['requests'][custom_id]}
+                response = line.get('response') or {}
+                if response.get('status_code') == 200 and not line.get('error'):
+                    body = response['body']
+                    record.update(content=body['choices'][0]['message']['content'], usage=body.get('usage'))
+                else:
+                    record['error'] = _error_message(line)
+                records.append(record)
+
+        # Requests an expired, cancelled or failed batch never ran
+        returned = {record['custom_id'] for record in records}
+        reason = f"Batch {remote.id} {remote.status}"
+        if remote.errors is not None and remote.errors.data:
+            reason = f"{reason}: {remote.errors.data[0].message}"
+        records.extend({'custom_id': custom_id, 'digest': digest, 'error': reason}
+                       for custom_id, digest in batch['requests'].items() if custom_id not in returned)
+
+        with open(self._results_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        failed = sum(1 for record in records if 'error' in record)
+        self.log(f"Round {self.name}: batch {remote.id} {remote.status}, {len(records) - failed} succeeded, {failed} failed")
+        return records
+
+    def _load_batches(self):
+        if not os.path.exists(self._batches_path):
+            return []
+        with open(self._batches_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load_results(self):
+        if not os.path.exists(self._results_path):
+            return []
+        with open(self._results_path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import zlib
+import hashlib
+import tempfile
+import threading
+from flask import current_app
+from app.services.result_store import PurgeScheduler
+
+# References look like "blob:<sha256 hex>" so they can travel in place of the text itself
+_REF_PATTERN = re.compile(r"^blob:([0-9a-f]{64})$")
+
+def is_blob_ref(value):
+    """Return True if value is a blob reference rather than literal content."""
+    return isinstance(value, str) and _REF_PATTERN.match(value) is not None
+
+class BlobStore:
+    """
+    Content-addressed store of compressed texts in a local directory.
+
+    Texts are stored once under their SHA-256 digest, so storing the same
+    template or document again costs nothing. Entries expire ttl seconds
+    after they were last stored, and are deleted by a background purge
+    started from put() at most every purge_interval seconds.
+    """
+
+    def __init__(self, directory, ttl=86400, compression_level=6, purge_interval=3600):
+        self.directory = directory
+        self.ttl = ttl
+        self.compression_level = compression_level
+        self._purge = PurgeScheduler(self.purge_expired, purge_interval)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, text):
+        """
+        Store a text and return its reference.
+
+        Args:
+            text (str): The content to store.
+
+        Returns:
+            str: A reference of the form "blob:<sha256>".
+        """
+        self._purge.maybe_run()
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        try:
+            # Already stored; refresh its age so it outlives this reference
+            os.utime(path)
+            return f"blob:{digest}"
+        except FileNotFoundError:
+            # Not stored yet, or purged just now; write it below
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(data, self.compression_level))
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return f"blob:{digest}"
+
+    def get(self, ref):
+        """
+        Fetch the text behind a reference.
+
+        Args:
+            ref (str): A reference returned by put().
+
+        Returns:
+            str: The stored text.
+
+        Raises:
+            KeyError: If the blob is missing or has been purged.
+        """
+        match = _REF_PATTERN.match(ref or '')
+        if match is None:
+            raise ValueError(f"Not a blob reference: {ref!r}")
+        try:
+            with open(self._path(match.group(1)), 'rb') as f:
+                return zlib.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            raise KeyError(f"Blob {ref} is missing or expired")
+
+    def resolve(self, value):
+        """Return the text behind value if it is a reference, otherwise value itself."""
+        return self.get(value) if is_blob_ref(value) else value
+
+    def purge_expired(self):
+        """
+        Delete blobs not stored for longer than the TTL.
+
+        Returns:
+            int: The number of blobs removed.
+        """
+        removed = 0
+        cutoff = time.time() - self.ttl
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+# Guards lazy creation so concurrent request threads share one store
+_init_lock = threading.Lock()
+
+def get_blob_store():
+    """
+    Return the blob store for the current application, creating it on first use.
+
+    Returns:
+        BlobStore: The store rooted at BLOB_STORE_DIR.
+    """
+    store = current_app.extensions.get('blob_store')
+    if store is None:
+        with _init_lock:
+            store = current_app.extensions.get('blob_store')
+            if store is None:
+                config = current_app.config
+                store = BlobStore(
+                    config['BLOB_STORE_DIR'],
+                    ttl=config.get('BLOB_TTL', 86400),
+                    compression_level=config.get('BLOB_COMPRESSION_LEVEL', 6),
+                    purge_interval=config.get('BLOB_PURGE_INTERVAL', 3600)
+                )
+                current_app.extensions['blob_store'] = store
+    return store
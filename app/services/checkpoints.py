@@ -0,0 +1,84 @@
+import contextvars
+from contextlib import contextmanager
+
+# Checkpoint of the task running in the current context, if any
+_current_checkpoint = contextvars.ContextVar('current_checkpoint', default=None)
+
+class TaskCheckpoint:
+    """
+    Named intermediate results of one task, persisted in the result store.
+
+    Each stage or chunk is stored under its own key as soon as it completes,
+    so a retried or redelivered task with the same ID picks up every result
+    that was already paid for.
+    """
+
+    def __init__(self, store, task_id, ttl=86400):
+        self.store = store
+        self.task_id = task_id
+        self.ttl = ttl
+
+    def _key(self, name):
+        return f"checkpoint:{self.task_id}:{name}"
+
+    def get(self, name):
+        """
+        Return the entry saved under name.
+
+        Returns:
+            dict: {'value': ...} if the entry exists, otherwise None.
+        """
+        return self.store.get(self._key(name))
+
+    def put(self, name, value):
+        """Save a JSON-compatible value under name."""
+        self.store.put({'value': value}, result_id=self._key(name), ttl=self.ttl)
+
+@contextmanager
+def checkpointing(checkpoint):
+    """
+    Make checkpoint the active checkpoint for pipeline code run within the block.
+
+    Threads started with submit_with_context inherit it.
+    """
+    token = _current_checkpoint.set(checkpoint)
+    try:
+        yield checkpoint
+    finally:
+        _current_checkpoint.reset(token)
+
+def active_checkpoint():
+    """Return the active TaskCheckpoint, or None outside a checkpointed task."""
+    return _current_checkpoint.get()
+
+def checkpointed(name, fn, *args, encode=None, decode=None, save_if=None, **kwargs):
+    """
+    Return the saved result of a pipeline step, or run it and save the result.
+
+    Without an active checkpoint this simply calls fn.
+
+    Args:
+        name (str): The step name, unique within the task.
+        fn (callable): The step.
+        *args: Positional arguments for fn.
+        encode (callable, optional): Turns fn's result into a JSON-compatible value.
+        decode (callable, optional): Turns a saved value back into fn's result type.
+        save_if (callable, optional): Called with fn's result; a false return leaves it
+            unsaved, for steps that report failure by returning a value.
+        **kwargs: Keyword arguments for fn.
+
+    Returns:
+        fn's result, computed now or restored from the checkpoint.
+    """
+    checkpoint = active_checkpoint()
+    if checkpoint is None:
+        return fn(*args, **kwargs)
+
+    saved = checkpoint.get(name)
+    if saved is not None:
+        return decode(saved['value']) if decode else saved['value']
+
+    value = fn(*args, **kwargs)
+    if save_if is None or save_if(value):
+        checkpoint.put(name, encode(value) if encode else value)
+    return value
@@ -0,0 +1,114 @@
+# Preferred break points, strongest first: paragraphs, lines, sentences, words
+DEFAULT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+class ChunkView:
+    """
+    A chunk of a larger text, stored as an offset and length into the shared text.
+
+    Views stand in for LangChain Document chunks: page_content and metadata
+    are built on access, so a split document holds one copy of its text no
+    matter how many chunks it has. Code that reads page_content gets a
+    transient string that is freed once the call it is passed to returns.
+    """
+
+    __slots__ = ('buffer', 'start', 'length', 'source', 'index')
+
+    def __init__(self, buffer, start, length, source=0, index=0):
+        self.buffer = buffer
+        self.start = start
+        self.length = length
+        self.source = source
+        self.index = index
+
+    @property
+    def end(self):
+        return self.start + self.length
+
+    @property
+    def page_content(self):
+        return self.buffer[self.start:self.start + self.length]
+
+    @property
+    def metadata(self):
+        return {'source': self.source, 'start_index': self.start, 'chunk_index': self.index}
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"ChunkView(source={self.source}, start={self.start}, length={self.length})"
+
+def _break_before(text, start, end, separators):
+    """Return the end of the last separator in the second half of text[start:end], or end if there is none."""
+    lowest = start + (end - start) // 2
+    for separator in separators:
+        position = text.rfind(separator, lowest, end)
+        if position != -1:
+            return position + len(separator)
+    return end
+
+def split_views(text, chunk_size, chunk_overlap, source=0, first_index=0, separators=DEFAULT_SEPARATORS):
+    """
+    Split text into overlapping chunk views without copying it.
+
+    Like RecursiveCharacterTextSplitter, chunks are at most chunk_size
+    characters and end at the strongest separator available in their second
+    half. Consecutive chunks overlap by about chunk_overlap characters, and
+    overlaps start at a word boundary. Leading and trailing whitespace is
+    left out of each view.
+
+    Args:
+        text (str): The text to split.
+        chunk_size (int): Maximum chunk length in characters.
+        chunk_overlap (int): Characters shared by consecutive chunks.
+        source (int): Source number recorded in each view's metadata.
+        first_index (int): Index of the first view, for numbering across several texts.
+        separators (tuple): Break points, strongest first.
+
+    Returns:
+        list: ChunkView objects in text order.
+    """
+    views = []
+    size = len(text)
+    start = 0
+    while start < size:
+        while start < size and text[start].isspace():
+            start += 1
+        if start >= size:
+            break
+        end = min(start + chunk_size, size)
+        if end < size:
+            end = _break_before(text, start, end, separators)
+
+        stop = end
+        while stop > start and text[stop - 1].isspace():
+            stop -= 1
+        views.append(ChunkView(text, start, stop - start, source, first_index + len(views)))
+        if end >= size:
+            break
+
+        next_start = max(end - chunk_overlap, start + 1)
+        if next_start < end:
+            boundary = text.find(" ", next_start, end)
+            next_start = boundary + 1 if boundary != -1 else next_start
+        start = next_start
+    return views
+
+def split_corpus(texts, chunk_size, chunk_overlap, separators=DEFAULT_SEPARATORS):
+    """
+    Split several texts into one list of chunk views, numbered across the corpus.
+
+    Args:
+        texts (list): The texts; each view's source is the position of its text.
+        chunk_size (int): Maximum chunk length in characters.
+        chunk_overlap (int): Characters shared by consecutive chunks.
+        separators (tuple): Break points, strongest first.
+
+    Returns:
+        list: ChunkView objects.
+    """
+    views = []
+    for source, text in enumerate(texts):
+        views.extend(split_views(text, chunk_size, chunk_overlap, source=source, first_index=len(views),
+                                 separators=separators))
+    return views
@@ -0,0 +1,28 @@
+import contextvars
+from flask import current_app
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """
+    Submit a call to an executor so it runs like it would in the calling thread.
+
+    The call gets a copy of the caller's context variables (such as the
+    request priority used for rate limiting) and its own application context
+    for the current app, so current_app and its configuration work inside it.
+
+    Args:
+        executor (concurrent.futures.Executor): A thread pool.
+        fn (callable): The function to call.
+        *args: Positional arguments for fn.
+        **kwargs: Keyword arguments for fn.
+
+    Returns:
+        concurrent.futures.Future: The future of the call.
+    """
+    app = current_app._get_current_object()
+    context = contextvars.copy_context()
+
+    def call():
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    return executor.submit(context.run, call)
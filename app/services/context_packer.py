@@ -0,0 +1,151 @@
+import numpy as np
+from scipy import sparse
+from app.services.retrieval import tokenize
+from app.services.openai_service import estimate_tokens
+
+def tfidf_vectors(texts, query_text):
+    """
+    Build TF-IDF vectors for a handful of texts and a query.
+
+    Used to compare retrieved chunks when no embeddings are available, such
+    as after lexical retrieval.
+
+    Args:
+        texts (list): The chunk texts.
+        query_text (str): The query.
+
+    Returns:
+        tuple: (numpy.ndarray of shape (n, vocabulary), numpy.ndarray query vector)
+    """
+    vocabulary = {}
+    rows, cols = [], []
+    for row, text in enumerate(texts + [query_text]):
+        for token in tokenize(text):
+            rows.append(row)
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+
+    shape = (len(texts) + 1, max(len(vocabulary), 1))
+    counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape).toarray()
+    doc_freq = (counts[:-1] > 0).sum(axis=0)
+    weighted = counts * np.log((1 + len(texts)) / (1 + doc_freq) + 1)
+    return weighted[:-1], weighted[-1]
+
+def _normalise(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+def select_mmr(vectors, query_vector, lambda_mult=0.5, duplicate_threshold=0.95):
+    """
+    Rank candidates by maximal marginal relevance, dropping near-duplicates.
+
+    Each step picks the candidate that best balances similarity to the query
+    against similarity to the candidates already picked. A candidate whose
+    cosine similarity to a picked one reaches duplicate_threshold is dropped.
+
+    Args:
+        vectors (numpy.ndarray): Candidate vectors, shape (n, dim).
+        query_vector (numpy.ndarray): The query vector.
+        lambda_mult (float): 1 ranks purely by relevance, 0 purely by diversity.
+        duplicate_threshold (float): Cosine similarity treated as a duplicate.
+
+    Returns:
+        list: Candidate indices in selection order.
+    """
+    vectors = _normalise(np.asarray(vectors, dtype=np.float32))
+    query_vector = _normalise(np.asarray(query_vector, dtype=np.float32))
+    relevance = vectors @ query_vector
+    similarity = vectors @ vectors.T
+
+    count = len(vectors)
+    max_similarity = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    selected = []
+    while available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        available[best] = False
+        if selected and max_similarity[best] >= duplicate_threshold:
+            continue
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
+
+def merge_spans(spans):
+    """
+    Merge overlapping or touching (start, end) character spans.
+
+    Args:
+        spans (list): (start, end) pairs.
+
+    Returns:
+        list: Disjoint spans sorted by start.
+    """
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def pack_context(docs, context_texts, query_text, token_budget, vectors=None, query_vector=None,
+                 lambda_mult=0.5, duplicate_threshold=0.95):
+    """
+    Turn retrieved chunks into a small set of diverse, contiguous passages.
+
+    Chunks are taken in MMR order, skipping near-duplicates, while the
+    passages fit in the token budget. Chunks from the same source whose
+    character spans overlap (the splitter overlaps neighbours) are merged
+    back into one passage cut from the source text, so shared text is sent
+    only once.
+
+    Args:
+        docs (list): Retrieved Document chunks with 'source' and 'start_index' metadata.
+        context_texts (list): The full text of each context source.
+        query_text (str): The retrieval query.
+        token_budget (int): Maximum estimated tokens of context to return.
+        vectors (numpy.ndarray, optional): Embeddings of docs; TF-IDF vectors are used if omitted.
+        query_vector (numpy.ndarray, optional): Embedding of the query, required with vectors.
+        lambda_mult (float): MMR relevance/diversity trade-off.
+        duplicate_threshold (float): Cosine similarity treated as a duplicate.
+
+    Returns:
+        list: Document passages in source order.
+    """
+    from langchain.docstore.document import Document
+    if not docs:
+        return []
+    if vectors is None:
+        vectors, query_vector = tfidf_vectors([doc.page_content for doc in docs], query_text)
+
+    spans = {}
+    loose = []
+    used_tokens = 0
+    for i in select_mmr(vectors, query_vector, lambda_mult, duplicate_threshold):
+        doc = docs[i]
+        source = doc.metadata.get('source')
+        start = doc.metadata.get('start_index', -1)
+
+        # Chunks whose position in the source is unknown cannot be merged
+        if source is None or start < 0:
+            cost = estimate_tokens(doc.page_content)
+            if used_tokens == 0 or used_tokens + cost <= token_budget:
+                loose.append(doc)
+                used_tokens += cost
+            continue
+
+        candidate = merge_spans(spans.get(source, []) + [(start, start + len(doc.page_content))])
+        added_chars = sum(e - s for s, e in candidate) - sum(e - s for s, e in spans.get(source, []))
+        cost = added_chars // 4
+        # The most relevant chunk is always kept, even if it alone exceeds the budget
+        if used_tokens == 0 or used_tokens + cost <= token_budget:
+            spans[source] = candidate
+            used_tokens += cost
+
+    passages = [
+        Document(page_content=context_texts[source][start:end], metadata={'source': source, 'start_index': start})
+        for source in sorted(spans)
+        for start, end in spans[source]
+    ]
+    return passages + loose
@@ -1,7 +1,107 @@
 import io
+import time
 from flask import current_app
-from app.services.openai_service import generate_completion, get_prompts
+from app.services.openai_service import generate_completion, get_prompts, estimate_tokens, rate_limit_retry_delay
+from app.services.rate_limiter import get_rate_governor
+from app.services.checkpoints import checkpointed
+from app.services.profiling import stage
+from app.services.semantic_cache import active_seed
+from app.services.rendering import active_renderer, render_text, load_rendition
 
+# Prefix of the text compose_document returns instead of raising
+GENERATION_ERROR_PREFIX = "An error occurred while generating the document"
+
+def is_generation_error(text):
+    """Return True if text is the error compose_document returned instead of a document."""
+    return text.startswith(GENERATION_ERROR_PREFIX)
+
+# Chunks of a long document summarized separately in the map stage
+MAP_CHUNK_SIZE = 2000
+MAP_CHUNK_OVERLAP = 300
+
+# Same wording as LangChain's default map_reduce map prompt
+MAP_PROMPT = 'Write a concise summary of the following:\n\n\n"{text}"\n\n\nCONCISE SUMMARY:'
+
+def build_map_messages(chunk_text):
+    """Return the chat messages summarizing one chunk of a long document."""
+    return [{"role": "user", "content": MAP_PROMPT.format(text=chunk_text)}]
+
+def build_summary_messages(template_text, document_text):
+    """Return the chat messages summarizing a document with reference to the template."""
+    prompts = get_prompts()
+    user_prompt = (
+        f"Template:\n{template_text}\n\n"
+        f"Document:\n{document_text}\n\n"
+        "Summary (bullet points):"
+    )
+    return [
+        {"role": "system", "content": prompts.get("summarize_document_prompt")},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def build_generation_messages(template_text, summarized_info, context_chunks=None, seed=None):
+    """
+    Return the chat messages generating the final document.
+    
+    Args:
+        template_text (str): The document template.
+        summarized_info (str): Summary of the original document.
+        context_chunks (list, optional): Retrieved context chunks.
+        seed (str, optional): A previous document for a near-identical source (see the semantic cache).
+        
+    Returns:
+        list: The system and user messages.
+    """
+    prompts = get_prompts()
+    
+    # Join all parts at once so the prompt is built in a single copy
+    parts = ["Template:\n", template_text, "\n\n"]
+    if context_chunks:
+        parts.append("Additional Context:\n")
+        for position, doc in enumerate(context_chunks):
+            parts.extend(("\n" if position else "", doc.page_content))
+        parts.append("\n\n")
+    if seed:
+        # Keeps wording consistent with the earlier document
+        parts.extend(("Previous Document For A Very Similar Source (reuse its wording where the facts are unchanged):\n",
+                      seed, "\n\n"))
+    parts.extend(("Original Document Summary:\n", summarized_info,
+                  "\n\nPlease generate a comprehensive document that provides detailed and thorough content for each section of the template. Aim to be comprehensive rather than brief."))
+    return [
+        {"role": "system", "content": prompts.get("generate_document_from_template_prompt")},
+        {"role": "user", "content": "".join(parts)}
+    ]
+
+def summary_strategy(document_text, LONG_DOC_THRESHOLD=3000):
+    """
+    Decide how a document is reduced before the summary call.
+    
+    Args:
+        document_text (str): The full text of the original document.
+        LONG_DOC_THRESHOLD (int): Character threshold to determine if document is "long".
+        
+    Returns:
+        str: 'full' (summarized as is), 'extractive' (cut down locally, see
+        extract_document) or 'map_reduce' (chunks summarized first, see summarize_long_document).
+    """
+    if len(document_text) <= LONG_DOC_THRESHOLD:
+        return 'full'
+    config = current_app.config
+    if config.get('EXTRACTIVE_SUMMARY', True) and estimate_tokens(document_text) <= config.get('EXTRACTIVE_MAX_TOKENS', 20000):
+        return 'extractive'
+    return 'map_reduce'
+
+def extract_document(document_text, template_text):
+    """Cut a medium-length document down locally so a single LLM call can summarize it."""
+    from app.services.extractive import extract_summary
+    config = current_app.config
+    return extract_summary(
+        document_text, template_text,
+        token_budget=config.get('EXTRACTIVE_TOKEN_BUDGET', 3000),
+        template_weight=config.get('EXTRACTIVE_TEMPLATE_WEIGHT', 0.5)
+    )
+
+@stage('map_reduce')
 def summarize_long_document(document_text):
     """
     Summarize a long document using LangChain's text splitter and summarization chain.
@@ -12,37 +112,71 @@ def summarize_long_document(document_text):
     Returns:
         str: A summary of the document.
     """
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain.docstore.document import Document
+    from app.services.chunking import split_views
     
-    # Split the long document into larger chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000,  # Increased from 1000
-        chunk_overlap=300  # Increased from 200
-    )
-    texts = text_splitter.split_text(document_text)
-    
-    # Convert each chunk into a Document object
-    docs = [Document(page_content=t) for t in texts]
+    # Split the long document into larger chunks, kept as views into document_text
+    views = split_views(document_text, chunk_size=MAP_CHUNK_SIZE, chunk_overlap=MAP_CHUNK_OVERLAP)
     
-    # Use the chat-based LLM wrapper for LangChain
+    # Use the chat-based LLM wrapper for LangChain, with the model routed for the map stage by chunk size
     from langchain.chat_models import ChatOpenAI
-    llm = ChatOpenAI(temperature=0.5, model="gpt-4o", openai_api_key=current_app.config.get('OPENAI_API_KEY'))
+    from app.services.model_routing import route_model, get_stage_metrics
+    route = route_model('map', max((estimate_tokens(view.page_content) for view in views), default=0) + 256,
+                        current_app.config)
+    # LangChain's own retries would bypass the rate governor, so 429s are retried in summarize_chunk instead
+    llm = ChatOpenAI(temperature=route['temperature'], model=route['model'], max_tokens=route['max_tokens'],
+                     openai_api_key=current_app.config.get('OPENAI_API_KEY'),
+                     openai_api_base=current_app.config.get('OPENAI_BASE_URL'),
+                     max_retries=0)
     
     # Load a summarization chain (map_reduce is a good choice for long documents)
     from langchain.chains.summarize import load_summarize_chain
     chain = load_summarize_chain(llm, chain_type="map_reduce")
     
     # Process each document chunk individually
+    from openai import RateLimitError
+    governor = get_rate_governor('chat')
+    metrics = get_stage_metrics()
+    max_retries = current_app.config.get('RATE_LIMIT_MAX_RETRIES', 3)
+    
+    @stage('map')
+    def summarize_chunk(view):
+        # Only the chunk being sent is materialised; it is freed once the chain returns
+        doc = Document(page_content=view.page_content)
+        # The chain makes a map call and a combine call for each chunk
+        prompt_tokens = 2 * (estimate_tokens(doc.page_content) + 256)
+        for attempt in range(max_retries + 1):
+            governor.acquire(prompt_tokens, requests=2)
+            started = time.perf_counter()
+            try:
+                summary = chain.run([doc])
+            except RateLimitError as e:
+                # Same handling as generate_completion: every caller pauses for Retry-After
+                metrics.record('map', route['model'], time.perf_counter() - started, prompt_tokens, succeeded=False)
+                if attempt == max_retries:
+                    raise
+                delay = rate_limit_retry_delay(e, attempt)
+                current_app.logger.warning(f"OpenAI rate limit hit in the map stage; pausing {delay:.1f}s before retrying")
+                governor.penalize(delay)
+                continue
+            except Exception:
+                metrics.record('map', route['model'], time.perf_counter() - started, prompt_tokens, succeeded=False)
+                raise
+            # LangChain does not report usage here, so the token counts are estimates
+            metrics.record('map', route['model'], time.perf_counter() - started, prompt_tokens, 2 * estimate_tokens(summary))
+            return summary
+    
     partial_summaries = []
-    for doc in docs:
-        summary = chain.run([doc])
-        partial_summaries.append(summary)
+    for view in views:
+        # Inside a checkpointed task, each chunk summary is saved as soon as it is paid for.
+        # Task inputs are immutable blobs, so a chunk's offsets identify it across retries.
+        partial_summaries.append(checkpointed(f"map:{view.start}:{view.length}", summarize_chunk, view))
     
     # Combine the partial summaries into a single summary
     long_summary = "\n".join(partial_summaries)
     return long_summary
 
+@stage('summarize')
 def summarize_document(document_text, template_text, LONG_DOC_THRESHOLD=3000):
     """
     Summarize the given document text with reference to the template.
@@ -54,37 +188,23 @@ def summarize_document(document_text, template_text, LONG_DOC_THRESHOLD=3000):
         
     Returns:
         str: A summary of the document.
+        
+    Raises:
+        Exception: If the summary call fails after its rate-limit retries. The
+        unsummarized text is not used instead, since it could be far larger
+        than the generation prompt is sized for.
     """
-    if len(document_text) > LONG_DOC_THRESHOLD:
+    strategy = summary_strategy(document_text, LONG_DOC_THRESHOLD)
+    if strategy == 'extractive':
+        # Medium-length documents are cut down locally so a single LLM call can summarize them
+        document_text = extract_document(document_text, template_text)
+    elif strategy == 'map_reduce':
         document_text = summarize_long_document(document_text)
 
-    # Get prompts from application configuration
-    prompts = get_prompts()
+    messages = build_summary_messages(template_text, document_text)
     
-    # Create prompt for summarization
-    system_prompt = prompts.get("summarize_document_prompt")
-    user_prompt = (
-        f"Template:\n{template_text}\n\n"
-        f"Document:\n{document_text}\n\n"
-        "Summary (bullet points):"
-    )
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
-    
-    # Generate summary using OpenAI - increased max tokens
-    try:
-        summary = generate_completion(
-            messages=messages,
-            model="gpt-4o",
-            temperature=0.5,
-            max_tokens=2000  # Increased from 500
-        )
-        return summary
-    except Exception as e:
-        current_app.logger.error(f"Error summarizing document: {e}")
-        return document_text
+    # Generate summary using OpenAI; model, temperature and max_tokens come from MODEL_ROUTES['summarize']
+    return generate_completion(messages=messages, stage_name='summarize')
 
 def generate_document(template_text, info_text, context_chunks=None):
     """
@@ -100,40 +220,147 @@ def generate_document(template_text, info_text, context_chunks=None):
     """
     # Summarize the original document with reference to the template
     summarized_info = summarize_document(info_text, template_text)
+    return compose_document(template_text, summarized_info, context_chunks)
+
+@stage('generate')
+def compose_document(template_text, summarized_info, context_chunks=None):
+    """
+    Generate the final document from the template, the summarized information and any retrieved context.
     
-    # Prepare additional context if available
-    additional_context_text = ""
-    if context_chunks:
-        additional_context_text = "\n".join([doc.page_content for doc in context_chunks])
-    
-    # Get prompts from application configuration
-    prompts = get_prompts()
-    
-    # Create prompt for document generation
-    system_prompt = prompts.get("generate_document_from_template_prompt")
-    user_prompt = f"Template:\n{template_text}\n\n"
-    if additional_context_text:
-        user_prompt += f"Additional Context:\n{additional_context_text}\n\n"
-    user_prompt += f"Original Document Summary:\n{summarized_info}\n\nPlease generate a comprehensive document that provides detailed and thorough content for each section of the template. Aim to be comprehensive rather than brief."
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
+    Args:
+        template_text (str): The document template.
+        summarized_info (str): Summary of the original document from summarize_document.
+        context_chunks (list, optional): A list of Document objects retrieved from additional context files.
+        
+    Returns:
+        str: The generated document.
+    """
+    # A previous document for a near-identical source (see the semantic cache) keeps wording consistent
+    messages = build_generation_messages(template_text, summarized_info, context_chunks, seed=active_seed())
     
-    # Generate document using OpenAI - with increased max tokens
+    # Generate document using OpenAI - with increased max tokens.
+    # Inside a rendering() block the completion is streamed into the DOCX/PDF renderer as it arrives.
+    renderer = active_renderer()
     try:
+        # Model, temperature and max_tokens come from MODEL_ROUTES['generate']
         generated_document = generate_completion(
             messages=messages,
-            model="gpt-4o",
-            temperature=0.7,  # Slight increase for more creative/detailed output
-            max_tokens=8192  # Doubled from 4096 for longer documents
+            stage_name='generate',
+            on_delta=renderer.feed if renderer is not None else None
         )
         return generated_document
     except Exception as e:
+        # Celery's soft time limit (matched by name; the web app runs without Celery): the task
+        # retries and resumes from its checkpoints, so this is not a generation failure
+        if type(e).__name__ == 'SoftTimeLimitExceeded':
+            raise
         current_app.logger.error(f"Error generating document: {str(e)}")
-        return f"An error occurred while generating the document: {str(e)}"
+        return f"{GENERATION_ERROR_PREFIX}: {str(e)}"
+
+def summarize_while_retrieving(template_text, info_text, retrieve):
+    """
+    Summarize the original document while context is retrieved in a background thread.
+    
+    Both stages mostly wait on OpenAI, so running them side by side makes the
+    pipeline take as long as the slower one rather than both combined.
+    
+    Args:
+        template_text (str): The document template.
+        info_text (str): The original document text.
+        retrieve (callable, optional): Returns the retrieved context chunks; None when there is no context.
+        
+    Returns:
+        tuple: (summarized information, retrieved context chunks or None)
+    """
+    if retrieve is None:
+        return checkpointed('summary', summarize_document, info_text, template_text), None
+    
+    from concurrent.futures import ThreadPoolExecutor
+    from app.services.concurrency import submit_with_context
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        retrieval = submit_with_context(
+            executor, checkpointed, 'context', retrieve, encode=encode_chunks, decode=decode_chunks
+        )
+        summarized_info = checkpointed('summary', summarize_document, info_text, template_text)
+        return summarized_info, retrieval.result()
+
+def encode_chunks(chunks):
+    """Turn retrieved Document chunks into JSON-compatible values for checkpoints."""
+    return [{'page_content': doc.page_content, 'metadata': doc.metadata} for doc in chunks or []]
+
+def decode_chunks(values):
+    """Rebuild Document chunks saved by encode_chunks."""
+    from langchain.docstore.document import Document
+    return [Document(page_content=value['page_content'], metadata=value['metadata']) for value in values]
+
+def generate_document_with_context(template_text, info_text, context_files=None, retrieval_engine=None):
+    """
+    Retrieve relevant chunks from uploaded context files and generate the document.
+    
+    The context files are extracted and searched while the original document
+    is being summarized.
+    
+    Args:
+        template_text (str): The document template.
+        info_text (str): The original document text.
+        context_files (list, optional): Context file objects from the request.
+        retrieval_engine (str, optional): Retrieval engine for the context files.
+        
+    Returns:
+        str: The generated document.
+    """
+    from app.services.file_processor import process_context_files
+    retrieve = None
+    if context_files and context_files[0].filename != "":
+        retrieve = lambda: process_context_files(context_files, template_text, engine=retrieval_engine)
+    summarized_info, retrieved_docs = summarize_while_retrieving(template_text, info_text, retrieve)
+    return compose_document(template_text, summarized_info, context_chunks=retrieved_docs)
+
+def generate_document_from_texts(template_text, info_text, context_texts=None, retrieval_engine=None):
+    """
+    Retrieve relevant chunks from already-extracted context texts and generate the document.
+    
+    The context texts are searched while the original document is being summarized.
+    
+    Args:
+        template_text (str): The document template.
+        info_text (str): The original document text.
+        context_texts (list, optional): Text content of each context file.
+        retrieval_engine (str, optional): Retrieval engine for the context texts.
+        
+    Returns:
+        str: The generated document.
+    """
+    from app.services.file_processor import retrieve_context_chunks
+    retrieve = None
+    if context_texts:
+        retrieve = lambda: retrieve_context_chunks(context_texts, template_text, engine=retrieval_engine)
+    summarized_info, retrieved_docs = summarize_while_retrieving(template_text, info_text, retrieve)
+    # A returned error is not checkpointed, so a retried task generates the document again
+    return checkpointed('document', compose_document, template_text, summarized_info, context_chunks=retrieved_docs,
+                        save_if=lambda document: not is_generation_error(document))
+
+def document_file(text, fmt, result_id=None):
+    """
+    Return a generated document as a DOCX or PDF file.
+    
+    Files rendered while the document was generated are stored with its
+    result (see save_renditions); other documents are rendered now.
+    
+    Args:
+        text (str): The generated document.
+        fmt (str): 'docx' or 'pdf'.
+        result_id (str, optional): Result store ID of the document.
+        
+    Returns:
+        BytesIO: The file.
+    """
+    stored = load_rendition(result_id, fmt)
+    if stored is not None:
+        return stored
+    return generate_docx(text) if fmt == 'docx' else generate_pdf(text)
 
+@stage('render_docx')
 def generate_docx(text):
     """
     Generate a DOCX file from the given text.
@@ -144,16 +371,10 @@ def generate_docx(text):
     Returns:
         BytesIO: An in-memory DOCX file.
     """
-    from docx import Document as DocxDocument
-    doc = DocxDocument()
-    # Add a title and paragraph; customize formatting as needed
-    doc.add_heading("Generated Document", level=1)
-    doc.add_paragraph(text)
-    f = io.BytesIO()
-    doc.save(f)
-    f.seek(0)
-    return f
+    # Same layout as documents rendered while streaming (see StreamingRenderer)
+    return io.BytesIO(render_text(text, 'docx'))
 
+@stage('render_pdf')
 def generate_pdf(text):
     """
     Generate a PDF file from the given text.
@@ -164,10 +385,5 @@ def generate_pdf(text):
     Returns:
         BytesIO: An in-memory PDF file.
     """
-    from weasyprint import HTML
-    # Wrap the text in basic HTML formatting
-    html_str = f"<html><body><h1>Generated Document</h1><pre>{text}</pre></body></html>"
-    pdf = HTML(string=html_str).write_pdf()
-    f = io.BytesIO(pdf)
-    f.seek(0)
-    return f
\ No newline at end of file
+    # Same layout as documents rendered while streaming (see StreamingRenderer)
+    return io.BytesIO(render_text(text, 'pdf'))
\ No newline at end of file
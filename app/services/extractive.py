@@ -0,0 +1,134 @@
+import re
+import numpy as np
+from scipy import sparse
+from app.services.retrieval import tokenize
+from app.services.openai_service import estimate_tokens
+from app.services.profiling import stage
+
+# Sentence ends followed by whitespace, or blank-line separated blocks such as headings
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+def split_sentences(text):
+    """
+    Split text into sentences, treating paragraph breaks as boundaries too.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: Non-empty, stripped sentences in document order.
+    """
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+def _split_oversized(sentences, token_budget):
+    # Blocks without sentence punctuation, such as table rows joined by newlines, fall back to lines
+    units = []
+    for sentence in sentences:
+        if estimate_tokens(sentence) > token_budget and "\n" in sentence:
+            units.extend(line.strip() for line in sentence.split("\n") if line.strip())
+        else:
+            units.append(sentence)
+    return units
+
+def _truncate(text, token_budget):
+    # Longest prefix of text within the token budget
+    end = len(text) * token_budget // estimate_tokens(text)
+    while end > 0 and estimate_tokens(text[:end]) > token_budget:
+        end -= 1
+    return text[:end]
+
+def _tfidf_matrix(texts, extra_texts=()):
+    # L2-normalised sparse TF-IDF rows; extra_texts share the vocabulary but not the IDF
+    vocabulary = {}
+    rows, cols = [], []
+    for row, text in enumerate(list(texts) + list(extra_texts)):
+        for token in tokenize(text):
+            rows.append(row)
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+
+    shape = (len(texts) + len(extra_texts), max(len(vocabulary), 1))
+    counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    counts.sum_duplicates()
+    doc_freq = np.bincount(counts[:len(texts)].indices, minlength=shape[1])
+    idf = np.log((1 + len(texts)) / (1 + doc_freq)).astype(np.float32) + 1
+    weighted = counts.multiply(idf).tocsr()
+
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    weighted = sparse.diags(1 / np.where(norms > 0, norms, 1)) @ weighted
+    return weighted[:len(texts)], weighted[len(texts):]
+
+def textrank_scores(similarity, damping=0.85, iterations=50, tolerance=1e-6):
+    """
+    Rank sentences by PageRank over their similarity graph.
+
+    Args:
+        similarity (numpy.ndarray): Symmetric sentence similarity matrix, shape (n, n).
+        damping (float): PageRank damping factor.
+        iterations (int): Maximum power iterations.
+        tolerance (float): Stop once scores change by less than this (L1).
+
+    Returns:
+        numpy.ndarray: One score per sentence, summing to 1.
+    """
+    count = len(similarity)
+    weights = similarity.copy()
+    np.fill_diagonal(weights, 0)
+    out_degree = weights.sum(axis=1, keepdims=True)
+    # Sentences sharing no words with any other spread their rank uniformly
+    transition = np.where(out_degree > 0, weights / np.where(out_degree > 0, out_degree, 1), 1.0 / count)
+
+    scores = np.full(count, 1.0 / count)
+    for _ in range(iterations):
+        updated = (1 - damping) / count + damping * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < tolerance:
+            return updated
+        scores = updated
+    return scores
+
+def _min_max(values):
+    spread = values.max() - values.min()
+    if spread <= 0:
+        return np.ones_like(values)
+    return (values - values.min()) / spread
+
+@stage('extractive')
+def extract_summary(document_text, template_text, token_budget, template_weight=0.5):
+    """
+    Cut a document down to its most template-relevant sentences, without any LLM call.
+
+    Sentences are scored by TextRank centrality within the document, blended
+    with their TF-IDF similarity to the template, and the best ones that fit
+    in the token budget are returned in their original order. Sentences over
+    the budget are split into their lines; if no sentence fits even then, the
+    best one is cut to the budget rather than returning nothing.
+
+    Args:
+        document_text (str): The document to reduce.
+        template_text (str): The template the summary will be written against.
+        token_budget (int): Maximum estimated tokens of the extract.
+        template_weight (float): Weight of template similarity; centrality gets the remainder.
+
+    Returns:
+        str: The extracted sentences joined by newlines.
+    """
+    sentences = split_sentences(document_text)
+    if not sentences or estimate_tokens(document_text) <= token_budget:
+        return document_text
+    sentences = _split_oversized(sentences, token_budget)
+
+    vectors, template_vector = _tfidf_matrix(sentences, [template_text or ''])
+    similarity = (vectors @ vectors.T).toarray()
+    centrality = textrank_scores(similarity)
+    relevance = (vectors @ template_vector.T).toarray().ravel()
+    scores = (1 - template_weight) * _min_max(centrality) + template_weight * _min_max(relevance)
+
+    selected = []
+    used_tokens = 0
+    for i in np.argsort(-scores, kind='stable'):
+        cost = estimate_tokens(sentences[i])
+        if used_tokens + cost <= token_budget:
+            selected.append(i)
+            used_tokens += cost
+    if not selected:
+        return _truncate(sentences[int(np.argmax(scores))], token_budget)
+    return "\n".join(sentences[i] for i in sorted(selected))
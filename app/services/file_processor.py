@@ -1,6 +1,11 @@
 import os
+import mmap
+import threading
 from werkzeug.utils import secure_filename
 from flask import current_app
+from app.services.openai_service import estimate_tokens
+from app.services.rate_limiter import get_rate_governor
+from app.services.profiling import stage
 
 def read_large_pdf(file_path):
     """
@@ -30,48 +35,93 @@ def read_large_pdf(file_path):
                 
     return "\n".join(text_chunks)
 
+def extract_pdf_text(source):
+    """
+    Extract the text of a PDF, page by page.
+    
+    Args:
+        source: A binary file-like object holding the PDF.
+        
+    Returns:
+        str: The text of every page that has any, one page per line group.
+    """
+    import PyPDF2
+    reader = PyPDF2.PdfReader(source)
+    pages_text = []
+    for page in reader.pages:
+        text = page.extract_text()
+        if text:
+            pages_text.append(text)
+    return "\n".join(pages_text)
+
+def extract_pdf_bytes(data):
+    """Extract the text of a PDF given as bytes; the entry point of PDF extraction processes."""
+    from io import BytesIO
+    return extract_pdf_text(BytesIO(data))
+
+@stage('extract')
 def read_uploaded_file(uploaded_file):
     """
     Read the uploaded file and extract text depending on its file type.
     Supports .txt, .md, .docx, and .pdf files.
     
+    Uploads spooled to disk are parsed through a memory map rather than
+    being read into memory first (see open_upload_view).
+    
     Args:
         uploaded_file: The uploaded file object from request.files.
         
     Returns:
         str: The extracted text content from the file.
     """
+    from app.services.uploads import open_upload_view
     filename = secure_filename(uploaded_file.filename)
     ext = os.path.splitext(filename)[1].lower()
     
-    # For text-based files
-    if ext in ['.txt', '.md']:
-        return uploaded_file.read().decode('utf-8')
-    
-    # For DOCX files
-    elif ext == '.docx':
-        from docx import Document
-        doc = Document(uploaded_file)
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        return "\n".join(full_text)
-    
-    # For PDF files
-    elif ext == '.pdf':
-        import PyPDF2
-        uploaded_file.seek(0)
-        reader = PyPDF2.PdfReader(uploaded_file)
-        pages_text = []
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                pages_text.append(text)
-        return "\n".join(pages_text)
+    with open_upload_view(uploaded_file) as view:
+        # For DOCX files
+        if ext == '.docx':
+            # Streams the XML parts, keeping tables, headers, footers and text boxes
+            from app.services.docx_extractor import extract_docx_text
+            return extract_docx_text(view)
+        
+        # For PDF files
+        elif ext == '.pdf':
+            return extract_pdf_text(view)
+        
+        # For text-based files, and as the fallback for anything else
+        else:
+            if isinstance(view, mmap.mmap):
+                # Decode straight from the mapped pages without an intermediate bytes copy
+                return str(view, 'utf-8')
+            return view.read().decode('utf-8')
+
+def compute_file_digest(uploaded_file, block_size=1024 * 1024):
+    """
+    Compute a SHA-256 digest of an uploaded file's raw bytes.
     
-    # Fallback to reading as text
-    else:
-        return uploaded_file.read().decode('utf-8')
+    Uploads received through SpoolingRequest were hashed as they streamed
+    in, so their digest is returned without reading the file again.
+    
+    Args:
+        uploaded_file: The uploaded file object from request.files.
+        block_size (int): Number of bytes to hash at a time.
+        
+    Returns:
+        str: The hex digest. The file pointer is rewound afterwards.
+    """
+    from app.services.uploads import upload_content_hash
+    content_hash = upload_content_hash(uploaded_file)
+    if content_hash is not None:
+        return content_hash
+    
+    import hashlib
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(block_size), b""):
+        digest.update(block)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
 
 def read_file_content(file_object):
     """
@@ -86,13 +136,14 @@ def read_file_content(file_object):
     """
     return read_uploaded_file(file_object)
 
-def process_context_files(context_files, query_text):
+def process_context_files(context_files, query_text, engine=None):
     """
     Process additional context files uploaded by the user.
     
     Args:
         context_files (list): List of file objects from the request.
         query_text (str): The text to use as a query for similarity search.
+        engine (str, optional): Retrieval engine: 'auto', 'vector', 'lexical' or 'hybrid'.
         
     Returns:
         list: A list of Document objects that are most relevant or an empty list if no context is provided.
@@ -101,29 +152,238 @@ def process_context_files(context_files, query_text):
     if not context_files or context_files[0].filename == "":
         return []
     
-    # Read and extract text from each context file
-    context_texts = []
-    for file in context_files:
-        context_texts.append(read_uploaded_file(file))
-    
-    # Split the text into chunks and convert each chunk into a Document
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from langchain.docstore.document import Document
-    all_context_docs = []
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    for doc_text in context_texts:
-        chunks = text_splitter.split_text(doc_text)
-        for chunk in chunks:
-            all_context_docs.append(Document(page_content=chunk))
-    
-    # Build a vector store from the Document objects and perform similarity search
-    from langchain.embeddings import OpenAIEmbeddings
-    from langchain.vectorstores import FAISS
-    
-    # Get API key from Flask app config
-    api_key = current_app.config.get('OPENAI_API_KEY')
-    
-    embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-    vector_store = FAISS.from_documents(all_context_docs, embeddings)
-    retrieved_docs = vector_store.similarity_search(query_text, k=5)
-    return retrieved_docs
\ No newline at end of file
+    context_texts = read_context_files(context_files)
+    return retrieve_context_chunks(context_texts, query_text, engine=engine)
+
+# Guards lazy creation of the PDF extraction pool
+_pdf_pool_lock = threading.Lock()
+
+def get_pdf_pool():
+    """
+    Return this worker's PDF extraction process pool, or None if CONTEXT_PDF_PROCESSES is 0.
+    
+    The pool is created on first use and kept for the life of the worker.
+    Its processes are started by a fork server, so they never inherit the
+    worker's threads or open connections.
+    
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The pool, or None.
+    """
+    processes = current_app.config.get('CONTEXT_PDF_PROCESSES', 0)
+    if not processes:
+        return None
+    pool = current_app.extensions.get('pdf_pool')
+    if pool is None:
+        with _pdf_pool_lock:
+            pool = current_app.extensions.get('pdf_pool')
+            if pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(method))
+                current_app.extensions['pdf_pool'] = pool
+    return pool
+
+def read_upload_bytes(uploaded_file):
+    """Return an upload's raw bytes, leaving the file rewound."""
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(0)
+    return data
+
+def read_context_files(context_files, max_workers=None):
+    """
+    Extract the text of several uploaded context files in parallel.
+    
+    PyPDF2 is pure Python and holds the GIL, so threads barely overlap PDF
+    parsing. When there are several PDFs, they are parsed in the worker's
+    PDF process pool (see get_pdf_pool), at the cost of copying each PDF's
+    bytes into a process. The other files are read on a thread pool.
+    
+    Args:
+        context_files (list): File objects from the request; entries without a filename are skipped.
+        max_workers (int, optional): Extraction threads; defaults to CONTEXT_EXTRACT_WORKERS.
+        
+    Returns:
+        list: The text of each file, in upload order.
+    """
+    files = [f for f in context_files if f.filename]
+    if len(files) <= 1:
+        return [read_uploaded_file(f) for f in files]
+    
+    from concurrent.futures import ThreadPoolExecutor
+    pdfs = [i for i, f in enumerate(files) if os.path.splitext(secure_filename(f.filename))[1].lower() == '.pdf']
+    pool = get_pdf_pool() if len(pdfs) > 1 else None
+    futures = {}
+    if pool is not None:
+        futures = {i: pool.submit(extract_pdf_bytes, read_upload_bytes(files[i])) for i in pdfs}
+    
+    max_workers = max_workers or current_app.config.get('CONTEXT_EXTRACT_WORKERS', 4)
+    threaded = [i for i in range(len(files)) if i not in futures]
+    texts = [None] * len(files)
+    if threaded:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(threaded))) as executor:
+            for i, text in zip(threaded, executor.map(read_uploaded_file, [files[i] for i in threaded])):
+                texts[i] = text
+    for i, future in futures.items():
+        texts[i] = future.result()
+    return texts
+
+def plan_embedding_batches(texts, max_tokens, max_inputs):
+    """
+    Group texts into embedding requests that stay under the API's input limits.
+    
+    Args:
+        texts (list): Texts to embed.
+        max_tokens (int): Maximum estimated tokens per request.
+        max_inputs (int): Maximum texts per request.
+        
+    Returns:
+        list: (start, end) index ranges, one per request, covering texts in order.
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if i > start and (batch_tokens + tokens > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start, batch_tokens = i, 0
+        batch_tokens += tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+@stage('embed')
+def embed_texts(embeddings, texts, governor, config):
+    """
+    Embed texts in size-aware batches, with a bounded number of requests in flight.
+    
+    Each batch takes its share of the embeddings rate limit before it is
+    sent, so concurrent batches never overrun the quota.
+    
+    Args:
+        embeddings: A LangChain embeddings client.
+        texts (list): Texts to embed.
+        governor (RateGovernor): The embeddings rate governor.
+        config (dict): Application configuration.
+        
+    Returns:
+        numpy.ndarray: float32 vectors, one row per text.
+    """
+    import contextvars
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    
+    batches = plan_embedding_batches(
+        texts,
+        max_tokens=config.get('EMBEDDING_BATCH_MAX_TOKENS', 100000),
+        max_inputs=config.get('EMBEDDING_BATCH_MAX_INPUTS', 1000)
+    )
+    
+    def embed_batch(batch):
+        start, end = batch
+        governor.acquire(sum(estimate_tokens(text) for text in texts[start:end]))
+        return embeddings.embed_documents(texts[start:end])
+    
+    if len(batches) == 1:
+        return np.array(embed_batch(batches[0]), dtype=np.float32)
+    
+    # Each batch runs in a copy of this context so the request priority applies to its rate limiting
+    max_in_flight = min(config.get('EMBEDDING_MAX_IN_FLIGHT', 4), len(batches))
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, embed_batch, batch) for batch in batches]
+        vectors = [vector for future in futures for vector in future.result()]
+    return np.array(vectors, dtype=np.float32)
+
+@stage('retrieve')
+def retrieve_context_chunks(context_texts, query_text, engine=None, k=5):
+    """
+    Retrieve the chunks of already-extracted context texts most relevant to the query.
+    
+    Small corpora are searched locally with BM25; larger ones use OpenAI
+    embeddings and a FAISS index, optionally fused with BM25 (see
+    RETRIEVAL_ENGINE). Vector indexes are persisted per corpus and
+    memory-mapped on reuse (see VECTOR_INDEX_TYPE). With CONTEXT_PACKING,
+    the candidates are de-duplicated, merged into contiguous passages and
+    trimmed to CONTEXT_TOKEN_BUDGET instead of returning the top k chunks.
+    
+    Args:
+        context_texts (list): Text content of each context file.
+        query_text (str): The text to use as a query for similarity search.
+        engine (str, optional): Retrieval engine: 'auto', 'vector', 'lexical' or 'hybrid'.
+        k (int): Number of chunks to retrieve when context packing is off.
+        
+    Returns:
+        list: The most relevant Document passages (ChunkViews when context packing is off),
+        or an empty list if no context is provided.
+    """
+    if not context_texts:
+        return []
+    
+    config = current_app.config
+    packing = config.get('CONTEXT_PACKING', True)
+    fetch_k = config.get('CONTEXT_FETCH_K', 20) if packing else k
+    
+    # Split the texts into chunk views; chunk text is only copied out when it is scored or embedded
+    from app.services.chunking import split_corpus
+    all_context_docs = split_corpus(context_texts, chunk_size=1000, chunk_overlap=200)
+    
+    from app.services.retrieval import choose_retrieval_engine, lexical_search, hybrid_search
+    engine = choose_retrieval_engine(engine, len(all_context_docs), config)
+    candidate_vectors = query_vector = None
+    if engine == 'lexical':
+        candidates = lexical_search(all_context_docs, query_text, k=fetch_k)
+    else:
+        # Embed the chunks into a vector index, unless this corpus was indexed before
+        from langchain.embeddings import OpenAIEmbeddings
+        from app.services.vector_index import (choose_index_type, build_index, corpus_key, get_index_cache,
+                                               search_index, reconstruct_vectors)
+        
+        # Get API key from Flask app config
+        api_key = config.get('OPENAI_API_KEY')
+        
+        # One embedding request per planned batch (see embed_texts)
+        embeddings = OpenAIEmbeddings(
+            openai_api_key=api_key,
+            openai_api_base=config.get('OPENAI_BASE_URL'),
+            chunk_size=config.get('EMBEDDING_BATCH_MAX_INPUTS', 1000)
+        )
+        governor = get_rate_governor('embeddings')
+        
+        index_type = choose_index_type(None, len(all_context_docs), config)
+        key = corpus_key((doc.page_content for doc in all_context_docs), embeddings.model, index_type)
+        index_cache = get_index_cache()
+        index = index_cache.get(key, config)
+        if index is None:
+            vectors = embed_texts(embeddings, [doc.page_content for doc in all_context_docs], governor, config)
+            index = build_index(vectors, index_type, config)
+            index_cache.put(key, index)
+        
+        governor.acquire(estimate_tokens(query_text))
+        query_vector = embeddings.embed_query(query_text)
+        vector_hits = search_index(index, query_vector, k=max(fetch_k, 20) if engine == 'hybrid' else fetch_k)
+        if engine == 'hybrid':
+            candidates = hybrid_search(
+                vector_hits, all_context_docs, query_text, k=fetch_k,
+                vector_weight=config.get('HYBRID_VECTOR_WEIGHT', 0.5)
+            )
+        else:
+            candidates = [all_context_docs[position] for position, _ in vector_hits]
+        
+        if packing:
+            candidate_vectors = reconstruct_vectors(index, [doc.index for doc in candidates])
+    
+    if not packing:
+        return candidates
+    
+    # Keep diverse, non-overlapping passages within the token budget
+    from app.services.context_packer import pack_context
+    return pack_context(
+        candidates, context_texts, query_text,
+        token_budget=config.get('CONTEXT_TOKEN_BUDGET', 2000),
+        vectors=candidate_vectors,
+        query_vector=query_vector if candidate_vectors is not None else None,
+        lambda_mult=config.get('CONTEXT_MMR_LAMBDA', 0.5),
+        duplicate_threshold=config.get('CONTEXT_DUPLICATE_THRESHOLD', 0.95)
+    )
\ No newline at end of file
@@ -0,0 +1,90 @@
+import threading
+from flask import current_app
+
+# Pipeline stages that call the chat model
+MODEL_STAGES = ('map', 'summarize', 'generate')
+
+def route_model(stage, input_tokens, config):
+    """
+    Choose the model and sampling settings for a pipeline stage.
+
+    Each stage in MODEL_ROUTES has a default model, temperature and
+    max_tokens, and optional size routes: the route with the highest
+    min_input_tokens not above input_tokens overrides the defaults.
+
+    Args:
+        stage (str): One of MODEL_STAGES.
+        input_tokens (int): Estimated prompt tokens of the call.
+        config (dict): Application configuration.
+
+    Returns:
+        dict: 'model', 'temperature' and 'max_tokens' for the call.
+    """
+    settings = config.get('MODEL_ROUTES', {}).get(stage, {})
+    chosen = {
+        'model': settings.get('model', 'gpt-4o'),
+        'temperature': settings.get('temperature', 0.5),
+        'max_tokens': settings.get('max_tokens', 4096),
+    }
+    routes = [route for route in settings.get('routes', []) if input_tokens >= route.get('min_input_tokens', 0)]
+    if routes:
+        route = max(routes, key=lambda route: route.get('min_input_tokens', 0))
+        chosen.update({key: route[key] for key in chosen if key in route})
+    return chosen
+
+class StageMetrics:
+    """Per-stage, per-model call counts, latency and token usage of this worker's chat calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, stage, model, seconds, prompt_tokens=0, completion_tokens=0, succeeded=True):
+        with self._lock:
+            totals = self._totals.setdefault((stage, model), {
+                'calls': 0, 'failed': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                'prompt_tokens': 0, 'completion_tokens': 0,
+            })
+            totals['calls'] += 1
+            totals['failed'] += 0 if succeeded else 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['prompt_tokens'] += prompt_tokens or 0
+            totals['completion_tokens'] += completion_tokens or 0
+
+    def stats(self):
+        """
+        Report the metrics of every stage and model seen by this worker.
+
+        Returns:
+            dict: Stage name to model name to its counters and average latency.
+        """
+        report = {}
+        with self._lock:
+            for (stage, model), totals in self._totals.items():
+                report.setdefault(stage, {})[model] = dict(
+                    totals,
+                    seconds=round(totals['seconds'], 3),
+                    max_seconds=round(totals['max_seconds'], 3),
+                    avg_seconds=round(totals['seconds'] / totals['calls'], 3),
+                )
+        return report
+
+# Guards lazy creation so concurrent request threads share one recorder
+_init_lock = threading.Lock()
+
+def get_stage_metrics():
+    """
+    Return the model call metrics of the current application.
+
+    Returns:
+        StageMetrics: The recorder for this worker.
+    """
+    metrics = current_app.extensions.get('stage_metrics')
+    if metrics is None:
+        with _init_lock:
+            metrics = current_app.extensions.get('stage_metrics')
+            if metrics is None:
+                metrics = StageMetrics()
+                current_app.extensions['stage_metrics'] = metrics
+    return metrics
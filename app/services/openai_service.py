@@ -1,6 +1,8 @@
 import os
+import time
 from openai import OpenAI
 from flask import current_app
+from app.services.profiling import stage
 
 def get_openai_client():
     """
@@ -15,7 +17,7 @@ def get_openai_client():
     if not api_key:
         raise ValueError("The OpenAI API key is not set.")
     
-    return OpenAI(api_key=api_key)
+    return OpenAI(api_key=api_key, base_url=current_app.config.get('OPENAI_BASE_URL'))
 
 def get_prompts():
     """
@@ -29,15 +31,55 @@ def get_prompts():
         raise ValueError("Prompts not loaded in application configuration.")
     return prompts
 
-def generate_completion(messages, model="gpt-4o", temperature=0.5, max_tokens=4096):
+def estimate_tokens(text):
+    """
+    Cheaply estimate the number of tokens in a text (about four characters per token).
+    
+    Args:
+        text (str): The text to measure.
+        
+    Returns:
+        int: The estimated token count.
+    """
+    return len(text) // 4 + 1
+
+def rate_limit_retry_delay(error, attempt):
+    """
+    Work out how long to pause after OpenAI rejected a call with 429.
+    
+    Args:
+        error (openai.RateLimitError): The rate-limit error.
+        attempt (int): Zero-based attempt number, used for exponential backoff.
+        
+    Returns:
+        float: Seconds to wait, from the Retry-After header if present.
+    """
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return float(2 ** attempt)
+
+@stage('completion')
+def generate_completion(messages, model=None, temperature=None, max_tokens=None, on_delta=None, stage_name=None):
     """
     Generate a completion using OpenAI's chat completion API.
     
+    Every call first takes capacity from the shared chat rate governor. If
+    OpenAI still answers 429, all callers are paused for the Retry-After
+    period and the call is retried.
+    
     Args:
         messages (list): List of message dictionaries (role and content).
-        model (str): The model to use for completion.
-        temperature (float): Controls randomness (0 to 1).
-        max_tokens (int): Maximum number of tokens to generate.
+        model (str, optional): The model to use for completion.
+        temperature (float, optional): Controls randomness (0 to 1).
+        max_tokens (int, optional): Maximum number of tokens to generate.
+        on_delta (callable, optional): If given, the completion is streamed and
+            each piece of text is passed to it as it arrives.
+        stage_name (str, optional): Pipeline stage making the call. Settings not
+            given are taken from its MODEL_ROUTES entry for the prompt size, and
+            the call's latency and tokens are recorded under it.
         
     Returns:
         str: The generated content.
@@ -45,15 +87,73 @@ def generate_completion(messages, model="gpt-4o", temperature=0.5, max_tokens=40
     Raises:
         Exception: If an error occurs during the API call.
     """
+    from openai import RateLimitError
+    from app.services.rate_limiter import get_rate_governor
+    from app.services.model_routing import route_model, get_stage_metrics
+    
+    prompt_tokens = sum(estimate_tokens(m['content']) for m in messages)
+    route = route_model(stage_name, prompt_tokens, current_app.config) if stage_name else {}
+    model = model or route.get('model', "gpt-4o")
+    temperature = temperature if temperature is not None else route.get('temperature', 0.5)
+    max_tokens = max_tokens or route.get('max_tokens', 4096)
+    
+    governor = get_rate_governor('chat')
+    # OpenAI counts max_tokens towards the tokens-per-minute limit
+    estimated_tokens = prompt_tokens + max_tokens
+    max_retries = current_app.config.get('RATE_LIMIT_MAX_RETRIES', 3)
+    
+    def record(started, succeeded, usage=None, content=None):
+        # Reported usage when OpenAI returns it, otherwise estimates
+        if stage_name:
+            get_stage_metrics().record(
+                stage_name, model, time.perf_counter() - started,
+                prompt_tokens=usage.prompt_tokens if usage else prompt_tokens,
+                completion_tokens=usage.completion_tokens if usage else estimate_tokens(content or ""),
+                succeeded=succeeded
+            )
+    
     try:
         client = get_openai_client()
-        response = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        return response.choices[0].message.content
+        for attempt in range(max_retries + 1):
+            governor.acquire(estimated_tokens)
+            started = time.perf_counter()
+            try:
+                streaming = on_delta is not None
+                response = client.chat.completions.create(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=streaming,
+                    # The final streamed chunk then carries the token usage
+                    **({'stream_options': {'include_usage': True}} if streaming else {})
+                )
+                if not streaming:
+                    content = response.choices[0].message.content
+                    record(started, True, response.usage, content)
+                    return content
+                
+                parts = []
+                usage = None
+                for chunk in response:
+                    usage = getattr(chunk, 'usage', None) or usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        on_delta(delta)
+                        parts.append(delta)
+                content = "".join(parts)
+                record(started, True, usage, content)
+                return content
+            except RateLimitError as e:
+                record(started, False)
+                if attempt == max_retries:
+                    raise
+                delay = rate_limit_retry_delay(e, attempt)
+                current_app.logger.warning(f"OpenAI rate limit hit; pausing {delay:.1f}s before retrying")
+                governor.penalize(delay)
+            except Exception:
+                record(started, False)
+                raise
     except Exception as e:
         current_app.logger.error(f"Error generating completion: {e}")
-        raise
\ No newline at end of file
+        raise
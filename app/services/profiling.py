@@ -0,0 +1,305 @@
+import io
+import hmac
+import time
+import uuid
+import base64
+import marshal
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+from flask import current_app
+
+# Profile of the request or task running in the current context, if any
+_current_profile = contextvars.ContextVar('current_profile', default=None)
+
+# Allocation mark of the innermost stage measured by the memory tracker in this context
+_current_memory_mark = contextvars.ContextVar('current_memory_mark', default=None)
+
+# Process-wide memory tracker; None unless MEMORY_TRACKING is on (see init_memory_tracking)
+_memory_tracker = None
+
+# Header carrying PROFILING_TOKEN, both to profile a request and to download profiles
+PROFILE_HEADER = 'X-Profile-Token'
+
+class ProfileSession:
+    """
+    A cProfile run of one request or task plus the wall time of each pipeline stage.
+
+    cProfile only sees the thread that started the session. Stages run in
+    other threads (such as context retrieval, see summarize_while_retrieving)
+    still appear in the stage breakdown because submit_with_context copies
+    the active session into them.
+    """
+
+    def __init__(self, label, profile_id=None):
+        self.id = profile_id or uuid.uuid4().hex
+        self.label = label
+        self.created = time.time()
+        self.duration = None
+        self.stages = []
+        self._lock = threading.Lock()
+        self._profiler = cProfile.Profile()
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._profiler.enable()
+
+    def stop(self):
+        self._profiler.disable()
+        self.duration = time.perf_counter() - self._started
+
+    def record_stage(self, name, started, seconds, peak_bytes=None):
+        with self._lock:
+            self.stages.append({
+                'name': name,
+                'offset_seconds': round(started - self._started, 4),
+                'seconds': round(seconds, 4),
+                'peak_bytes': peak_bytes,
+                'thread': threading.current_thread().name,
+            })
+
+    def report(self, top=50):
+        """
+        Summarize the session.
+
+        Stage times are inclusive, so nested stages (a completion within a
+        summary) are counted under both names.
+
+        Args:
+            top (int): Number of functions listed in the cumulative-time table.
+
+        Returns:
+            dict: Session metadata, per-stage breakdown, the formatted profile
+            and the raw pstats data (base64) for tools such as snakeviz.
+        """
+        breakdown = {}
+        for entry in self.stages:
+            totals = breakdown.setdefault(entry['name'], {'calls': 0, 'seconds': 0.0, 'peak_bytes': None})
+            totals['calls'] += 1
+            totals['seconds'] = round(totals['seconds'] + entry['seconds'], 4)
+            if entry.get('peak_bytes') is not None:
+                totals['peak_bytes'] = max(totals['peak_bytes'] or 0, entry['peak_bytes'])
+
+        output = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(top)
+        return {
+            'id': self.id,
+            'label': self.label,
+            'created': self.created,
+            'duration_seconds': round(self.duration, 4) if self.duration is not None else None,
+            'breakdown': breakdown,
+            'stages': self.stages,
+            'stats': output.getvalue(),
+            # Same format as pstats.Stats.dump_stats, so the download opens in any pstats viewer
+            'pstats': base64.b64encode(marshal.dumps(stats.stats)).decode('ascii'),
+        }
+
+class MemoryTracker:
+    """
+    Peak Python heap allocation of each pipeline stage, measured with tracemalloc.
+
+    A stage's peak is the most memory allocated at any point during the
+    stage, above what was allocated when it started; nested stages are
+    included in their parent's peak. tracemalloc's peak is process-wide, so
+    stages running at the same time in other threads blur each other's
+    figures; measure with one generation at a time for exact numbers.
+    Memory held by C libraries such as lxml or FAISS is not traced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peaks = {}
+
+    def enter(self):
+        """Start measuring a stage and return its mark for exit()."""
+        current, peak = tracemalloc.get_traced_memory()
+        parent = _current_memory_mark.get()
+        if parent is not None:
+            # Resetting the peak below would lose the parent's peak so far, so carry it
+            parent[1] = max(parent[1], peak)
+        tracemalloc.reset_peak()
+        mark = [current, 0]
+        return mark, _current_memory_mark.set(mark)
+
+    def exit(self, name, entered):
+        """Finish measuring a stage, record its peak and return it in bytes."""
+        mark, token = entered
+        _, peak = tracemalloc.get_traced_memory()
+        _current_memory_mark.reset(token)
+        peak = max(peak, mark[1])
+        parent = _current_memory_mark.get()
+        if parent is not None:
+            parent[1] = max(parent[1], peak)
+
+        peak_bytes = max(peak - mark[0], 0)
+        with self._lock:
+            totals = self._peaks.setdefault(name, {'calls': 0, 'max_bytes': 0, 'total_bytes': 0})
+            totals['calls'] += 1
+            totals['max_bytes'] = max(totals['max_bytes'], peak_bytes)
+            totals['total_bytes'] += peak_bytes
+        return peak_bytes
+
+    def stats(self):
+        """
+        Report the peak allocation of each stage seen by this process.
+
+        Returns:
+            dict: Stage name to its call count and maximum and average peak in MB.
+        """
+        with self._lock:
+            return {
+                name: {
+                    'calls': totals['calls'],
+                    'max_peak_mb': round(totals['max_bytes'] / 1048576, 2),
+                    'avg_peak_mb': round(totals['total_bytes'] / totals['calls'] / 1048576, 2),
+                }
+                for name, totals in self._peaks.items()
+            }
+
+def active_profile():
+    """Return the active ProfileSession, or None when profiling is off."""
+    return _current_profile.get()
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage for the active profile and measure its peak memory.
+
+    Usable as a context manager or decorator. With neither a profile active
+    nor memory tracking on, it only costs a context variable lookup.
+
+    Args:
+        name (str): The stage name shown in the breakdown.
+    """
+    session = _current_profile.get()
+    tracker = _memory_tracker
+    if session is None and tracker is None:
+        yield
+        return
+    started = time.perf_counter()
+    entered = tracker.enter() if tracker is not None else None
+    try:
+        yield
+    finally:
+        peak_bytes = tracker.exit(name, entered) if tracker is not None else None
+        if session is not None:
+            session.record_stage(name, started, time.perf_counter() - started, peak_bytes)
+
+def profile_key(profile_id):
+    return f"profile:{profile_id}"
+
+def start_profile(label, profile_id=None):
+    """
+    Start profiling the current context.
+
+    Returns:
+        tuple: (ProfileSession, token to pass to finish_profile), or (None, None)
+        if a profile is already active, since cProfile runs cannot be nested.
+    """
+    if _current_profile.get() is not None:
+        return None, None
+    session = ProfileSession(label, profile_id)
+    token = _current_profile.set(session)
+    session.start()
+    return session, token
+
+def finish_profile(session, token):
+    """
+    Stop a session started with start_profile and save its report to the result store.
+
+    Returns:
+        str: The profile ID.
+    """
+    from app.services.result_store import get_result_store
+    session.stop()
+    _current_profile.reset(token)
+    get_result_store().put(session.report(), result_id=profile_key(session.id),
+                           ttl=current_app.config.get('PROFILE_TTL', 86400))
+    current_app.logger.info(f"Saved profile {session.id} ({session.label}, {session.duration:.2f}s)")
+    return session.id
+
+@contextmanager
+def profiled(label, profile_id=None):
+    """Profile the block and save the report; see start_profile and finish_profile."""
+    session, token = start_profile(label, profile_id)
+    try:
+        yield session
+    finally:
+        if session is not None:
+            finish_profile(session, token)
+
+def load_profile(profile_id):
+    """Return a saved profile report, or None if it is unknown or expired."""
+    from app.services.result_store import get_result_store
+    return get_result_store().get(profile_key(profile_id))
+
+def profiling_authorized(token):
+    """Return True if token matches PROFILING_TOKEN. Always False when profiling is disabled."""
+    expected = current_app.config.get('PROFILING_TOKEN')
+    return bool(expected and token) and hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+def init_memory_tracking(app):
+    """
+    Start tracemalloc and per-stage peak tracking if MEMORY_TRACKING is on.
+
+    tracemalloc slows allocation-heavy code noticeably, so this is meant for
+    sizing runs (such as the load test) rather than for normal operation.
+
+    Args:
+        app (Flask): The application instance.
+    """
+    global _memory_tracker
+    if not app.config.get('MEMORY_TRACKING') or _memory_tracker is not None:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(app.config.get('MEMORY_TRACKING_FRAMES', 1))
+    _memory_tracker = MemoryTracker()
+
+def memory_stats():
+    """Return per-stage peak memory of this process, or None if memory tracking is off."""
+    return _memory_tracker.stats() if _memory_tracker is not None else None
+
+def init_profiling(app):
+    """
+    Profile requests that carry a valid PROFILE_HEADER.
+
+    The profile ID is returned in the X-Profile-Id response header and the
+    report can be downloaded from /api/admin/profiles/<id>. Nothing is
+    registered unless PROFILING_TOKEN is set, so there is no per-request
+    cost when profiling is disabled.
+
+    Args:
+        app (Flask): The application instance.
+    """
+    if not app.config.get('PROFILING_TOKEN'):
+        return
+
+    @app.before_request
+    def _start_request_profile():
+        from flask import g, request
+        if request.endpoint == 'api.download_profile' or not profiling_authorized(request.headers.get(PROFILE_HEADER)):
+            return
+        g.profile_session, g.profile_token = start_profile(f"{request.method} {request.path}")
+
+    @app.after_request
+    def _add_profile_header(response):
+        from flask import g
+        session = g.get('profile_session')
+        if session is not None:
+            response.headers['X-Profile-Id'] = session.id
+        return response
+
+    @app.teardown_request
+    def _finish_request_profile(error=None):
+        from flask import g
+        session = g.pop('profile_session', None)
+        if session is not None:
+            try:
+                finish_profile(session, g.pop('profile_token'))
+            except Exception as e:
+                app.logger.warning(f"Could not save profile {session.id}: {e}")
@@ -0,0 +1,221 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from flask import current_app
+
+# Priority of the OpenAI calls made by the current request or task
+_priority = contextvars.ContextVar('openai_priority', default='interactive')
+
+@contextmanager
+def request_priority(priority):
+    """
+    Run a block with the given OpenAI call priority.
+
+    Interactive calls may drain the buckets completely; batch calls must leave
+    a reserved share of each bucket for interactive traffic.
+
+    Args:
+        priority (str): 'interactive' or 'batch'.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority():
+    """Return the OpenAI call priority of the current context."""
+    return _priority.get()
+
+class RateLimitTimeout(Exception):
+    """Raised when a call could not get rate-limit capacity within the allowed wait."""
+
+class LocalBucketBackend:
+    """In-process token buckets, a stand-in for RedisBucketBackend in tests and single-process runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._cooldowns = {}
+
+    def _level(self, key, capacity, now):
+        level, updated = self._buckets.get(key, (capacity, now))
+        return min(capacity, level + (now - updated) * capacity / 60.0)
+
+    def try_acquire(self, name, rpm, tpm, request_cost, token_cost, reserve):
+        """
+        Take capacity from both buckets if the call fits.
+
+        Returns:
+            float: 0 if granted, otherwise the seconds to wait before retrying.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cooldown = self._cooldowns.get(name, 0) - now
+            if cooldown > 0:
+                return cooldown
+
+            requests = self._level(f"{name}:requests", rpm, now)
+            tokens = self._level(f"{name}:tokens", tpm, now)
+            wait = max(
+                (request_cost + reserve * rpm - requests) * 60.0 / rpm,
+                (token_cost + reserve * tpm - tokens) * 60.0 / tpm,
+                0
+            )
+            if wait > 0:
+                return wait
+
+            self._buckets[f"{name}:requests"] = (requests - request_cost, now)
+            self._buckets[f"{name}:tokens"] = (tokens - token_cost, now)
+            return 0
+
+    def penalize(self, name, seconds):
+        """Pause all calls for the given number of seconds."""
+        with self._lock:
+            self._cooldowns[name] = max(self._cooldowns.get(name, 0), time.monotonic() + seconds)
+
+# Refill both buckets from the Redis clock, then take capacity only if the
+# call fits in both. Values are returned as strings to keep fractional waits.
+_REDIS_ACQUIRE_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[3])
+if cooldown > 0 then
+    return tostring(cooldown / 1000)
+end
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local request_cost = tonumber(ARGV[3])
+local token_cost = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+
+local function level(key, capacity)
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local current = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    return math.min(capacity, current + (now - updated) * capacity / 60)
+end
+
+local requests = level(KEYS[1], rpm)
+local tokens = level(KEYS[2], tpm)
+local wait = math.max(
+    (request_cost + reserve * rpm - requests) * 60 / rpm,
+    (token_cost + reserve * tpm - tokens) * 60 / tpm,
+    0
+)
+if wait > 0 then
+    return tostring(wait)
+end
+
+redis.call('HSET', KEYS[1], 'level', requests - request_cost, 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tokens - token_cost, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return '0'
+"""
+
+class RedisBucketBackend:
+    """Token buckets shared by every web and Celery worker through Redis."""
+
+    def __init__(self, client, prefix='docgen:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._acquire = client.register_script(_REDIS_ACQUIRE_SCRIPT)
+
+    def try_acquire(self, name, rpm, tpm, request_cost, token_cost, reserve):
+        """Take capacity from both buckets if the call fits (see LocalBucketBackend.try_acquire)."""
+        keys = [f"{self.prefix}{name}:requests", f"{self.prefix}{name}:tokens", f"{self.prefix}{name}:cooldown"]
+        return float(self._acquire(keys=keys, args=[rpm, tpm, request_cost, token_cost, reserve]))
+
+    def penalize(self, name, seconds):
+        """Pause all calls for the given number of seconds."""
+        self.client.set(f"{self.prefix}{name}:cooldown", 1, px=max(1, int(seconds * 1000)))
+
+class RateGovernor:
+    """
+    Requests-per-minute and tokens-per-minute token buckets for one OpenAI quota.
+
+    Each bucket holds a minute's worth of capacity and refills continuously.
+    A call proceeds once both buckets can cover it; otherwise it sleeps for
+    the time the buckets need to refill.
+    """
+
+    def __init__(self, backend, name, rpm, tpm, batch_reserve=0.2, max_wait=120):
+        self.backend = backend
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.batch_reserve = batch_reserve
+        self.max_wait = max_wait
+
+    def acquire(self, tokens, requests=1, priority=None):
+        """
+        Block until the quota allows a call of the given size.
+
+        Args:
+            tokens (int): Estimated tokens consumed (prompt plus max completion).
+            requests (int): Number of API requests the call makes.
+            priority (str, optional): 'interactive' or 'batch'; defaults to the current context's priority.
+
+        Raises:
+            RateLimitTimeout: If capacity did not free up within max_wait seconds.
+        """
+        priority = priority or current_priority()
+        reserve = self.batch_reserve if priority == 'batch' else 0
+        # A single call larger than the bucket would otherwise wait forever
+        tokens = min(tokens, self.tpm * (1 - reserve))
+        requests = min(requests, self.rpm * (1 - reserve))
+
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self.backend.try_acquire(self.name, self.rpm, self.tpm, requests, tokens, reserve)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"OpenAI {self.name} quota exhausted; gave up after waiting {self.max_wait}s.")
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Pause every caller sharing this quota, e.g. after OpenAI answered 429."""
+        self.backend.penalize(self.name, seconds)
+
+# Guards lazy creation so concurrent request threads share one backend
+_init_lock = threading.Lock()
+
+def get_rate_governor(name='chat'):
+    """
+    Return the rate governor for an OpenAI quota.
+
+    Args:
+        name (str): 'chat' for completions or 'embeddings' for embedding calls.
+
+    Returns:
+        RateGovernor: The governor configured from the application config.
+    """
+    governors = current_app.extensions.get('rate_governors')
+    if governors is None or name not in governors:
+        with _init_lock:
+            governors = current_app.extensions.setdefault('rate_governors', {})
+            if name not in governors:
+                config = current_app.config
+                backend = governors.get('_backend')
+                if backend is None:
+                    if config.get('RATE_LIMIT_BACKEND', 'local') == 'redis':
+                        from app.services.redis_service import get_redis_client
+                        backend = RedisBucketBackend(get_redis_client())
+                    else:
+                        backend = LocalBucketBackend()
+                    governors['_backend'] = backend
+
+                limits = config['RATE_LIMITS'][name]
+                governors[name] = RateGovernor(
+                    backend,
+                    name,
+                    rpm=limits['rpm'],
+                    tpm=limits['tpm'],
+                    batch_reserve=config.get('RATE_LIMIT_BATCH_RESERVE', 0.2),
+                    max_wait=config.get('RATE_LIMIT_MAX_WAIT', 120)
+                )
+    return governors[name]
@@ -0,0 +1,20 @@
+from flask import current_app
+
+def get_redis_client():
+    """
+    Return the Redis client shared by the application's services.
+
+    The client is created lazily and cached on the application, so the
+    redis package is only imported when a Redis-backed service is in use.
+    redis-py resets its connection pool when it detects a fork, so the
+    cached client is safe to share between gunicorn workers.
+
+    Returns:
+        redis.Redis: A Redis client connected to REDIS_URL.
+    """
+    client = current_app.extensions.get('redis_client')
+    if client is None:
+        import redis
+        client = redis.Redis.from_url(current_app.config['REDIS_URL'])
+        current_app.extensions['redis_client'] = client
+    return client
@@ -0,0 +1,160 @@
+import io
+import html
+import base64
+import hashlib
+import contextvars
+from contextlib import contextmanager
+from flask import current_app
+
+# Renderer fed by the generation running in the current context, if any
+_current_renderer = contextvars.ContextVar('current_renderer', default=None)
+
+RENDER_FORMATS = ('docx', 'pdf')
+# Formats built while streaming unless RENDER_FORMATS is configured; the PDF is laid out on download
+DEFAULT_RENDER_FORMATS = ('docx',)
+DOCUMENT_TITLE = "Generated Document"
+PDF_STYLE = "body { font-family: sans-serif; } p { margin: 0; white-space: pre-wrap; min-height: 1em; }"
+
+class DocxBuilder:
+    """Appends the document to a python-docx Document one line at a time."""
+
+    def __init__(self, title=DOCUMENT_TITLE):
+        from docx import Document as DocxDocument
+        self.doc = DocxDocument()
+        self.doc.add_heading(title, level=1)
+
+    def add_line(self, line):
+        self.doc.add_paragraph(line)
+
+    def finish(self):
+        f = io.BytesIO()
+        self.doc.save(f)
+        return f.getvalue()
+
+class PdfBuilder:
+    """
+    Collects the document as HTML while it streams in and lays it out with WeasyPrint once.
+
+    WeasyPrint cannot append to a laid-out document, and laying out parts
+    separately would start each part on a new page, so the document is laid
+    out as a single flow in finish(). Only the HTML is built while streaming.
+    """
+
+    def __init__(self, title=DOCUMENT_TITLE):
+        self._lines = [f"<h1>{html.escape(title)}</h1>"]
+
+    def add_line(self, line):
+        self._lines.append(f"<p>{html.escape(line)}</p>")
+
+    def finish(self):
+        from weasyprint import HTML
+        body = "".join(self._lines)
+        return HTML(string=f"<html><head><style>{PDF_STYLE}</style></head><body>{body}</body></html>").write_pdf()
+
+class StreamingRenderer:
+    """
+    Builds DOCX and PDF renditions of a document while its text is generated.
+
+    Feed it the completion deltas as they arrive; every complete line is
+    added to each rendition straight away, so when generation ends the
+    DOCX only needs to be saved and the PDF laid out. If the final text differs from what was
+    streamed (for example a result shared by single-flight or restored from
+    a checkpoint), finish() renders the final text instead.
+    """
+
+    def __init__(self, formats=RENDER_FORMATS, title=DOCUMENT_TITLE):
+        self.formats = tuple(formats)
+        self.title = title
+        self._reset()
+
+    def _reset(self):
+        self._pending = ""
+        self._digest = hashlib.sha256()
+        self._builders = {}
+        for fmt in self.formats:
+            if fmt == 'docx':
+                self._builders[fmt] = DocxBuilder(self.title)
+            elif fmt == 'pdf':
+                self._builders[fmt] = PdfBuilder(self.title)
+
+    def feed(self, delta):
+        """Add a chunk of generated text."""
+        self._digest.update(delta.encode('utf-8'))
+        *lines, self._pending = (self._pending + delta).split("\n")
+        for line in lines:
+            for builder in self._builders.values():
+                builder.add_line(line)
+
+    def finish(self, text):
+        """
+        Complete the renditions of the final document text.
+
+        Args:
+            text (str): The generated document.
+
+        Returns:
+            dict: Format to file bytes.
+        """
+        if self._digest.digest() != hashlib.sha256(text.encode('utf-8')).digest():
+            self._reset()
+            self.feed(text)
+        if self._pending:
+            self.feed("\n")
+        return {fmt: builder.finish() for fmt, builder in self._builders.items()}
+
+def new_renderer(formats=None):
+    """
+    Create a renderer with the application's settings.
+
+    Args:
+        formats (iterable, optional): Formats to build; defaults to RENDER_FORMATS in the config.
+
+    Returns:
+        StreamingRenderer: The renderer, or None if there is nothing to render.
+    """
+    config = current_app.config
+    formats = [fmt for fmt in (formats if formats is not None else config.get('RENDER_FORMATS', DEFAULT_RENDER_FORMATS))
+               if fmt in RENDER_FORMATS]
+    if not formats:
+        return None
+    return StreamingRenderer(formats)
+
+@contextmanager
+def rendering(renderer):
+    """Stream the document generated within the block into renderer (a no-op for None)."""
+    token = _current_renderer.set(renderer)
+    try:
+        yield renderer
+    finally:
+        _current_renderer.reset(token)
+
+def active_renderer():
+    """Return the renderer for the current generation, or None."""
+    return _current_renderer.get()
+
+def render_text(text, fmt):
+    """Render a complete document to DOCX or PDF bytes."""
+    return StreamingRenderer([fmt]).finish(text)[fmt]
+
+def _rendition_key(result_id, fmt):
+    return f"rendition:{result_id}:{fmt}"
+
+def save_renditions(result_id, renditions, ttl=None):
+    """Store rendered files next to the result they were rendered from."""
+    from app.services.result_store import get_result_store
+    store = get_result_store()
+    for fmt, data in renditions.items():
+        store.put({'data': base64.b64encode(data).decode('ascii')}, result_id=_rendition_key(result_id, fmt), ttl=ttl)
+
+def load_rendition(result_id, fmt):
+    """
+    Fetch a stored rendition.
+
+    Returns:
+        BytesIO: The file, or None if it was not pre-rendered or has expired.
+    """
+    from app.services.result_store import get_result_store
+    if not result_id:
+        return None
+    entry = get_result_store().get(_rendition_key(result_id, fmt))
+    return io.BytesIO(base64.b64decode(entry['data'])) if entry else None
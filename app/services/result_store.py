@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Every filesystem entry starts with its expiry time as a big-endian double
+_EXPIRY_HEADER = struct.Struct('>d')
+
+def encode_payload(value, level=6):
+    """
+    Serialize a JSON-compatible value and compress it.
+
+    Args:
+        value: The value to encode (str, dict, list, ...).
+        level (int): zlib compression level.
+
+    Returns:
+        bytes: The compressed payload.
+    """
+    return zlib.compress(json.dumps(value).encode('utf-8'), level)
+
+def decode_payload(payload):
+    """
+    Decompress and deserialize a payload produced by encode_payload.
+
+    Args:
+        payload (bytes): The compressed payload.
+
+    Returns:
+        The decoded value.
+    """
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+class PurgeScheduler:
+    """
+    Runs a store's purge on a background thread at most once per interval.
+
+    Stores call maybe_run() whenever they write, so expired entries that
+    are never read again are still removed, without a separate scheduler
+    process and without slowing the write itself. The first write after
+    startup purges what earlier processes left behind.
+    """
+
+    def __init__(self, purge, interval):
+        self.purge = purge
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = False
+        self._next_run = 0.0
+
+    def maybe_run(self):
+        """Start a purge if none is running and the interval has passed; a no-op for interval 0."""
+        if not self.interval:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._running or now < self._next_run:
+                return
+            self._running = True
+            self._next_run = now + self.interval
+        threading.Thread(target=self._run, name='store-purge', daemon=True).start()
+
+    def _run(self):
+        try:
+            removed = self.purge()
+            if removed:
+                logger.info(f"Purged {removed} expired entries")
+        except Exception as e:
+            logger.warning(f"Purging expired entries failed: {e}")
+        finally:
+            with self._lock:
+                self._running = False
+
+class FilesystemResultStore:
+    """
+    Result store keeping compressed entries in a local directory.
+
+    Expired entries are deleted when read, and by a background purge
+    started from put() at most every purge_interval seconds.
+    """
+
+    def __init__(self, directory, default_ttl=1800, compression_level=6, purge_interval=600):
+        self.directory = directory
+        self.default_ttl = default_ttl
+        self.compression_level = compression_level
+        self._purge = PurgeScheduler(self.purge_expired, purge_interval)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        # Hash the key so IDs taken from URLs can never escape the directory
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, value, result_id=None, ttl=None):
+        """
+        Store a value and return its result ID.
+
+        Args:
+            value: A JSON-compatible value.
+            result_id (str, optional): The ID to store under; a new one is generated if omitted.
+            ttl (int, optional): Seconds until the entry expires.
+
+        Returns:
+            str: The result ID.
+        """
+        result_id = result_id or uuid.uuid4().hex
+        expires_at = time.time() + (ttl or self.default_ttl)
+        path = self._path(result_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_EXPIRY_HEADER.pack(expires_at))
+                f.write(encode_payload(value, self.compression_level))
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self._purge.maybe_run()
+        return result_id
+
+    def get(self, result_id):
+        """
+        Fetch a stored value.
+
+        Args:
+            result_id (str): The result ID.
+
+        Returns:
+            The stored value, or None if it is missing or expired.
+        """
+        if not result_id:
+            return None
+        path = self._path(result_id)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        (expires_at,) = _EXPIRY_HEADER.unpack_from(data)
+        if expires_at < time.time():
+            self.delete(result_id)
+            return None
+        return decode_payload(data[_EXPIRY_HEADER.size:])
+
+    def delete(self, result_id):
+        """Remove a stored value if it exists."""
+        try:
+            os.unlink(self._path(result_id))
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self):
+        """
+        Delete every expired entry from the store directory.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        removed = 0
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, 'rb') as f:
+                        header = f.read(_EXPIRY_HEADER.size)
+                        inode = os.fstat(f.fileno()).st_ino
+                    # Skip entries rewritten since the header was read (put replaces the file)
+                    if (len(header) == _EXPIRY_HEADER.size and _EXPIRY_HEADER.unpack(header)[0] < now
+                            and os.stat(path).st_ino == inode):
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+class RedisResultStore:
+    """Result store keeping compressed entries in Redis with native expiry."""
+
+    def __init__(self, client, default_ttl=1800, compression_level=6, prefix='docgen:result:'):
+        self.client = client
+        self.default_ttl = default_ttl
+        self.compression_level = compression_level
+        self.prefix = prefix
+
+    def put(self, value, result_id=None, ttl=None):
+        """Store a value and return its result ID (see FilesystemResultStore.put)."""
+        result_id = result_id or uuid.uuid4().hex
+        self.client.set(
+            self.prefix + result_id,
+            encode_payload(value, self.compression_level),
+            ex=int(ttl or self.default_ttl)
+        )
+        return result_id
+
+    def get(self, result_id):
+        """Fetch a stored value, or None if it is missing or expired."""
+        if not result_id:
+            return None
+        payload = self.client.get(self.prefix + result_id)
+        if payload is None:
+            return None
+        return decode_payload(payload)
+
+    def delete(self, result_id):
+        """Remove a stored value if it exists."""
+        self.client.delete(self.prefix + result_id)
+
+    def purge_expired(self):
+        """Redis expires entries itself, so there is nothing to purge."""
+        return 0
+
+def create_result_store(config):
+    """
+    Build a result store from configuration.
+
+    Args:
+        config (dict): Application configuration.
+
+    Returns:
+        FilesystemResultStore or RedisResultStore: The configured store.
+    """
+    backend = config.get('RESULT_STORE_BACKEND', 'filesystem')
+    ttl = config.get('RESULT_TTL', 1800)
+    level = config.get('RESULT_COMPRESSION_LEVEL', 6)
+
+    if backend == 'redis':
+        from app.services.redis_service import get_redis_client
+        return RedisResultStore(get_redis_client(), default_ttl=ttl, compression_level=level)
+    elif backend == 'filesystem':
+        return FilesystemResultStore(config['RESULT_STORE_DIR'], default_ttl=ttl, compression_level=level,
+                                     purge_interval=config.get('RESULT_PURGE_INTERVAL', 600))
+    else:
+        raise ValueError(f"Unknown result store backend: {backend}")
+
+# Guards lazy creation so concurrent request threads share one store
+_init_lock = threading.Lock()
+
+def get_result_store():
+    """
+    Return the result store for the current application, creating it on first use.
+
+    Returns:
+        FilesystemResultStore or RedisResultStore: The shared result store.
+    """
+    store = current_app.extensions.get('result_store')
+    if store is None:
+        with _init_lock:
+            store = current_app.extensions.get('result_store')
+            if store is None:
+                store = create_result_store(current_app.config)
+                current_app.extensions['result_store'] = store
+    return store
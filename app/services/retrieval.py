@@ -0,0 +1,168 @@
+import re
+import numpy as np
+from scipy import sparse
+
+# Retrieval engines selectable per request or through RETRIEVAL_ENGINE
+RETRIEVAL_ENGINES = ('auto', 'vector', 'lexical', 'hybrid')
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    """Split text into lower-cased word tokens."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Okapi BM25 index over a list of texts, held as a sparse document-term matrix.
+
+    The per-term BM25 weights are computed once when the index is built, so
+    scoring a query is a single sparse matrix-vector product.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.vocabulary = {}
+        rows, cols = [], []
+        count = 0
+        # texts may be a generator, so each text only needs to exist while it is tokenized
+        for row, text in enumerate(texts):
+            count += 1
+            for token in tokenize(text):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+
+        # Duplicate (row, col) entries are summed into term frequencies
+        shape = (count, max(len(self.vocabulary), 1))
+        tf = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+        tf.sum_duplicates()
+
+        doc_lengths = np.asarray(tf.sum(axis=1)).ravel()
+        avg_length = doc_lengths.mean() if count and doc_lengths.mean() > 0 else 1.0
+        doc_freq = np.bincount(tf.indices, minlength=shape[1])
+        self.idf = np.log(1.0 + (count - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+        # Turn each stored term frequency into its BM25 weight in place
+        length_norm = k1 * (1 - b + b * doc_lengths / avg_length)
+        row_of_entry = np.repeat(np.arange(shape[0]), np.diff(tf.indptr))
+        tf.data = self.idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + length_norm[row_of_entry])
+        self.weights = tf
+
+    def query_vector(self, query_text):
+        """Return the query as a sparse term-count vector over the index vocabulary."""
+        cols = [self.vocabulary[token] for token in tokenize(query_text) if token in self.vocabulary]
+        vector = np.zeros(self.weights.shape[1], dtype=np.float32)
+        np.add.at(vector, cols, 1.0)
+        return vector
+
+    def scores(self, query_text):
+        """
+        Score every indexed text against the query.
+
+        Args:
+            query_text (str): The query.
+
+        Returns:
+            numpy.ndarray: One BM25 score per indexed text.
+        """
+        return self.weights @ self.query_vector(query_text)
+
+    def top_k(self, query_text, k=5):
+        """
+        Return the indices of the k best-scoring texts, best first.
+
+        Args:
+            query_text (str): The query.
+            k (int): Number of results.
+
+        Returns:
+            list: Indices into the indexed texts.
+        """
+        scores = self.scores(query_text)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        return best[np.argsort(-scores[best])].tolist()
+
+def choose_retrieval_engine(requested, chunk_count, config):
+    """
+    Decide which retrieval engine to use for a request.
+
+    Args:
+        requested (str, optional): Engine requested by the caller; falls back to RETRIEVAL_ENGINE.
+        chunk_count (int): Number of context chunks to search.
+        config (dict): Application configuration.
+
+    Returns:
+        str: 'vector', 'lexical' or 'hybrid'.
+    """
+    engine = requested or config.get('RETRIEVAL_ENGINE', 'auto')
+    if engine not in RETRIEVAL_ENGINES:
+        raise ValueError(f"Unknown retrieval engine: {engine}")
+    if engine == 'auto':
+        # Small corpora are not worth an embedding round-trip
+        return 'lexical' if chunk_count <= config.get('LEXICAL_MAX_CHUNKS', 50) else 'vector'
+    return engine
+
+def lexical_search(docs, query_text, k=5):
+    """
+    Retrieve the chunks most relevant to the query with BM25, without any network call.
+
+    Args:
+        docs (list): Document chunks or ChunkViews.
+        query_text (str): The query.
+        k (int): Number of chunks to return.
+
+    Returns:
+        list: The best matching Document objects.
+    """
+    index = BM25Index(doc.page_content for doc in docs)
+    return [docs[i] for i in index.top_k(query_text, k)]
+
+def _min_max(values):
+    # Empty or constant scores carry no ranking signal
+    if values.size == 0:
+        return values
+    spread = values.max() - values.min()
+    if spread <= 0:
+        return np.ones_like(values)
+    return (values - values.min()) / spread
+
+def hybrid_search(vector_hits, docs, query_text, k=5, vector_weight=0.5):
+    """
+    Retrieve chunks by fusing FAISS vector scores with BM25 scores.
+
+    The vector hits and as many BM25 top chunks form the candidate set. Both
+    scores are min-max normalised over the candidates and combined as a
+    weighted sum.
+
+    Args:
+        vector_hits (list): (chunk position, L2 distance) pairs from the vector index.
+        docs (list): Document chunks or ChunkViews, in index order.
+        query_text (str): The query.
+        k (int): Number of chunks to return.
+        vector_weight (float): Weight of the vector score; BM25 gets the remainder.
+
+    Returns:
+        list: The best matching Document objects.
+    """
+    bm25_scores = BM25Index(doc.page_content for doc in docs).scores(query_text)
+
+    # FAISS returns L2 distances, so closer chunks get higher similarity
+    vector_similarity = {position: -distance for position, distance in vector_hits}
+    lexical_best = np.argsort(-bm25_scores)[:max(len(vector_hits), k)].tolist()
+    candidates = sorted(set(vector_similarity) | set(lexical_best))
+    if not candidates:
+        return []
+
+    if vector_similarity:
+        # Lexical-only candidates score as the farthest vector hit
+        floor = min(vector_similarity.values())
+        vector_values = _min_max(np.array([vector_similarity.get(i, floor) for i in candidates], dtype=np.float32))
+    else:
+        # No vector hits (e.g. an approximate index found nothing): rank by BM25 alone
+        vector_values = np.zeros(len(candidates), dtype=np.float32)
+    lexical_values = _min_max(bm25_scores[candidates].astype(np.float32))
+
+    fused = vector_weight * vector_values + (1 - vector_weight) * lexical_values
+    order = np.argsort(-fused)[:k]
+    return [docs[candidates[i]] for i in order]
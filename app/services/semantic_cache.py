@@ -0,0 +1,403 @@
+import re
+import time
+import uuid
+import zlib
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from flask import current_app
+
+# Volatile tokens that should not make otherwise identical documents look different
+_VOLATILE_PATTERNS = [
+    # UUIDs and long hex identifiers
+    re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"),
+    re.compile(r"\b[0-9a-f]{16,}\b"),
+    # ISO timestamps and dates, then numeric dates and clock times
+    re.compile(r"\b\d{4}-\d{2}-\d{2}(?:[t ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:z|[+-]\d{2}:?\d{2})?)?\b"),
+    re.compile(r"\b\d{1,2}[/.]\d{1,2}[/.]\d{2,4}\b"),
+    re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?(?:\s?[ap]\.?m\.?)?\b"),
+]
+_WHITESPACE = re.compile(r"\s+")
+
+# Mersenne prime for the MinHash permutations; hash values are 32-bit, so products fit in 64 bits
+_MERSENNE_PRIME = (1 << 31) - 1
+
+# Previous document offered to the generation running in the current context, if any
+_current_seed = contextvars.ContextVar('current_seed', default=None)
+
+def normalize_text(text):
+    """
+    Normalise text for near-duplicate comparison.
+
+    Lower-cases it, replaces timestamps, dates, clock times and identifiers
+    with placeholders and collapses whitespace. Other numbers are kept, since
+    they usually carry facts that change the generated document.
+    """
+    text = text.lower()
+    for pattern in _VOLATILE_PATTERNS:
+        text = pattern.sub("#", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+def shingle_hashes(text, size=5):
+    """
+    Hash the word shingles of normalised text.
+
+    Args:
+        text (str): Normalised text.
+        size (int): Words per shingle.
+
+    Returns:
+        numpy.ndarray: Unique 32-bit shingle hashes (as int64).
+    """
+    words = text.split(" ")
+    if len(words) <= size:
+        shingles = {zlib.crc32(text.encode('utf-8'))}
+    else:
+        shingles = {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+    return np.fromiter(shingles, dtype=np.int64, count=len(shingles))
+
+class MinHasher:
+    """MinHash signatures from a fixed, seeded family of universal hash permutations."""
+
+    def __init__(self, num_perm=128, seed=1, shingle_size=5, block_size=4096):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.block_size = block_size
+        self.a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)[:, None]
+        self.b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)[:, None]
+
+    def signature(self, text):
+        """
+        Compute the MinHash signature of a text.
+
+        Args:
+            text (str): The text; it is normalised first.
+
+        Returns:
+            numpy.ndarray: num_perm uint32 minimum hash values.
+        """
+        hashes = shingle_hashes(normalize_text(text), self.shingle_size)
+        signature = np.full(self.num_perm, _MERSENNE_PRIME, dtype=np.int64)
+        # Permute in blocks so long documents never need a num_perm x shingles matrix
+        for start in range(0, len(hashes), self.block_size):
+            block = hashes[start:start + self.block_size][None, :]
+            permuted = (self.a * block + self.b) % _MERSENNE_PRIME
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+def estimate_similarity(signature, other):
+    """Estimate the Jaccard similarity of two texts from their MinHash signatures."""
+    return float(np.mean(signature == other))
+
+def band_hashes(signature, bands):
+    """Split a signature into LSH bands and hash each band to a short hex key."""
+    rows = len(signature) // bands
+    return [hashlib.blake2b(signature[i * rows:(i + 1) * rows].tobytes(), digest_size=8).hexdigest()
+            for i in range(bands)]
+
+class LocalLSHIndex:
+    """In-process LSH index with least-recently-used eviction, a stand-in for RedisLSHIndex."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._buckets = {}
+
+    def candidates(self, scope, bands):
+        """Return (entry ID, signature) pairs sharing at least one band with the query."""
+        with self._lock:
+            ids = set()
+            for i, band in enumerate(bands):
+                ids.update(self._buckets.get((scope, i, band), ()))
+            return [(entry_id, self._entries[entry_id][0]) for entry_id in ids]
+
+    def add(self, entry_id, scope, signature, bands):
+        """Index a signature, evicting the least recently used entries beyond max_entries."""
+        with self._lock:
+            keys = [(scope, i, band) for i, band in enumerate(bands)]
+            self._entries[entry_id] = (signature, keys)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def touch(self, entry_id):
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+
+    def remove(self, entry_id):
+        with self._lock:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+class RedisLSHIndex:
+    """
+    LSH index in Redis, shared by every web and Celery worker.
+
+    Each band bucket is a set of entry IDs; entries keep their signature and
+    bucket keys in a hash, and a sorted set of last-use times drives
+    least-recently-used eviction.
+    """
+
+    def __init__(self, client, max_entries=10000, prefix='docgen:semcache:'):
+        self.client = client
+        self.max_entries = max_entries
+        self.prefix = prefix
+
+    def _bucket_key(self, scope, i, band):
+        return f"{self.prefix}band:{scope}:{i}:{band}"
+
+    def _entry_key(self, entry_id):
+        return f"{self.prefix}entry:{entry_id}"
+
+    def candidates(self, scope, bands):
+        ids = self.client.sunion([self._bucket_key(scope, i, band) for i, band in enumerate(bands)])
+        if not ids:
+            return []
+        pipe = self.client.pipeline()
+        ids = [entry_id.decode() for entry_id in ids]
+        for entry_id in ids:
+            pipe.hget(self._entry_key(entry_id), 'signature')
+        return [(entry_id, np.frombuffer(signature, dtype=np.uint32))
+                for entry_id, signature in zip(ids, pipe.execute()) if signature is not None]
+
+    def add(self, entry_id, scope, signature, bands):
+        keys = [self._bucket_key(scope, i, band) for i, band in enumerate(bands)]
+        pipe = self.client.pipeline()
+        pipe.hset(self._entry_key(entry_id), mapping={'signature': signature.tobytes(), 'buckets': " ".join(keys)})
+        for key in keys:
+            pipe.sadd(key, entry_id)
+        pipe.zadd(f"{self.prefix}lru", {entry_id: time.time()})
+        pipe.zcard(f"{self.prefix}lru")
+        size = pipe.execute()[-1]
+        if size > self.max_entries:
+            for evicted, _ in self.client.zpopmin(f"{self.prefix}lru", size - self.max_entries):
+                self.remove(evicted.decode())
+
+    def touch(self, entry_id):
+        self.client.zadd(f"{self.prefix}lru", {entry_id: time.time()}, xx=True)
+
+    def remove(self, entry_id):
+        buckets = self.client.hget(self._entry_key(entry_id), 'buckets')
+        pipe = self.client.pipeline()
+        for key in (buckets.decode().split(" ") if buckets else []):
+            pipe.srem(key, entry_id)
+        pipe.delete(self._entry_key(entry_id))
+        pipe.zrem(f"{self.prefix}lru", entry_id)
+        pipe.execute()
+
+class SemanticCache:
+    """
+    Cache of generated documents keyed by near-duplicate source documents.
+
+    Entries are scoped to an exact template, context and parameter
+    combination; within a scope, source documents are matched by MinHash
+    similarity through LSH banding. A match at or above threshold may be
+    served as is (see serve_enabled). A match at or above seed_threshold is
+    offered to the generation as a reference document (see active_seed).
+    """
+
+    def __init__(self, index, store, hasher=None, bands=16, threshold=0.95, seed_threshold=None, ttl=604800):
+        self.index = index
+        self.store = store
+        self.hasher = hasher or MinHasher()
+        self.bands = bands
+        self.threshold = threshold
+        self.seed_threshold = seed_threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'seeded': 0, 'misses': 0, 'stored': 0}
+
+    def record(self, outcome):
+        """Count a lookup outcome: 'hits', 'seeded' or 'misses'."""
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def lookup(self, scope, info_text):
+        """
+        Find the closest cached document for a source text.
+
+        Args:
+            scope (str): From cache_scope.
+            info_text (str): The source document text.
+
+        Returns:
+            tuple: (signature, similarity, cached document); the last two are
+            None if no entry reaches the seed (or serving) threshold.
+        """
+        signature = self.hasher.signature(info_text)
+        bands = band_hashes(signature, self.bands)
+        floor = self.threshold if self.seed_threshold is None else min(self.seed_threshold, self.threshold)
+        ranked = sorted(((estimate_similarity(signature, other), entry_id)
+                         for entry_id, other in self.index.candidates(scope, bands)), reverse=True)
+        for similarity, entry_id in ranked:
+            if similarity < floor:
+                break
+            entry = self.store.get(f"semcache:{entry_id}")
+            if entry is None:
+                # The document expired from the result store; drop its index entry too
+                self.index.remove(entry_id)
+                continue
+            self.index.touch(entry_id)
+            return signature, similarity, entry['document']
+        return signature, None, None
+
+    def add(self, scope, signature, document):
+        """Cache a generated document under the signature of its source text."""
+        entry_id = uuid.uuid4().hex
+        self.store.put({'document': document}, result_id=f"semcache:{entry_id}", ttl=self.ttl)
+        self.index.add(entry_id, scope, signature, band_hashes(signature, self.bands))
+        self.record('stored')
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+def template_id(template_text):
+    """Return the short ID used to opt a template in through SEMANTIC_CACHE_TEMPLATES."""
+    return hashlib.sha256(normalize_text(template_text).encode('utf-8')).hexdigest()[:16]
+
+def cache_scope(template_text, context=None, params=None):
+    """Key the entries that may be shared: same normalised template, context and parameters."""
+    from app.services.single_flight import fingerprint_request
+    return fingerprint_request(normalize_text(template_text), "", context=context, params=params)
+
+def template_enabled(template_text, config):
+    """Return True if SEMANTIC_CACHE_TEMPLATES opts the template in ('*' enables every template)."""
+    templates = config.get('SEMANTIC_CACHE_TEMPLATES') or []
+    return '*' in templates or template_id(template_text) in templates
+
+def serve_enabled(template_text, config):
+    """
+    Return True if SEMANTIC_CACHE_SERVE_TEMPLATES lets the template serve cached documents as is.
+
+    Similarity is measured on normalised shingles, so a source that differs
+    only in a name, an amount or a masked date still scores close to 1.
+    Serving its cached document verbatim would repeat the old facts; other
+    templates therefore only use matches as a reference document.
+    """
+    templates = config.get('SEMANTIC_CACHE_SERVE_TEMPLATES') or []
+    return '*' in templates or template_id(template_text) in templates
+
+@contextmanager
+def seeding(document):
+    """Offer a previous document for a similar source to the generation run within the block."""
+    token = _current_seed.set(document)
+    try:
+        yield document
+    finally:
+        _current_seed.reset(token)
+
+def active_seed():
+    """Return the previous document offered to the current generation, or None."""
+    return _current_seed.get()
+
+def run_with_semantic_cache(template_text, info_text, generate, context=None, params=None):
+    """
+    Serve a generation from the semantic cache, or run it and cache the result.
+
+    Without SEMANTIC_CACHE, or for templates not opted in, this simply calls
+    generate. Near-duplicates are only served as is for templates in
+    SEMANTIC_CACHE_SERVE_TEMPLATES; otherwise they seed the generation.
+    Cache failures are logged and never fail the generation.
+
+    Args:
+        template_text (str): The template text.
+        info_text (str): The source document text.
+        generate (callable): Runs the generation and returns the document.
+        context (list, optional): Context texts or digests; they must match exactly to share entries.
+        params (dict, optional): Generation parameters that affect the output.
+
+    Returns:
+        str: The generated or cached document.
+    """
+    from app.services.document_generator import GENERATION_ERROR_PREFIX
+    config = current_app.config
+    if not config.get('SEMANTIC_CACHE'):
+        return generate()
+    if not template_enabled(template_text, config):
+        current_app.logger.debug(f"Template {template_id(template_text)} is not opted in to the semantic cache")
+        return generate()
+
+    cache = get_semantic_cache()
+    scope = cache_scope(template_text, context, params)
+    try:
+        signature, similarity, cached = cache.lookup(scope, info_text)
+    except Exception as e:
+        current_app.logger.warning(f"Semantic cache lookup failed: {e}")
+        return generate()
+
+    if cached is not None and similarity >= cache.threshold and serve_enabled(template_text, config):
+        cache.record('hits')
+        current_app.logger.info(f"Serving a cached document for a near-duplicate source (similarity {similarity:.2f})")
+        return cached
+
+    cache.record('seeded' if cached is not None else 'misses')
+    with seeding(cached):
+        document = generate()
+
+    if not document.startswith(GENERATION_ERROR_PREFIX):
+        try:
+            cache.add(scope, signature, document)
+        except Exception as e:
+            current_app.logger.warning(f"Could not store the document in the semantic cache: {e}")
+    return document
+
+# Guards lazy creation so concurrent request threads share one cache
+_init_lock = threading.Lock()
+
+def get_semantic_cache():
+    """
+    Return the semantic cache for the current application.
+
+    Returns:
+        SemanticCache: The cache, indexed in Redis or in process (SEMANTIC_CACHE_BACKEND).
+    """
+    from app.services.result_store import get_result_store
+    cache = current_app.extensions.get('semantic_cache')
+    if cache is not None:
+        return cache
+
+    with _init_lock:
+        cache = current_app.extensions.get('semantic_cache')
+        if cache is not None:
+            return cache
+
+        config = current_app.config
+        max_entries = config.get('SEMANTIC_CACHE_MAX_ENTRIES', 10000)
+        backend = config.get('SEMANTIC_CACHE_BACKEND', 'local')
+        if backend == 'redis':
+            from app.services.redis_service import get_redis_client
+            index = RedisLSHIndex(get_redis_client(), max_entries=max_entries)
+        elif backend == 'local':
+            index = LocalLSHIndex(max_entries=max_entries)
+        else:
+            raise ValueError(f"Unknown semantic cache backend: {backend}")
+
+        cache = SemanticCache(
+            index,
+            get_result_store(),
+            hasher=MinHasher(num_perm=config.get('SEMANTIC_CACHE_NUM_PERM', 128)),
+            bands=config.get('SEMANTIC_CACHE_BANDS', 16),
+            threshold=config.get('SEMANTIC_CACHE_THRESHOLD', 0.95),
+            seed_threshold=config.get('SEMANTIC_CACHE_SEED_THRESHOLD'),
+            ttl=config.get('SEMANTIC_CACHE_TTL', 604800)
+        )
+        current_app.extensions['semantic_cache'] = cache
+        return cache
@@ -0,0 +1,225 @@
+import json
+import time
+import uuid
+import hashlib
+import threading
+from flask import current_app
+from app.services.result_store import get_result_store
+
+def fingerprint_request(template_text, info_text, context=None, params=None):
+    """
+    Compute a stable fingerprint for a generation request.
+
+    Each part is length-prefixed before hashing so that moving text between
+    the template and the document can never produce the same fingerprint.
+
+    Args:
+        template_text (str): The document template.
+        info_text (str): The original document text.
+        context (list, optional): Context file contents or content digests.
+        params (dict, optional): Generation parameters that affect the output.
+
+    Returns:
+        str: A hex SHA-256 fingerprint.
+    """
+    digest = hashlib.sha256()
+    parts = [template_text, info_text]
+    parts.extend(context or [])
+    parts.append(json.dumps(params or {}, sort_keys=True))
+    for part in parts:
+        data = part.encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+class LocalLockBackend:
+    """In-process lock backend, a stand-in for RedisLockBackend in tests and single-process runs."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._held = {}
+
+    def acquire(self, name, ttl):
+        """Try to take the lock; return a release token, or None if it is held."""
+        now = time.monotonic()
+        with self._guard:
+            holder = self._held.get(name)
+            if holder and holder[1] > now:
+                return None
+            token = uuid.uuid4().hex
+            self._held[name] = (token, now + ttl)
+            return token
+
+    def release(self, name, token):
+        """Release the lock if it is still held with the given token."""
+        with self._guard:
+            holder = self._held.get(name)
+            if holder and holder[0] == token:
+                del self._held[name]
+
+    def is_held(self, name):
+        """Return True if the lock is currently held."""
+        with self._guard:
+            holder = self._held.get(name)
+            return bool(holder and holder[1] > time.monotonic())
+
+# Delete the key only if it still holds our token, so an expired leader
+# can never release a lock that a newer leader has taken
+_REDIS_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class RedisLockBackend:
+    """Cross-process lock backend using Redis SET NX with an expiry."""
+
+    def __init__(self, client, prefix='docgen:lock:'):
+        self.client = client
+        self.prefix = prefix
+        self._release = client.register_script(_REDIS_RELEASE_SCRIPT)
+
+    def acquire(self, name, ttl):
+        """Try to take the lock; return a release token, or None if it is held."""
+        token = uuid.uuid4().hex
+        if self.client.set(self.prefix + name, token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+
+    def release(self, name, token):
+        """Release the lock if it is still held with the given token."""
+        self._release(keys=[self.prefix + name], args=[token])
+
+    def is_held(self, name):
+        """Return True if the lock is currently held."""
+        return bool(self.client.exists(self.prefix + name))
+
+class SingleFlight:
+    """
+    Run at most one computation per key at a time across all workers.
+
+    The first caller for a key (the leader) takes a lock and runs the
+    computation. Concurrent callers with the same key wait for the leader's
+    result to appear in the result store and return it instead of running
+    the computation again.
+
+    A computation fails by raising, or by returning a value for which
+    is_failure returns True. Failures are kept only briefly, so waiting
+    callers see them but a later retry computes afresh.
+    """
+
+    def __init__(self, locks, store, lock_ttl=900, result_ttl=60, poll_interval=0.5, is_failure=None):
+        self.locks = locks
+        self.store = store
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.is_failure = is_failure
+
+    def run(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) once for all concurrent callers sharing key.
+
+        Args:
+            key (str): The request fingerprint.
+            fn (callable): The computation; its return value must be JSON-compatible.
+
+        Returns:
+            The computation's result.
+
+        Raises:
+            RuntimeError: If the leader failed, or no result arrived before the lock expired.
+        """
+        result_key = f"flight:{key}"
+        lock_name = f"flight:{key}"
+        deadline = time.monotonic() + self.lock_ttl
+
+        while True:
+            outcome = self.store.get(result_key)
+            if outcome is not None:
+                return self._unwrap(outcome)
+
+            token = self.locks.acquire(lock_name, self.lock_ttl)
+            if token is not None:
+                return self._lead(result_key, lock_name, token, fn, args, kwargs)
+
+            # Another worker is computing this request; wait for its result
+            while self.locks.is_held(lock_name) and time.monotonic() < deadline:
+                outcome = self.store.get(result_key)
+                if outcome is not None:
+                    return self._unwrap(outcome)
+                time.sleep(self.poll_interval)
+
+            if time.monotonic() >= deadline:
+                raise RuntimeError("Timed out waiting for an identical in-flight generation.")
+
+    def _lead(self, result_key, lock_name, token, fn, args, kwargs):
+        try:
+            # A previous leader may have finished between our check and acquiring the lock
+            outcome = self.store.get(result_key)
+            if outcome is not None:
+                return self._unwrap(outcome)
+
+            # Keep failures just long enough for current waiters to see them,
+            # so a later retry computes afresh
+            error_ttl = max(1, int(self.poll_interval * 4))
+            try:
+                value = fn(*args, **kwargs)
+            except Exception as e:
+                self.store.put({'ok': False, 'error': str(e)}, result_id=result_key, ttl=error_ttl)
+                raise
+            if self.is_failure is not None and self.is_failure(value):
+                self.store.put({'ok': False, 'error': str(value)}, result_id=result_key, ttl=error_ttl)
+            else:
+                self.store.put({'ok': True, 'value': value}, result_id=result_key, ttl=self.result_ttl)
+            return value
+        finally:
+            self.locks.release(lock_name, token)
+
+    @staticmethod
+    def _unwrap(outcome):
+        if not outcome['ok']:
+            raise RuntimeError(f"Identical in-flight generation failed: {outcome['error']}")
+        return outcome['value']
+
+# Guards lazy creation so concurrent request threads share one coordinator
+_init_lock = threading.Lock()
+
+def get_single_flight():
+    """
+    Return the single-flight coordinator for the current application.
+
+    Returns:
+        SingleFlight: The coordinator, using Redis locks or the in-process stand-in.
+    """
+    flight = current_app.extensions.get('single_flight')
+    if flight is not None:
+        return flight
+
+    with _init_lock:
+        flight = current_app.extensions.get('single_flight')
+        if flight is not None:
+            return flight
+
+        from app.services.document_generator import is_generation_error
+        backend = current_app.config.get('SINGLE_FLIGHT_BACKEND', 'local')
+        if backend == 'redis':
+            from app.services.redis_service import get_redis_client
+            locks = RedisLockBackend(get_redis_client())
+        elif backend == 'local':
+            locks = LocalLockBackend()
+        else:
+            raise ValueError(f"Unknown single-flight backend: {backend}")
+
+        flight = SingleFlight(
+            locks,
+            get_result_store(),
+            lock_ttl=current_app.config.get('SINGLE_FLIGHT_LOCK_TTL', 900),
+            result_ttl=current_app.config.get('SINGLE_FLIGHT_RESULT_TTL', 60),
+            poll_interval=current_app.config.get('SINGLE_FLIGHT_POLL_INTERVAL', 0.5),
+            # The pipeline reports OpenAI failures by returning an error text
+            is_failure=is_generation_error
+        )
+        current_app.extensions['single_flight'] = flight
+        return flight
@@ -0,0 +1,114 @@
+import threading
+
+# Priority classes a caller may request; batch work always runs on the batch queues
+TASK_PRIORITIES = ('interactive', 'batch')
+
+# Generation queues by priority class and estimated cost; each has its own worker pool
+GENERATION_QUEUES = ('interactive_short', 'interactive_long', 'batch_short', 'batch_long')
+DEFAULT_GENERATION_QUEUE = 'interactive_short'
+
+def estimate_generation_cost(template_text, info_text, context_texts=None):
+    """
+    Estimate the input tokens a generation will process.
+
+    Args:
+        template_text (str): The template text.
+        info_text (str): The original document text.
+        context_texts (list, optional): Text content of each context file.
+
+    Returns:
+        int: Estimated input tokens.
+    """
+    from app.services.openai_service import estimate_tokens
+    return (estimate_tokens(template_text) + estimate_tokens(info_text)
+            + sum(estimate_tokens(text) for text in context_texts or []))
+
+def choose_queue(priority, estimated_tokens, config):
+    """
+    Pick the Celery queue for a generation.
+
+    Args:
+        priority (str): 'interactive' or 'batch'.
+        estimated_tokens (int): From estimate_generation_cost.
+        config (dict): Application configuration.
+
+    Returns:
+        str: One of GENERATION_QUEUES.
+    """
+    size = 'long' if estimated_tokens > config.get('TASK_LONG_TOKENS', 30000) else 'short'
+    return f"{'batch' if priority == 'batch' else 'interactive'}_{size}"
+
+class QueueMetrics:
+    """
+    Per-queue task counters and timings kept in Redis hashes.
+
+    Web workers record enqueues and Celery workers record starts and
+    finishes, so every process reports the same numbers.
+    """
+
+    def __init__(self, client, prefix='docgen:queue:'):
+        self.client = client
+        self.prefix = prefix
+
+    def _incr(self, queue, **amounts):
+        pipe = self.client.pipeline()
+        for field, amount in amounts.items():
+            if isinstance(amount, float):
+                pipe.hincrbyfloat(self.prefix + queue, field, amount)
+            else:
+                pipe.hincrby(self.prefix + queue, field, amount)
+        pipe.execute()
+
+    def record_enqueued(self, queue):
+        self._incr(queue, enqueued=1)
+
+    def record_started(self, queue, wait_seconds):
+        self._incr(queue, started=1, wait_seconds=float(wait_seconds))
+
+    def record_finished(self, queue, run_seconds, succeeded):
+        self._incr(queue, **{'succeeded' if succeeded else 'failed': 1, 'run_seconds': float(run_seconds)})
+
+    def stats(self, queues=GENERATION_QUEUES):
+        """
+        Report counters, average wait and run times and current depth per queue.
+
+        Returns:
+            dict: Queue name to its metrics.
+        """
+        report = {}
+        for queue in queues:
+            values = {k.decode(): float(v) for k, v in self.client.hgetall(self.prefix + queue).items()}
+            started = values.get('started', 0)
+            finished = values.get('succeeded', 0) + values.get('failed', 0)
+            report[queue] = {
+                'enqueued': int(values.get('enqueued', 0)),
+                'started': int(started),
+                'succeeded': int(values.get('succeeded', 0)),
+                'failed': int(values.get('failed', 0)),
+                # Celery's Redis transport keeps each queue as a list named after it
+                'depth': int(self.client.llen(queue)),
+                'avg_wait_seconds': round(values.get('wait_seconds', 0) / started, 3) if started else None,
+                'avg_run_seconds': round(values.get('run_seconds', 0) / finished, 3) if finished else None,
+            }
+        return report
+
+# Guards lazy creation so concurrent request threads share one instance
+_init_lock = threading.Lock()
+
+def get_queue_metrics():
+    """
+    Return the queue metrics recorder for the current application.
+
+    Returns:
+        QueueMetrics: Metrics stored in the Redis at REDIS_URL.
+    """
+    from flask import current_app
+    from app.services.redis_service import get_redis_client
+    metrics = current_app.extensions.get('queue_metrics')
+    if metrics is None:
+        with _init_lock:
+            metrics = current_app.extensions.get('queue_metrics')
+            if metrics is None:
+                metrics = QueueMetrics(get_redis_client())
+                current_app.extensions['queue_metrics'] = metrics
+    return metrics
@@ -0,0 +1,107 @@
+import io
+import mmap
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from flask import Request, current_app
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """
+    Upload buffer that stays in memory up to max_size bytes, then spills to a
+    temporary file, computing a SHA-256 digest of everything written to it.
+    """
+
+    def __init__(self, max_size, dir=None):
+        super().__init__(max_size=max_size, mode='w+b', dir=dir)
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return super().write(data)
+
+    @property
+    def content_hash(self):
+        """Hex SHA-256 digest of the bytes written so far."""
+        return self._digest.hexdigest()
+
+    @property
+    def on_disk(self):
+        """Whether the contents have spilled to a temporary file."""
+        return self._rolled
+
+class MappedFile(mmap.mmap):
+    """Read-only memory map with the file-object methods zipfile and PyPDF2 expect."""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+class SpoolingRequest(Request):
+    """
+    Request whose file uploads are spooled through HashingSpooledFile.
+
+    Each file is hashed while Werkzeug parses the multipart body, so its
+    digest is available without reading the upload again, and anything larger
+    than UPLOAD_SPOOL_THRESHOLD goes to disk instead of the worker's heap.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        return HashingSpooledFile(
+            max_size=config.get('UPLOAD_SPOOL_THRESHOLD', 1024 * 1024),
+            dir=config.get('UPLOAD_FOLDER')
+        )
+
+def upload_content_hash(uploaded_file):
+    """
+    Return the digest computed while an upload was received, if there is one.
+
+    Args:
+        uploaded_file: A FileStorage from request.files.
+
+    Returns:
+        str: The hex SHA-256 digest, or None if the upload was not spooled by SpoolingRequest.
+    """
+    return getattr(getattr(uploaded_file, 'stream', uploaded_file), 'content_hash', None)
+
+@contextmanager
+def open_upload_view(uploaded_file):
+    """
+    Open a read-only, seekable view over an upload's bytes without copying them.
+
+    Uploads that spilled to disk are memory-mapped, so parsers read pages
+    straight from the page cache. Uploads still in memory are returned as
+    their own buffer, rewound.
+
+    Args:
+        uploaded_file: A FileStorage from request.files, or any binary file object.
+
+    Yields:
+        A binary file-like object (MappedFile or the upload stream).
+    """
+    stream = getattr(uploaded_file, 'stream', uploaded_file)
+    mapped = None
+    # fileno() would force an in-memory spooled file onto disk
+    if getattr(stream, '_rolled', True):
+        try:
+            stream.flush()
+            mapped = MappedFile(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+            # No file descriptor, or an empty file, which cannot be mapped
+            mapped = None
+
+    if mapped is None:
+        stream.seek(0)
+        try:
+            yield stream
+        finally:
+            stream.seek(0)
+        return
+    try:
+        yield mapped
+    finally:
+        mapped.close()
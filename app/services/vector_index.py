@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+from app.services.result_store import PurgeScheduler
+
+# Index types selectable through VECTOR_INDEX_TYPE
+INDEX_TYPES = ('auto', 'flat', 'hnsw', 'ivfpq')
+
+# Defaults used when no application config is available (e.g. in benchmarks)
+DEFAULT_INDEX_CONFIG = {
+    'VECTOR_INDEX_TYPE': 'auto',
+    'HNSW_MIN_VECTORS': 10000,
+    'IVFPQ_MIN_VECTORS': 200000,
+    'HNSW_M': 32,
+    'HNSW_EF_CONSTRUCTION': 80,
+    'HNSW_EF_SEARCH': 64,
+    'IVF_NLIST': None,
+    'IVF_NPROBE': 16,
+    'IVFPQ_M': 64,
+    'IVFPQ_NBITS': 8,
+    'IVF_TRAIN_SIZE': 100000,
+}
+
+def _setting(config, name):
+    value = config.get(name)
+    return DEFAULT_INDEX_CONFIG[name] if value is None else value
+
+def choose_index_type(requested, vector_count, config):
+    """
+    Decide which index type to build for a corpus.
+
+    Args:
+        requested (str, optional): Index type requested; falls back to VECTOR_INDEX_TYPE.
+        vector_count (int): Number of vectors in the corpus.
+        config (dict): Application configuration.
+
+    Returns:
+        str: 'flat', 'hnsw' or 'ivfpq'.
+    """
+    index_type = requested or _setting(config, 'VECTOR_INDEX_TYPE')
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+    if index_type == 'auto':
+        if vector_count >= _setting(config, 'IVFPQ_MIN_VECTORS'):
+            return 'ivfpq'
+        if vector_count >= _setting(config, 'HNSW_MIN_VECTORS'):
+            return 'hnsw'
+        return 'flat'
+    return index_type
+
+def _pq_subquantizers(dim, requested):
+    # Product quantization needs the dimension to split evenly into sub-vectors
+    for m in range(min(requested, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+def build_index(vectors, index_type, config):
+    """
+    Build a FAISS index over the given vectors.
+
+    IVF-PQ indexes are trained on a random sample of the vectors first. If
+    the corpus is too small to train the requested number of clusters and
+    codebooks, an HNSW index is built instead.
+
+    Args:
+        vectors (numpy.ndarray): float32 array of shape (n, dim).
+        index_type (str): 'flat', 'hnsw' or 'ivfpq'.
+        config (dict): Application configuration.
+
+    Returns:
+        faiss.Index: The populated index.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+
+    if index_type == 'ivfpq':
+        nlist = _setting(config, 'IVF_NLIST') or max(1, int(4 * np.sqrt(count)))
+        nbits = _setting(config, 'IVFPQ_NBITS')
+        # FAISS wants roughly 39 training points per centroid for both quantizers
+        if count < 39 * max(nlist, 2 ** nbits):
+            index_type = 'hnsw'
+        else:
+            m = _pq_subquantizers(dim, _setting(config, 'IVFPQ_M'))
+            quantizer = faiss.IndexFlatL2(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits)
+            train_size = min(count, _setting(config, 'IVF_TRAIN_SIZE'))
+            sample = vectors[np.random.default_rng(0).choice(count, train_size, replace=False)]
+            index.train(sample)
+            index.add(vectors)
+            index.nprobe = _setting(config, 'IVF_NPROBE')
+            return index
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, _setting(config, 'HNSW_M'))
+        index.hnsw.efConstruction = _setting(config, 'HNSW_EF_CONSTRUCTION')
+        index.add(vectors)
+        index.hnsw.efSearch = _setting(config, 'HNSW_EF_SEARCH')
+        return index
+
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    return index
+
+def save_index(index, path):
+    """
+    Write an index to disk atomically so concurrent readers never see a partial file.
+
+    Args:
+        index (faiss.Index): The index to save.
+        path (str): Destination file path.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+def load_index(path, mmap=True, config=None):
+    """
+    Load an index from disk, memory-mapping it read-only when possible.
+
+    Memory-mapped indexes share the operating system's page cache, so every
+    gunicorn and Celery worker on a host searching the same corpus holds a
+    single physical copy of the vectors.
+
+    Args:
+        path (str): Index file path.
+        mmap (bool): Whether to memory-map the index data.
+        config (dict, optional): Configuration providing search-time parameters.
+
+    Returns:
+        faiss.Index: The loaded index.
+    """
+    flags = 0
+    if mmap:
+        with open(path, 'rb') as f:
+            fourcc = f.read(4)
+        # IVF indexes map their inverted lists; flat and HNSW indexes map their code
+        # arrays. FAISS rejects both flags together on IVF files.
+        if fourcc.startswith(b'Iw'):
+            flags = faiss.IO_FLAG_MMAP
+        else:
+            flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+        flags |= faiss.IO_FLAG_READ_ONLY
+    index = faiss.read_index(path, flags)
+
+    # Search-time parameters are not stored in the file
+    config = config or {}
+    if isinstance(index, faiss.IndexHNSWFlat):
+        index.hnsw.efSearch = _setting(config, 'HNSW_EF_SEARCH')
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = _setting(config, 'IVF_NPROBE')
+    return index
+
+def search_index(index, query_vector, k=5):
+    """
+    Find the nearest vectors to a query.
+
+    Args:
+        index (faiss.Index): The index to search.
+        query_vector (list or numpy.ndarray): The query embedding.
+        k (int): Number of neighbours.
+
+    Returns:
+        list: (position, L2 distance) pairs, nearest first.
+    """
+    query = np.asarray([query_vector], dtype=np.float32)
+    distances, positions = index.search(query, min(k, index.ntotal))
+    return [(int(p), float(d)) for p, d in zip(positions[0], distances[0]) if p >= 0]
+
+def reconstruct_vectors(index, positions):
+    """
+    Recover the stored vectors at the given positions.
+
+    Args:
+        index (faiss.Index): The index.
+        positions (list): Vector positions.
+
+    Returns:
+        numpy.ndarray: The vectors (approximate for IVF-PQ), or None if the index
+        type cannot reconstruct them.
+    """
+    try:
+        return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    except RuntimeError:
+        return None
+
+def corpus_key(texts, model, index_type):
+    """
+    Derive the storage key of a corpus index from its chunks and build settings.
+
+    Args:
+        texts (list): The chunk texts, in index order.
+        model (str): The embedding model name.
+        index_type (str): The index type.
+
+    Returns:
+        str: A hex SHA-256 key.
+    """
+    digest = hashlib.sha256(json.dumps([model, index_type]).encode('utf-8'))
+    for text in texts:
+        data = text.encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+class IndexCache:
+    """
+    Per-process LRU cache of loaded indexes, backed by a directory of index files.
+
+    A corpus that was indexed before, by this or any other worker sharing the
+    directory, is memory-mapped from disk instead of being embedded again.
+    Index files not used for ttl seconds are deleted, and the least recently
+    used ones beyond max_bytes, by a background purge started from put() at
+    most every purge_interval seconds. Workers that still map a deleted file
+    keep using it until they drop it.
+    """
+
+    def __init__(self, directory, max_loaded=8, ttl=604800, max_bytes=None, purge_interval=3600):
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._purge = PurgeScheduler(self.purge_expired, purge_interval)
+
+    def path(self, key):
+        """Return the file path for an index key."""
+        return os.path.join(self.directory, key[:2], f"{key}.faiss")
+
+    def get(self, key, config=None):
+        """
+        Return the index stored under key, or None if it has not been built.
+
+        Args:
+            key (str): The corpus key.
+            config (dict, optional): Configuration providing search-time parameters.
+        """
+        path = self.path(key)
+        try:
+            # Mark the file as used so the purge keeps it
+            os.utime(path)
+            stored = True
+        except FileNotFoundError:
+            stored = False
+
+        with self._lock:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+                return self._loaded[key]
+        if not stored:
+            return None
+        index = load_index(path, mmap=True, config=config)
+        self._remember(key, index)
+        return index
+
+    def put(self, key, index):
+        """Save a freshly built index under key and keep it loaded."""
+        self._purge.maybe_run()
+        save_index(index, self.path(key))
+        self._remember(key, index)
+
+    def _remember(self, key, index):
+        with self._lock:
+            self._loaded[key] = index
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+    def purge_expired(self):
+        """
+        Delete index files unused for longer than the TTL, then the least recently used beyond max_bytes.
+
+        Returns:
+            int: The number of files removed.
+        """
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        cutoff = time.time() - self.ttl
+        total_bytes = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if mtime >= cutoff and (self.max_bytes is None or total_bytes <= self.max_bytes):
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        return removed
+
+# Guards lazy creation so concurrent request threads share one cache
+_init_lock = threading.Lock()
+
+def get_index_cache():
+    """
+    Return the index cache for the current application.
+
+    Returns:
+        IndexCache: The cache rooted at VECTOR_INDEX_DIR.
+    """
+    from flask import current_app
+    cache = current_app.extensions.get('index_cache')
+    if cache is None:
+        with _init_lock:
+            cache = current_app.extensions.get('index_cache')
+            if cache is None:
+                config = current_app.config
+                cache = IndexCache(
+                    config['VECTOR_INDEX_DIR'],
+                    max_loaded=config.get('VECTOR_INDEX_CACHE_SIZE', 8),
+                    ttl=config.get('VECTOR_INDEX_TTL', 604800),
+                    max_bytes=config.get('VECTOR_INDEX_MAX_BYTES'),
+                    purge_interval=config.get('VECTOR_INDEX_PURGE_INTERVAL', 3600)
+                )
+                current_app.extensions['index_cache'] = cache
+    return cache
@@ -1,112 +1,228 @@
 import os
-import json
 import time
+import uuid
+import threading
+from contextlib import nullcontext
+from celery.exceptions import SoftTimeLimitExceeded
 from .celery_worker import celery
 from dotenv import load_dotenv
-from app.services.document_generator import generate_document
-from app.services.file_processor import process_context_files
+from app.services.document_generator import generate_document_from_texts, is_generation_error
+from app.services.result_store import get_result_store
+from app.services.blob_store import get_blob_store
+from app.services.single_flight import fingerprint_request, get_single_flight
+from app.services.checkpoints import TaskCheckpoint, checkpointing
+from app.services.profiling import active_profile, profiled
+from app.services.rendering import new_renderer, rendering, save_renditions
+from app.services.semantic_cache import run_with_semantic_cache
+from app.services.rate_limiter import request_priority
+from app.services.task_routing import (estimate_generation_cost, choose_queue, get_queue_metrics,
+                                       DEFAULT_GENERATION_QUEUE)
 
 # Load environment variables
 load_dotenv()
 
-# A simple in-memory store for task progress
-# In production, you'd want to use Redis directly
-task_progress = {}
+# This worker process's Flask app; see get_worker_app
+_worker_app = None
+_worker_app_lock = threading.Lock()
+
+def get_worker_app():
+    """
+    Return the Flask app for this worker process, creating it on first use.
+
+    Tasks share one app so its extensions (rate limit buckets, the semantic
+    cache index, store and Redis clients) persist across tasks instead of
+    starting empty for each one. It is created lazily, in the worker process
+    that runs the task, so nothing is shared across the prefork pool's fork.
+    """
+    global _worker_app
+    if _worker_app is not None:
+        return _worker_app
+    with _worker_app_lock:
+        if _worker_app is None:
+            from app import create_app
+            _worker_app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+        return _worker_app
+
+def save_task_record(task_id, status, progress, message, result_id=None):
+    """
+    Save a task's progress to the shared result store.
+    
+    Web workers read these records to render the status and result pages,
+    so progress is visible regardless of which process handles the request.
+    
+    Args:
+        task_id (str): The task ID.
+        status (str): One of 'queued', 'running', 'done' or 'error'.
+        progress (int): Completion percentage.
+        message (str): Human-readable status message.
+        result_id (str, optional): Result store ID of the generated document.
+    """
+    get_result_store().put({
+        'status': status,
+        'progress': progress,
+        'message': message,
+        'result_id': result_id
+    }, result_id=f"task:{task_id}")
+
+def record_queue_metric(method, *args):
+    """Record a queue metric, logging rather than failing the task if Redis is unavailable."""
+    from flask import current_app
+    try:
+        getattr(get_queue_metrics(), method)(*args)
+    except Exception as e:
+        current_app.logger.warning(f"Could not record queue metric {method}: {e}")
+
+def enqueue_generation(template_text, info_text, context_texts=None, priority='interactive', retrieval_engine=None,
+                       profile=None):
+    """
+    Queue a document generation on Celery.
+    
+    The texts are written to the blob store and only their references go
+    through the broker. The task is routed to a queue by priority and
+    estimated size (see choose_queue), so long jobs never hold up short
+    ones. Must be called within an application context.
+    
+    Args:
+        template_text (str): The document template text.
+        info_text (str): The original document text.
+        context_texts (list, optional): Text content of each context file.
+        priority (str): OpenAI call priority, 'interactive' or 'batch'.
+        retrieval_engine (str, optional): Retrieval engine for the context texts.
+        profile (bool, optional): Profile the task under its task ID; defaults to
+            whether the calling request is being profiled.
+        
+    Returns:
+        str: The task ID.
+    """
+    from flask import current_app
+    task_id = uuid.uuid4().hex
+    if profile is None:
+        profile = active_profile() is not None
+    queue = choose_queue(priority, estimate_generation_cost(template_text, info_text, context_texts), current_app.config)
+    save_task_record(task_id, 'queued', 0, 'Waiting for a worker...')
+    blobs = get_blob_store()
+    context_refs = [blobs.put(text) for text in context_texts] if context_texts else None
+    generate_document_task.apply_async(
+        args=(blobs.put(template_text), blobs.put(info_text), context_refs),
+        kwargs={'priority': priority, 'retrieval_engine': retrieval_engine, 'enqueued_at': time.time(),
+                'profile': profile},
+        task_id=task_id,
+        queue=queue
+    )
+    record_queue_metric('record_enqueued', queue)
+    return task_id
 
 @celery.task(bind=True)
-def generate_document_task(self, template_text, info_text, context_files_content=None):
+def generate_document_task(self, template_text, info_text, context_files_content=None, priority='interactive',
+                           retrieval_engine=None, enqueued_at=None, profile=False):
     """
     Celery task to generate a document in the background.
     
+    The inputs are normally blob references (see enqueue_generation); literal
+    texts are still accepted. The generated document goes to the result store
+    and only its ID is returned, so broker and backend payloads stay small.
+    
+    Completed stages and chunk summaries are checkpointed under the task ID.
+    A task redelivered after a worker crash, or retried after hitting the soft
+    time limit, resumes from the last checkpoint instead of starting over.
+    
     Args:
         self: Celery task instance
-        template_text (str): The document template text
-        info_text (str): The original document text
-        context_files_content (list): List of context file contents (optional)
+        template_text (str): Blob reference to (or text of) the document template
+        info_text (str): Blob reference to (or text of) the original document
+        context_files_content (list): Blob references to (or texts of) the context files (optional)
+        priority (str): OpenAI call priority, 'interactive' or 'batch'
+        retrieval_engine (str): Retrieval engine for the context files (optional)
+        enqueued_at (float): Time the task was queued, for queue wait metrics (optional)
+        profile (bool): Profile the task; the report is saved under the task ID (optional)
         
     Returns:
-        str: The generated document
+        dict: The task status and the result store ID of the generated document
     """
-    # Initialize task state
-    self.update_state(
-        state='PROGRESS',
-        meta={'current': 0, 'total': 100, 'status': 'Starting document generation...'}
-    )
-    
-    task_progress[self.request.id] = {
-        'current': 0,
-        'total': 100,
-        'status': 'Starting document generation...'
-    }
+    app = get_worker_app()
     
-    try:
-        # Process context if provided
-        context_chunks = None
-        if context_files_content:
+    profile_scope = profiled(f"task {self.name}", profile_id=self.request.id) if profile else nullcontext()
+    with app.app_context(), request_priority(priority), profile_scope:
+        def report(current, status):
             self.update_state(
                 state='PROGRESS',
-                meta={'current': 10, 'total': 100, 'status': 'Processing context files...'}
+                meta={'current': current, 'total': 100, 'status': status}
             )
-            task_progress[self.request.id]['current'] = 10
-            task_progress[self.request.id]['status'] = 'Processing context files...'
-            
-            # Here you would need to implement a version of process_context_files
-            # that works with the content directly rather than file objects
-            # For simplicity, we'll assume no context files for now
-            pass
-        
-        # Update progress to indicate summarization is starting
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 30, 'total': 100, 'status': 'Summarizing document...'}
-        )
-        task_progress[self.request.id]['current'] = 30
-        task_progress[self.request.id]['status'] = 'Summarizing document...'
+            save_task_record(self.request.id, 'running', current, status)
         
-        # Generate the document
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 50, 'total': 100, 'status': 'Generating document...'}
-        )
-        task_progress[self.request.id]['current'] = 50
-        task_progress[self.request.id]['status'] = 'Generating document...'
+        queue = (self.request.delivery_info or {}).get('routing_key') or DEFAULT_GENERATION_QUEUE
+        started = time.time()
+        record_queue_metric('record_started', queue, started - enqueued_at if enqueued_at else 0.0)
         
-        # Import here to ensure Flask app context is available
-        from app import create_app
-        app = create_app()
+        checkpoint = TaskCheckpoint(get_result_store(), self.request.id, ttl=app.config.get('CHECKPOINT_TTL', 86400))
+        resuming = checkpoint.get('started') is not None
         
-        with app.app_context():
-            final_document = generate_document(template_text, info_text, context_chunks)
-        
-        # Simulating processing time
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 90, 'total': 100, 'status': 'Finalizing document...'}
-        )
-        task_progress[self.request.id]['current'] = 90
-        task_progress[self.request.id]['status'] = 'Finalizing document...'
+        try:
+            if resuming:
+                report(0, 'Resuming from checkpoint...')
+            else:
+                checkpoint.put('started', True)
+                report(0, 'Starting document generation...')
+            blobs = get_blob_store()
+            template_text = blobs.resolve(template_text)
+            info_text = blobs.resolve(info_text)
+            if context_files_content:
+                context_files_content = [blobs.resolve(content) for content in context_files_content]
+            report(30, 'Processing context and generating document...' if context_files_content else 'Generating document...')
+            
+            # The download files are rendered from the completion as it streams in
+            renderer = new_renderer()
+            with checkpointing(checkpoint), rendering(renderer):
+                if resuming:
+                    # The previous attempt may still hold the single-flight lock if its worker died
+                    final_document = generate_document_from_texts(
+                        template_text, info_text, context_files_content, retrieval_engine
+                    )
+                else:
+                    # Duplicate tasks attach to an identical in-flight generation, and
+                    # near-duplicates of earlier sources may be served from the semantic cache
+                    params = {'retrieval_engine': retrieval_engine}
+                    key = fingerprint_request(template_text, info_text, context=context_files_content, params=params)
+                    final_document = run_with_semantic_cache(
+                        template_text, info_text,
+                        lambda: get_single_flight().run(
+                            key, generate_document_from_texts, template_text, info_text, context_files_content,
+                            retrieval_engine
+                        ),
+                        context=context_files_content, params=params
+                    )
+            
+            if is_generation_error(final_document):
+                # Not stored as a 'done' result; the error record below shows the message instead
+                raise RuntimeError(final_document)
+            
+            report(90, 'Finalizing document...')
+            result_id = get_result_store().put(final_document)
+            if renderer is not None:
+                save_renditions(result_id, renderer.finish(final_document))
+            save_task_record(self.request.id, 'done', 100, 'Complete', result_id=result_id)
+            record_queue_metric('record_finished', queue, time.time() - started, True)
+            
+            return {'status': 'Complete', 'result_id': result_id}
         
-        # Set final state
-        task_progress[self.request.id] = {
-            'current': 100,
-            'total': 100,
-            'status': 'Complete',
-            'result': final_document
-        }
+        except SoftTimeLimitExceeded as e:
+            # Retry under the same task ID; completed stages are restored from the checkpoint
+            max_resumes = app.config.get('TASK_MAX_RESUMES', 5)
+            if self.request.retries < max_resumes:
+                save_task_record(self.request.id, 'running', 30, 'Time limit reached; resuming from the last checkpoint...')
+                record_queue_metric('record_finished', queue, time.time() - started, False)
+                raise self.retry(exc=e, countdown=1, max_retries=max_resumes)
+            save_task_record(self.request.id, 'error', 100, 'Generation did not finish within the time limit')
+            record_queue_metric('record_finished', queue, time.time() - started, False)
+            raise
         
-        return {'status': 'Complete', 'result': final_document}
-    
-    except Exception as e:
-        # Update state to indicate failure
-        error_message = str(e)
-        task_progress[self.request.id] = {
-            'current': 100,
-            'total': 100,
-            'status': 'Error',
-            'error': error_message
-        }
-        self.update_state(
-            state='FAILURE',
-            meta={'status': 'Error', 'error': error_message}
-        )
-        raise
\ No newline at end of file
+        except Exception as e:
+            # Update state to indicate failure
+            error_message = str(e)
+            save_task_record(self.request.id, 'error', 100, error_message)
+            record_queue_metric('record_finished', queue, time.time() - started, False)
+            self.update_state(
+                state='FAILURE',
+                meta={'status': 'Error', 'error': error_message}
+            )
+            raise
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+import time
+import importlib
+
+# Modules the request path would otherwise import lazily on first use
+WARMUP_MODULES = [
+    'openai',
+    'langchain.text_splitter',
+    'langchain.docstore.document',
+    'langchain.embeddings',
+    'langchain.vectorstores',
+    'langchain.chat_models',
+    'langchain.chains.summarize',
+    'faiss',
+    'docx',
+    'PyPDF2',
+    'weasyprint',
+    'app.services.document_generator',
+    'app.services.file_processor',
+]
+
+# Cached objects holding sockets that must not be shared across a fork
+FORK_UNSAFE_EXTENSIONS = ['redis_client', 'result_store', 'single_flight', 'rate_governors', 'queue_metrics',
+                          'semantic_cache', 'pdf_pool']
+
+def warm_up(app, modules=None):
+    """
+    Import the heavy modules used by the generation pipeline ahead of time.
+
+    Run this in the gunicorn master with preload enabled so every forked
+    worker inherits the imported modules instead of paying for them on its
+    first request. Only modules are imported; no network clients are created,
+    which keeps the warm-up fork-safe.
+
+    Args:
+        app (Flask): The application instance.
+        modules (list, optional): Module names to import; defaults to WARMUP_MODULES.
+
+    Returns:
+        dict: Import time in seconds per module (None for modules that failed to import).
+    """
+    timings = {}
+    for name in modules or WARMUP_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            timings[name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            app.logger.warning(f"Warm-up could not import {name}: {e}")
+            timings[name] = None
+
+    # Prompts are loaded by create_app; touching them here fails fast if they are missing
+    if not app.config.get('PROMPTS'):
+        raise ValueError("Prompts not loaded in application configuration.")
+
+    return timings
+
+def reset_after_fork(app):
+    """
+    Drop cached network clients inherited from the master process.
+
+    Each worker then lazily opens its own connections on first use.
+
+    Args:
+        app (Flask): The application instance.
+    """
+    for name in FORK_UNSAFE_EXTENSIONS:
+        app.extensions.pop(name, None)
+
+def install_latency_reporting(app, startup_seconds, warmup_timings=None):
+    """
+    Record startup latency and log the latency of each worker's first request.
+
+    The report is kept in app.extensions['startup_report'] and exposed by the
+    API health check.
+
+    Args:
+        app (Flask): The application instance.
+        startup_seconds (float): Time taken to create (and warm) the application.
+        warmup_timings (dict, optional): Per-module import times from warm_up.
+    """
+    report = {
+        'startup_seconds': round(startup_seconds, 4),
+        'warmed_up': warmup_timings is not None,
+        'warmup_modules': warmup_timings or {},
+        'first_request_seconds': {},
+    }
+    app.extensions['startup_report'] = report
+    app.logger.info(f"Application ready in {startup_seconds:.2f}s (warm-up {'on' if warmup_timings is not None else 'off'})")
+
+    @app.before_request
+    def _start_request_timer():
+        from flask import g
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _report_first_request(response):
+        from flask import g, request
+        pid = str(os.getpid())
+        started = getattr(g, 'request_started', None)
+        if started is not None and pid not in report['first_request_seconds']:
+            elapsed = round(time.perf_counter() - started, 4)
+            report['first_request_seconds'][pid] = elapsed
+            app.logger.info(f"First request in worker {pid} ({request.path}) took {elapsed:.2f}s")
+        return response
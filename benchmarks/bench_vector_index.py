@@ -0,0 +1,83 @@
+"""
+Benchmark recall and latency of the vector index types.
+
+Builds flat, HNSW and IVF-PQ indexes over synthetic clustered vectors
+(shaped like OpenAI embeddings), then measures build time, file size,
+memory-mapped load time, recall@k against exact search and query latency.
+IVF-PQ needs enough vectors to train (see build_index); below that the
+"built as" column shows the HNSW fallback.
+
+Uniform synthetic data is harder for graph and quantised indexes than real
+embeddings, so use --ef-search and --nprobe to find the recall/latency
+trade-off before changing HNSW_EF_SEARCH or IVF_NPROBE.
+
+Usage:
+    python -m benchmarks.bench_vector_index --vectors 200000 --dim 1536
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from app.services.vector_index import DEFAULT_INDEX_CONFIG, build_index, save_index, load_index
+
+def make_vectors(count, dim, clusters, seed):
+    """Generate unit-normalised vectors grouped around random centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.2 * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def measure(index, queries, truth, k):
+    """Return recall@k and per-query latencies in milliseconds."""
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, positions = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(positions[0].tolist()) & set(expected.tolist()))
+    return hits / (len(queries) * k), np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--clusters', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', default='flat,hnsw,ivfpq')
+    parser.add_argument('--ef-search', type=int, default=DEFAULT_INDEX_CONFIG['HNSW_EF_SEARCH'])
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_INDEX_CONFIG['IVF_NPROBE'])
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dim, args.clusters, seed=0)
+    queries = make_vectors(args.queries, args.dim, args.clusters, seed=1)
+    config = dict(DEFAULT_INDEX_CONFIG, HNSW_EF_SEARCH=args.ef_search, IVF_NPROBE=args.nprobe)
+
+    # Exact search gives the ground truth for recall
+    exact = build_index(vectors, 'flat', config)
+    _, truth = exact.search(queries, args.k)
+
+    print(f"{args.vectors} vectors, dim {args.dim}, {args.queries} queries, recall@{args.k}")
+    print(f"{'type':<8}{'built as':>16}{'build s':>10}{'size MB':>10}{'load ms':>10}{'recall':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for index_type in args.types.split(','):
+            start = time.perf_counter()
+            index = build_index(vectors, index_type, config)
+            build_seconds = time.perf_counter() - start
+
+            path = os.path.join(directory, f"{index_type}.faiss")
+            save_index(index, path)
+            start = time.perf_counter()
+            mapped = load_index(path, mmap=True, config=config)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            recall, latencies = measure(mapped, queries, truth, args.k)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            size_mb = os.path.getsize(path) / 1e6
+            print(f"{index_type:<8}{type(mapped).__name__:>16}{build_seconds:>10.2f}{size_mb:>10.1f}{load_ms:>10.1f}{recall:>10.3f}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+"""
+Load-test the web, API and Celery generation paths against a stub LLM.
+
+For every configuration (gunicorn worker count, and Celery concurrency for
+the celery target) this starts a local stub OpenAI server
+(benchmarks.stub_llm), gunicorn with gunicorn.conf.py and, for the celery
+target, a Celery worker. It then drives requests and reports throughput,
+p50/p95/p99 latency, error rate and peak resident memory per worker.
+Everything runs on one Linux machine and needs no network access. The
+celery target needs a local Redis at REDIS_URL.
+
+Targets:
+    api     POST /api/generate (multipart), answered inline
+    web     POST /generate (the HTML form)
+    celery  POST /api/generate with every request diverted to Celery, then
+            polled until done; latency is end to end
+
+Requests arrive open-loop as a Poisson process at --rate per second, or
+closed-loop from --concurrency clients when --rate is 0. --mix weights the
+file profiles in FILE_PROFILES. Each request gets unique content, so
+duplicate-request handling does not collapse the load, unless
+--duplicate-rate says otherwise.
+
+Usage:
+    python -m benchmarks.load_test --targets api,web --workers 2,4 --rate 2 --duration 60
+    python -m benchmarks.load_test --targets celery --celery-concurrency 2,8 --concurrency 16 --latency-scale 0.2
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.stub_llm import make_server, add_profile_arguments, profile_from_args
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = ('api', 'web', 'celery')
+
+# Uploaded file shapes: characters of the info document, its format, and context files
+FILE_PROFILES = {
+    'small': {'info_chars': 3000, 'info_format': 'txt', 'context_files': 0, 'context_chars': 0},
+    'medium': {'info_chars': 20000, 'info_format': 'docx', 'context_files': 2, 'context_chars': 10000},
+    'large': {'info_chars': 120000, 'info_format': 'txt', 'context_files': 5, 'context_chars': 40000},
+}
+
+TEMPLATE_TEXT = (
+    "Project Report\n\n1. Executive summary\n2. Objectives\n3. Budget and timeline\n"
+    "4. Risks and mitigations\n5. Next steps\n"
+)
+WORDS = ("budget timeline risk customer revenue delivery milestone security hiring vendor contract "
+         "forecast scope quality review migration platform roadmap compliance training").split()
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+def parse_mix(value):
+    """Parse 'small=3,medium=1' into profile weights."""
+    mix = {}
+    for item in parse_list(value):
+        name, _, weight = item.partition('=')
+        if name not in FILE_PROFILES:
+            raise argparse.ArgumentTypeError(f"Unknown file profile: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def synthetic_text(rng, chars):
+    """Generate sentence-shaped filler text of about the given length."""
+    sentences = []
+    length = 0
+    while length < chars:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + '.'
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(sentences)
+
+def as_docx(text):
+    """Wrap text in a DOCX of 1000-character paragraphs, or return None without python-docx."""
+    try:
+        from docx import Document
+    except ImportError:
+        return None
+    doc = Document()
+    for start in range(0, len(text), 1000):
+        doc.add_paragraph(text[start:start + 1000])
+    f = io.BytesIO()
+    doc.save(f)
+    return f.getvalue()
+
+class PayloadFactory:
+    """Builds multipart upload payloads following the configured file mix."""
+
+    def __init__(self, mix, duplicate_rate=0.0, seed=0):
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.duplicate_rate = duplicate_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # Base texts are generated once per profile; a nonce makes each request unique
+        self.base = {
+            name: (synthetic_text(self.rng, profile['info_chars']),
+                   [synthetic_text(self.rng, profile['context_chars']) for _ in range(profile['context_files'])])
+            for name, profile in FILE_PROFILES.items() if name in mix
+        }
+
+    def make(self):
+        """Return (profile name, form fields, files) for one request."""
+        with self.lock:
+            name = self.rng.choices(self.names, self.weights)[0]
+            duplicate = self.rng.random() < self.duplicate_rate
+        profile = FILE_PROFILES[name]
+        info_text, context_texts = self.base[name]
+        if not duplicate:
+            info_text = f"Reference {uuid.uuid4().hex}. {info_text}"
+
+        files = [('template_file', 'template.txt', TEMPLATE_TEXT.encode('utf-8'))]
+        info_docx = as_docx(info_text) if profile['info_format'] == 'docx' else None
+        if info_docx is not None:
+            files.append(('info_file', 'info.docx', info_docx))
+        else:
+            files.append(('info_file', 'info.txt', info_text.encode('utf-8')))
+        for i, text in enumerate(context_texts):
+            files.append(('context_files', f"context{i}.txt", text.encode('utf-8')))
+        return name, {'output_format': 'text'}, files
+
+def encode_multipart(fields, files):
+    """Encode form fields and (field, filename, bytes) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode('utf-8'))
+    for name, filename, data in files:
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n".encode('utf-8') + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode('utf-8'))
+    return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+def http_request(base_url, method, path, body=None, headers=None, timeout=900):
+    """Make one HTTP request without following redirects; return (status, headers, body)."""
+    parts = urlsplit(base_url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+def run_request(base_url, target, payload_factory, poll_interval=0.5, timeout=900):
+    """
+    Send one generation request and wait for its outcome.
+
+    Returns:
+        dict: profile, ok, status and latency in seconds.
+    """
+    profile, fields, files = payload_factory.make()
+    body, content_type = encode_multipart(fields, files)
+    path = '/generate' if target == 'web' else '/api/generate'
+    started = time.perf_counter()
+    try:
+        status, headers, content = http_request(base_url, 'POST', path, body, {'Content-Type': content_type}, timeout)
+        ok = status == 200
+        if target == 'celery' and status == 202:
+            status_url = headers.get('Location') or json.loads(content)['status_url']
+            deadline = started + timeout
+            while time.perf_counter() < deadline:
+                time.sleep(poll_interval)
+                status, _, content = http_request(base_url, 'GET', status_url, timeout=timeout)
+                if status != 200:
+                    break
+                task = json.loads(content)
+                if 'result' in task:
+                    break
+                if task.get('status') == 'error':
+                    status = 'task_error'
+                    break
+            ok = status == 200 and 'result' in json.loads(content)
+        elif target == 'celery':
+            # Anything but 202 means the request was not diverted to Celery
+            ok = False
+    except Exception as e:
+        status, ok = type(e).__name__, False
+    return {'profile': profile, 'ok': ok, 'status': status, 'latency': time.perf_counter() - started}
+
+def drive_load(base_url, target, payload_factory, duration, rate=0.0, concurrency=8, max_clients=256, seed=0):
+    """
+    Drive requests for duration seconds and wait for the outstanding ones.
+
+    With rate > 0, requests arrive as a Poisson process (open loop); otherwise
+    concurrency clients send back-to-back requests (closed loop).
+
+    Returns:
+        tuple: (list of request results, elapsed seconds including the drain)
+    """
+    results = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    stop_at = started + duration
+
+    def record(result):
+        with lock:
+            results.append(result)
+
+    if rate > 0:
+        rng = random.Random(seed)
+        with ThreadPoolExecutor(max_workers=max_clients) as executor:
+            next_arrival = started
+            while True:
+                next_arrival += rng.expovariate(rate)
+                if next_arrival >= stop_at:
+                    break
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                executor.submit(lambda: record(run_request(base_url, target, payload_factory)))
+    else:
+        def client():
+            while time.perf_counter() < stop_at:
+                record(run_request(base_url, target, payload_factory))
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results, time.perf_counter() - started
+
+def descendants(root_pid):
+    """Return the PIDs of all descendants of a process, read from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields after it are positional
+                fields = f.read().rsplit(')', 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            continue
+    found, stack = [], [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+def rss_mb(pid):
+    """Resident set size of a process in MB, or None if it has exited."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+class MemorySampler(threading.Thread):
+    """Periodically records the peak RSS of every worker process under the given roots."""
+
+    def __init__(self, roots, interval=0.5):
+        super().__init__(daemon=True)
+        self.roots = roots  # label -> root pid
+        self.interval = interval
+        self.peaks = {label: {} for label in roots}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for label, root in self.roots.items():
+                for pid in descendants(root):
+                    rss = rss_mb(pid)
+                    if rss is not None:
+                        self.peaks[label][pid] = max(rss, self.peaks[label].get(pid, 0.0))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self):
+        """Per label: worker count, mean and max of per-worker peak RSS (MB)."""
+        report = {}
+        for label, peaks in self.peaks.items():
+            values = list(peaks.values())
+            report[label] = {
+                'workers': len(values),
+                'mean_peak_rss_mb': round(float(np.mean(values)), 1) if values else None,
+                'max_peak_rss_mb': round(max(values), 1) if values else None,
+            }
+        return report
+
+def start_process(command, env, log_path):
+    log = open(log_path, 'ab')
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+def stop_process(process, timeout=30):
+    if process.poll() is not None:
+        return
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+def wait_until_ready(base_url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if http_request(base_url, 'GET', '/api/health', timeout=5)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become ready")
+
+def summarize(results, elapsed):
+    """Compute throughput, latency percentiles and error rate for a run."""
+    latencies = np.array([r['latency'] for r in results if r['ok']])
+    statuses = {}
+    for r in results:
+        statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (float('nan'),) * 3
+    return {
+        'requests': len(results),
+        'succeeded': int(len(latencies)),
+        'error_rate': round(1 - len(latencies) / len(results), 4) if results else 0.0,
+        'throughput_per_s': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        'p50_s': round(float(p50), 3),
+        'p95_s': round(float(p95), 3),
+        'p99_s': round(float(p99), 3),
+        'statuses': statuses,
+    }
+
+def run_configuration(args, target, workers, celery_concurrency, stub_url, log_dir):
+    """Start the servers for one configuration, drive load and return its report row."""
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(args.port),
+        'WEB_CONCURRENCY': str(workers),
+        'FLASK_CONFIG': args.config,
+        'OPENAI_BASE_URL': stub_url,
+        'OPENAI_API_KEY': env.get('OPENAI_API_KEY') or 'stub',
+        'SECRET_KEY': env.get('SECRET_KEY') or 'load-test',
+        'ADMISSION_DIR': tempfile.mkdtemp(prefix='admission-', dir=log_dir),
+    })
+    if not args.keep_rate_limits:
+        # The stub has no quota; only measure the application's own limits
+        env.update({'OPENAI_CHAT_RPM': '1000000', 'OPENAI_CHAT_TPM': '1000000000',
+                    'OPENAI_EMBEDDING_RPM': '1000000', 'OPENAI_EMBEDDING_TPM': '1000000000'})
+    if target == 'celery':
+        env.update({'ADMISSION_OVERFLOW': 'celery', 'MAX_CONCURRENT_GENERATIONS': '0', 'MAX_QUEUED_GENERATIONS': '0'})
+
+    label = f"{target}-w{workers}" + (f"-c{celery_concurrency}" if target == 'celery' else '')
+    processes = {'web': start_process(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+        env, os.path.join(log_dir, f"{label}-gunicorn.log")
+    )}
+    if target == 'celery':
+        processes['celery'] = start_process(
+            [sys.executable, '-m', 'celery', '-A', 'app.celery_worker.celery', 'worker',
+             '--concurrency', str(celery_concurrency), '--loglevel', 'WARNING'],
+            env, os.path.join(log_dir, f"{label}-celery.log")
+        )
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    sampler = MemorySampler({name: process.pid for name, process in processes.items()})
+    try:
+        wait_until_ready(base_url, processes['web'])
+        sampler.start()
+        payloads = PayloadFactory(args.mix, args.duplicate_rate, seed=args.seed)
+        results, elapsed = drive_load(base_url, target, payloads, args.duration, args.rate, args.concurrency,
+                                      seed=args.seed)
+    finally:
+        if sampler.is_alive():
+            sampler.stop()
+        for process in processes.values():
+            stop_process(process)
+
+    row = {'configuration': label, 'target': target, 'web_workers': workers,
+           'celery_concurrency': celery_concurrency if target == 'celery' else None}
+    row.update(summarize(results, elapsed))
+    row['memory'] = sampler.summary()
+    return row
+
+def print_row(row):
+    memory = row['memory']
+    web = memory.get('web', {})
+    celery = memory.get('celery', {})
+    print(f"{row['configuration']:<18}{row['requests']:>8}{row['throughput_per_s']:>10.2f}"
+          f"{row['p50_s']:>9.2f}{row['p95_s']:>9.2f}{row['p99_s']:>9.2f}{row['error_rate']:>8.1%}"
+          f"{web.get('max_peak_rss_mb') or 0:>11.0f}{celery.get('max_peak_rss_mb') or 0:>11.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', type=lambda v: parse_list(v), default=['api'])
+    parser.add_argument('--workers', type=lambda v: parse_list(v, int), default=[2], help="gunicorn worker counts")
+    parser.add_argument('--celery-concurrency', type=lambda v: parse_list(v, int), default=[4])
+    parser.add_argument('--rate', type=float, default=0.0, help="Open-loop arrivals per second (0: closed loop)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Closed-loop clients")
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds to send requests")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('small=3,medium=1,large=1'))
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=5051)
+    parser.add_argument('--stub-port', type=int, default=0)
+    parser.add_argument('--config', default='production')
+    parser.add_argument('--keep-rate-limits', action='store_true',
+                        help="Keep the configured OpenAI rate limits instead of lifting them")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-dir', default=None, help="Server logs (default: a temporary directory)")
+    parser.add_argument('--json', help="Also write the report rows to this file")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"Unknown targets: {', '.join(sorted(unknown))}")
+
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix='load-test-')
+    os.makedirs(log_dir, exist_ok=True)
+    stub = make_server(port=args.stub_port, profile=profile_from_args(args), seed=args.seed)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    print(f"Stub LLM at {stub_url}; server logs in {log_dir}")
+    print(f"{'configuration':<18}{'requests':>8}{'req/s':>10}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'errors':>8}"
+          f"{'web MB':>11}{'celery MB':>11}")
+
+    rows = []
+    for target in args.targets:
+        for workers in args.workers:
+            for celery_concurrency in (args.celery_concurrency if target == 'celery' else [None]):
+                row = run_configuration(args, target, workers, celery_concurrency, stub_url, log_dir)
+                rows.append(row)
+                print_row(row)
+
+    stub.shutdown()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == '__main__':
+    main()
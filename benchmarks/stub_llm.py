@@ -0,0 +1,404 @@
+"""
+Local stand-in for the OpenAI chat completions, embeddings and Batch endpoints.
+
+Answers with canned text and deterministic embeddings after a realistic,
+randomised delay, so the generation pipeline can be load-tested on one
+machine without network access or API spend. Point the application at it
+with OPENAI_BASE_URL=http://127.0.0.1:8900/v1.
+
+Chat latency is a log-normal time to first token plus a per-token
+generation time for a log-normally distributed number of output tokens
+(capped by max_tokens). Embedding latency is log-normal. --error-rate
+answers that fraction of calls with 429 and a Retry-After header.
+
+Batches (POST /v1/files with purpose "batch", then POST /v1/batches) stay
+in progress for --batch-seconds and then complete with a canned completion
+for every request line; with --error-rate, that fraction of lines ends up
+in the batch's error file instead.
+
+Usage:
+    python -m benchmarks.stub_llm --port 8900 --latency-scale 0.1
+"""
+import json
+import math
+import time
+import uuid
+import email
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+DEFAULT_PROFILE = {
+    'first_token_median': 0.6,   # Seconds before the first output token
+    'first_token_sigma': 0.5,
+    'token_seconds': 0.012,      # Seconds per generated token
+    'output_tokens_median': 700,
+    'output_tokens_sigma': 0.6,
+    'embedding_median': 0.2,     # Seconds per embeddings request
+    'embedding_sigma': 0.4,
+    'embedding_dim': 1536,
+    'latency_scale': 1.0,        # Multiplies every delay; < 1 compresses a run
+    'error_rate': 0.0,           # Fraction of calls answered with 429
+    'batch_seconds': 5.0,        # Seconds a batch stays in progress
+}
+
+FILLER = ("The stub model produced this sentence to stand in for generated text. "
+          "It covers the requested section with plausible, neutral content. ")
+
+def lognormal(rng, median, sigma):
+    """Sample a log-normal value with the given median."""
+    return rng.lognormvariate(math.log(median), sigma)
+
+def fake_embedding(text, dim):
+    """Return a deterministic unit vector for a text, so identical chunks embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+class StubState:
+    """Profile, random source and request counters shared by the handler threads."""
+
+    def __init__(self, profile=None, seed=0):
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {'chat': 0, 'embeddings': 0, 'rate_limited': 0, 'batches': 0, 'batch_requests': 0}
+        self.files = {}
+        self.batches = {}
+
+    def sample(self, median, sigma):
+        with self.lock:
+            return lognormal(self.rng, median, sigma)
+
+    def should_fail(self):
+        with self.lock:
+            return self.rng.random() < self.profile['error_rate']
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def add_file(self, data, filename, purpose):
+        """Store an uploaded or generated file and return its file object."""
+        file = {'id': f"file-stub-{uuid.uuid4().hex}", 'object': 'file', 'bytes': len(data),
+                'created_at': int(time.time()), 'filename': filename, 'purpose': purpose, 'status': 'processed'}
+        with self.lock:
+            self.files[file['id']] = (file, data)
+        return file
+
+    def completion(self, payload):
+        """
+        Build a canned completion for a chat request.
+
+        Returns:
+            tuple: (text, usage, seconds to first token, seconds per token), delays unscaled.
+        """
+        profile = self.profile
+        prompt_tokens = sum(estimate_tokens(str(m.get('content', ''))) for m in payload.get('messages', []))
+        limit = payload.get('max_tokens') or payload.get('max_completion_tokens') or 4096
+        output_tokens = max(1, min(limit, int(self.sample(profile['output_tokens_median'],
+                                                           profile['output_tokens_sigma']))))
+        first_token = self.sample(profile['first_token_median'], profile['first_token_sigma'])
+        text = (FILLER * (output_tokens * 4 // len(FILLER) + 1))[:output_tokens * 4]
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': output_tokens,
+                 'total_tokens': prompt_tokens + output_tokens}
+        return text, usage, first_token, profile['token_seconds']
+
+def completion_object(completion_id, model, text, usage):
+    return {
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+        'usage': usage,
+    }
+
+def run_batch(state, batch_id):
+    """Process a batch in the background: wait batch_seconds, then answer every request line."""
+    with state.lock:
+        batch = state.batches[batch_id]
+        _, data = state.files[batch['input_file_id']]
+        total = sum(1 for line in data.splitlines() if line.strip())
+        batch.update(status='in_progress', in_progress_at=int(time.time()),
+                     request_counts={'total': total, 'completed': 0, 'failed': 0})
+    time.sleep(state.profile['batch_seconds'] * state.profile['latency_scale'])
+
+    output, errors = [], []
+    for line in data.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        result = {'id': f"batch_req_{uuid.uuid4().hex}", 'custom_id': request.get('custom_id'), 'error': None}
+        if request.get('url') != batch['endpoint']:
+            result['response'] = {'status_code': 400, 'request_id': uuid.uuid4().hex, 'body': {
+                'error': {'message': f"Unsupported url {request.get('url')}", 'type': 'invalid_request_error'}}}
+            errors.append(result)
+        elif state.should_fail():
+            result['response'] = {'status_code': 429, 'request_id': uuid.uuid4().hex, 'body': {
+                'error': {'message': 'Rate limit reached (stub)', 'type': 'rate_limit_error'}}}
+            errors.append(result)
+        else:
+            body = request.get('body', {})
+            text, usage, _, _ = state.completion(body)
+            result['response'] = {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': completion_object(
+                f"chatcmpl-stub-{time.time_ns()}", body.get('model', 'stub'), text, usage)}
+            output.append(result)
+
+    def results_file(results, kind):
+        if not results:
+            return None
+        data = "".join(json.dumps(result) + "\n" for result in results).encode('utf-8')
+        return state.add_file(data, f"{batch_id}_{kind}.jsonl", 'batch_output')['id']
+
+    output_file_id = results_file(output, 'output')
+    error_file_id = results_file(errors, 'error')
+    state.count('batch_requests', len(output) + len(errors))
+    with state.lock:
+        batch.update(status='completed', completed_at=int(time.time()), output_file_id=output_file_id,
+                     error_file_id=error_file_id,
+                     request_counts={'total': len(output) + len(errors), 'completed': len(output),
+                                     'failed': len(errors)})
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the OpenAI endpoints the application uses."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'StubLLM/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_bytes(self, data, content_type='application/octet-stream'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        parts = path.split('/')
+        if path.endswith('/stats'):
+            with self.state.lock:
+                self.send_json(200, dict(self.state.counters))
+            return
+        if len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content':
+            with self.state.lock:
+                entry = self.state.files.get(parts[-2])
+            if entry is not None:
+                self.send_bytes(entry[1])
+                return
+        elif len(parts) >= 2 and parts[-2] == 'batches':
+            with self.state.lock:
+                batch = dict(self.state.batches[parts[-1]]) if parts[-1] in self.state.batches else None
+            if batch is not None:
+                self.send_json(200, batch)
+                return
+        self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        # Batch uploads are multipart and not subject to the per-call rate limit
+        if path.endswith('/files'):
+            self.upload_file()
+            return
+        payload = self.read_json()
+        if path.endswith('/batches'):
+            self.create_batch(payload)
+        elif self.state.should_fail():
+            self.state.count('rate_limited')
+            self.send_json(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'rate_limit_error'}},
+                           headers={'Retry-After': '1'})
+        elif path.endswith('/chat/completions'):
+            self.state.count('chat')
+            self.chat_completion(payload)
+        elif path.endswith('/embeddings'):
+            self.state.count('embeddings')
+            self.embeddings(payload)
+        else:
+            self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def upload_file(self):
+        """Store a multipart file upload (the file and purpose fields) and return its file object."""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8') + body
+        )
+        fields = {}
+        for part in message.get_payload() if message.is_multipart() else []:
+            name = part.get_param('name', header='content-disposition')
+            fields[name] = (part.get_filename(), part.get_payload(decode=True))
+        if 'file' not in fields:
+            self.send_json(400, {'error': {'message': "Missing file", 'type': 'invalid_request_error'}})
+            return
+        filename, data = fields['file']
+        purpose = fields.get('purpose', (None, b'batch'))[1].decode('utf-8')
+        self.send_json(200, self.state.add_file(data, filename or 'upload.jsonl', purpose))
+
+    def create_batch(self, payload):
+        with self.state.lock:
+            known = payload.get('input_file_id') in self.state.files
+        if not known:
+            self.send_json(404, {'error': {'message': f"No such file: {payload.get('input_file_id')}",
+                                           'type': 'invalid_request_error'}})
+            return
+        batch = {
+            'id': f"batch_stub_{uuid.uuid4().hex}",
+            'object': 'batch',
+            'endpoint': payload.get('endpoint', '/v1/chat/completions'),
+            'input_file_id': payload['input_file_id'],
+            'completion_window': payload.get('completion_window', '24h'),
+            'status': 'validating',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': int(time.time()),
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            'metadata': payload.get('metadata'),
+        }
+        with self.state.lock:
+            self.state.batches[batch['id']] = batch
+        self.state.count('batches')
+        threading.Thread(target=run_batch, args=(self.state, batch['id']), daemon=True).start()
+        self.send_json(200, batch)
+
+    def chat_completion(self, payload):
+        scale = self.state.profile['latency_scale']
+        text, usage, first_token, token_seconds = self.state.completion(payload)
+        completion_id = f"chatcmpl-stub-{time.time_ns()}"
+        model = payload.get('model', 'stub')
+
+        if payload.get('stream'):
+            include_usage = (payload.get('stream_options') or {}).get('include_usage', False)
+            self.stream_completion(completion_id, model, text, first_token * scale,
+                                   token_seconds * scale, usage if include_usage else None)
+            return
+
+        time.sleep((first_token + usage['completion_tokens'] * token_seconds) * scale)
+        self.send_json(200, completion_object(completion_id, model, text, usage))
+
+    def stream_completion(self, completion_id, model, text, first_token_delay, token_delay, usage=None):
+        """Send the completion as server-sent events, about four characters per token, then usage if given."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        time.sleep(first_token_delay)
+        event({'role': 'assistant', 'content': ''})
+        # Send a few tokens per event to keep the event count reasonable
+        step = 32
+        for start in range(0, len(text), step):
+            time.sleep(token_delay * step / 4)
+            event({'content': text[start:start + step]})
+        event({}, finish_reason='stop')
+        if usage is not None:
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': [], 'usage': usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def embeddings(self, payload):
+        profile = self.state.profile
+        inputs = payload.get('input', [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        time.sleep(self.state.sample(profile['embedding_median'], profile['embedding_sigma']) * profile['latency_scale'])
+
+        data = []
+        tokens = 0
+        for i, item in enumerate(inputs):
+            # Token-array inputs (pre-tokenised by the client) are hashed by their ids
+            text = item if isinstance(item, str) else ' '.join(map(str, item))
+            tokens += estimate_tokens(text)
+            vector = fake_embedding(text, profile['embedding_dim'])
+            if payload.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii')
+            else:
+                embedding = vector.tolist()
+            data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+
+        self.send_json(200, {
+            'object': 'list',
+            'data': data,
+            'model': payload.get('model', 'stub'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+def make_server(host='127.0.0.1', port=8900, profile=None, seed=0):
+    """
+    Create a stub server; call serve_forever() (or run it in a thread) to start it.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port to bind; 0 picks a free port.
+        profile (dict, optional): Overrides for DEFAULT_PROFILE.
+        seed (int): Seed for the latency distributions.
+
+    Returns:
+        ThreadingHTTPServer: The server, with the StubState on its state attribute.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(profile, seed)
+    return server
+
+def add_profile_arguments(parser):
+    """Add a command-line option for every DEFAULT_PROFILE setting."""
+    for name, default in DEFAULT_PROFILE.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+
+def profile_from_args(args):
+    return {name: getattr(args, name) for name in DEFAULT_PROFILE}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--seed', type=int, default=0)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, profile_from_args(args), args.seed)
+    print(f"Stub LLM listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import os
+import time
+
+# Load the application (and warm up the pipeline) once in the master, then fork
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+# Generation requests block on LLM calls for minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+
+_master_started = time.perf_counter()
+
+def when_ready(server):
+    """Log how long the master took to become ready to accept connections."""
+    server.log.info(f"Master ready in {time.perf_counter() - _master_started:.2f}s (preload={preload_app})")
+
+def post_fork(server, worker):
+    """Make sure no worker reuses network clients created in the master."""
+    from run import app
+    from app.warmup import reset_after_fork
+    reset_after_fork(app)
@@ -1,12 +1,20 @@
 import os
+import time
 from app import create_app
+from app.warmup import warm_up, install_latency_reporting
 from dotenv import load_dotenv
 
+_started = time.perf_counter()
+
 # Load environment variables
 load_dotenv()
 
 # Create app instance with the specified configuration
 app = create_app(os.getenv('FLASK_CONFIG', 'default'))
 
+# Import the generation pipeline up front (in the gunicorn master when preloading)
+warmup_timings = warm_up(app) if app.config.get('WARMUP_ON_STARTUP') else None
+install_latency_reporting(app, time.perf_counter() - _started, warmup_timings)
+
 if __name__ == '__main__':
     app.run(debug=app.config['DEBUG'], host=app.config.get('HOST', '127.0.0.1'), port=app.config.get('PORT', 5001))
\ No newline at end of file
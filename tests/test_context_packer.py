@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from app.services.chunking import split_corpus
+from app.services.context_packer import merge_spans, select_mmr, pack_context
+
+def test_merge_spans_joins_overlapping_and_touching_spans():
+    assert merge_spans([(10, 20), (0, 5), (15, 30), (30, 35), (40, 45)]) == [(0, 5), (10, 35), (40, 45)]
+    assert merge_spans([]) == []
+
+def test_select_mmr_prefers_relevant_then_diverse_candidates():
+    vectors = np.array([[1.0, 0.0], [0.9, 0.1], [0.6, 0.8]])
+    # Pure relevance keeps query order; a diversity weight promotes the dissimilar candidate
+    assert select_mmr(vectors, [1.0, 0.0], lambda_mult=1.0, duplicate_threshold=1.1) == [0, 1, 2]
+    assert select_mmr(vectors, [1.0, 0.0], lambda_mult=0.3, duplicate_threshold=1.1) == [0, 2, 1]
+
+def test_select_mmr_drops_near_duplicates():
+    vectors = np.array([[1.0, 0.0], [1.0, 0.001], [0.0, 1.0]])
+    assert select_mmr(vectors, [1.0, -0.2], duplicate_threshold=0.95) == [0, 2]
+
+def test_pack_context_merges_overlapping_chunks_and_respects_the_budget():
+    pytest.importorskip('langchain')
+    sentences = [f"Clause {n} sets the invoice payment terms for order {n}." for n in range(60)]
+    unrelated = "The picnic by the river was pleasant. " * 40
+    context_texts = [" ".join(sentences), unrelated]
+    docs = split_corpus(context_texts, chunk_size=200, chunk_overlap=50)
+
+    passages = pack_context(docs, context_texts, "invoice payment terms", token_budget=200)
+
+    assert passages
+    assert sum(len(p.page_content) for p in passages) // 4 <= 200 + 50
+    for passage in passages:
+        source, start = passage.metadata['source'], passage.metadata['start_index']
+        assert context_texts[source][start:start + len(passage.page_content)] == passage.page_content
+    # Overlapping chunks of one source come back as disjoint passages in source order
+    spans = [(p.metadata['source'], p.metadata['start_index'], p.metadata['start_index'] + len(p.page_content))
+             for p in passages]
+    assert spans == sorted(spans)
+    for (source_a, _, end_a), (source_b, start_b, _) in zip(spans, spans[1:]):
+        assert source_a != source_b or end_a < start_b
+
+def test_pack_context_keeps_the_best_chunk_even_over_budget():
+    pytest.importorskip('langchain')
+    text = "invoice payment terms " * 100
+    docs = split_corpus([text], chunk_size=1000, chunk_overlap=0)
+    passages = pack_context(docs, [text], "invoice payment", token_budget=1)
+    assert len(passages) == 1
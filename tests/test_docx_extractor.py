@@ -0,0 +1,67 @@
+import io
+from docx import Document
+from app.services.docx_extractor import extract_docx_text
+
+def save(document):
+    f = io.BytesIO()
+    document.save(f)
+    f.seek(0)
+    return f
+
+def test_paragraphs_and_tables_keep_document_order():
+    document = Document()
+    document.add_paragraph("Invoice summary")
+    table = document.add_table(rows=2, cols=3)
+    for row, values in zip(table.rows, [("Item", "Qty", "Amount"), ("Widget", "2", "40.00")]):
+        for cell, value in zip(row.cells, values):
+            cell.text = value
+    document.add_paragraph("Payment is due in thirty days.")
+
+    assert extract_docx_text(save(document)).split("\n") == [
+        "Invoice summary",
+        "Item | Qty | Amount",
+        "Widget | 2 | 40.00",
+        "Payment is due in thirty days.",
+    ]
+
+def test_empty_paragraphs_and_rows_are_skipped_and_separator_is_configurable():
+    document = Document()
+    document.add_paragraph("")
+    table = document.add_table(rows=2, cols=2)
+    table.rows[1].cells[0].text = "a"
+    table.rows[1].cells[1].text = "b"
+    assert extract_docx_text(save(document), cell_separator="\t") == "a\tb"
+
+def test_nested_table_rows_stay_inside_their_cell():
+    document = Document()
+    outer = document.add_table(rows=1, cols=2)
+    outer.rows[0].cells[0].text = "Terms"
+    inner = outer.rows[0].cells[1].add_table(rows=1, cols=2)
+    inner.rows[0].cells[0].text = "net"
+    inner.rows[0].cells[1].text = "30"
+    assert extract_docx_text(save(document)) == "Terms | net | 30"
+
+def test_headers_come_first_and_footers_last_without_repeats():
+    document = Document()
+    section = document.sections[0]
+    section.header.paragraphs[0].text = "ACME Ltd"
+    section.footer.paragraphs[0].text = "Page footer"
+    document.add_paragraph("Body text")
+    document.add_section()
+    # A second section repeating the same header text through its own part
+    document.sections[1].header.is_linked_to_previous = False
+    document.sections[1].header.paragraphs[0].text = "ACME Ltd"
+    document.add_paragraph("More body text")
+
+    assert extract_docx_text(save(document)).split("\n") == [
+        "ACME Ltd", "Body text", "More body text", "Page footer",
+    ]
+
+def test_line_breaks_and_tabs_inside_a_paragraph_are_kept():
+    document = Document()
+    run = document.add_paragraph().add_run("Name")
+    run.add_tab()
+    run.add_text("Value")
+    run.add_break()
+    run.add_text("Next line")
+    assert extract_docx_text(save(document)) == "Name\tValue\nNext line"
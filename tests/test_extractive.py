@@ -0,0 +1,37 @@
+from app.services.extractive import extract_summary
+from app.services.openai_service import estimate_tokens
+
+TEMPLATE = "Summarise the payment terms and the invoice amounts."
+
+def test_short_document_is_returned_unchanged():
+    document = "The invoice is due in thirty days. Payment is by transfer."
+    assert extract_summary(document, TEMPLATE, token_budget=1000) == document
+
+def test_extract_keeps_relevant_sentences_in_document_order():
+    document = (
+        "Weather in our region was mild this spring. "
+        "Each invoice amount is due within thirty days of delivery. "
+        "Our office moved to a new building in March. "
+        "Late payment terms add interest to an invoice. "
+        "Everyone enjoyed a picnic by a river."
+    )
+    summary = extract_summary(document, TEMPLATE, token_budget=30, template_weight=1.0)
+    assert summary.split("\n") == [
+        "Each invoice amount is due within thirty days of delivery.",
+        "Late payment terms add interest to an invoice.",
+    ]
+
+def test_table_block_without_punctuation_is_split_into_rows():
+    # DOCX tables are extracted as rows of ' | '-joined cells, one block with no sentence punctuation
+    rows = [f"Invoice {n} | Amount {n * 100} | Payment terms net {n}" for n in range(1, 41)]
+    summary = extract_summary("\n".join(rows), TEMPLATE, token_budget=50)
+    assert summary
+    assert estimate_tokens(summary) <= 50
+    assert all(line in rows for line in summary.split("\n"))
+
+def test_oversized_single_sentence_is_cut_to_the_budget():
+    document = " ".join(f"invoice amount {n}" for n in range(500))
+    summary = extract_summary(document, TEMPLATE, token_budget=20)
+    assert summary
+    assert estimate_tokens(summary) <= 20
+    assert document.startswith(summary)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from app.services.chunking import ChunkView
+from app.services.retrieval import BM25Index, choose_retrieval_engine, lexical_search, hybrid_search
+
+TEXTS = [
+    "The invoice amount is due within thirty days.",
+    "Our office moved to a new building in March.",
+    "Late payment adds interest to the invoice.",
+    "The team enjoyed a picnic by the river.",
+]
+
+def make_docs(texts=TEXTS):
+    buffer = "".join(texts)
+    docs, start = [], 0
+    for index, text in enumerate(texts):
+        docs.append(ChunkView(buffer, start, len(text), index=index))
+        start += len(text)
+    return docs
+
+def test_bm25_ranks_texts_sharing_rare_query_terms_first():
+    index = BM25Index(TEXTS)
+    assert index.top_k("invoice payment", k=2) == [2, 0]
+    assert sorted(index.top_k("invoice", k=10)[:2]) == [0, 2]
+    assert len(index.top_k("invoice", k=10)) == len(TEXTS)
+
+def test_bm25_scores_unknown_terms_as_zero():
+    assert not BM25Index(TEXTS).scores("quantum chromodynamics").any()
+
+def test_bm25_handles_an_empty_corpus():
+    assert BM25Index([]).top_k("invoice") == []
+
+def test_lexical_search_returns_the_matching_chunks():
+    docs = make_docs()
+    assert [doc.page_content for doc in lexical_search(docs, "picnic river", k=1)] == [TEXTS[3]]
+
+def test_choose_retrieval_engine_keeps_small_corpora_local():
+    config = {'RETRIEVAL_ENGINE': 'auto', 'LEXICAL_MAX_CHUNKS': 50}
+    assert choose_retrieval_engine(None, 10, config) == 'lexical'
+    assert choose_retrieval_engine(None, 51, config) == 'vector'
+    assert choose_retrieval_engine('hybrid', 10, config) == 'hybrid'
+    with pytest.raises(ValueError):
+        choose_retrieval_engine('semantic', 10, config)
+
+def test_hybrid_search_fuses_vector_and_lexical_scores():
+    docs = make_docs()
+    # The vector index favours chunk 1; BM25 favours chunk 3
+    vector_hits = [(1, 0.1), (3, 0.5), (0, 2.0)]
+    results = hybrid_search(vector_hits, docs, "picnic river", k=2, vector_weight=0.5)
+    assert [doc.page_content for doc in results] == [TEXTS[3], TEXTS[1]]
+    only_vector = hybrid_search(vector_hits, docs, "picnic river", k=1, vector_weight=1.0)
+    assert only_vector[0].page_content == TEXTS[1]
+
+def test_hybrid_search_without_vector_hits_ranks_by_bm25():
+    docs = make_docs()
+    with np.errstate(all='raise'):
+        results = hybrid_search([], docs, "late payment interest", k=2)
+    assert results[0].page_content == TEXTS[2]
+
+def test_hybrid_search_with_a_single_candidate():
+    docs = make_docs(TEXTS[:1])
+    results = hybrid_search([(0, 0.3)], docs, "invoice", k=5)
+    assert [doc.page_content for doc in results] == [TEXTS[0]]
@@ -0,0 +1,105 @@
+import time
+import threading
+import pytest
+from app.services.single_flight import SingleFlight, LocalLockBackend
+from app.services.document_generator import GENERATION_ERROR_PREFIX, is_generation_error
+
+class MemoryStore:
+    """Result store stand-in with the put/get interface of the real stores."""
+
+    def __init__(self):
+        self.entries = {}
+        self.ttls = {}
+
+    def put(self, value, result_id, ttl=None):
+        self.entries[result_id] = (value, time.monotonic() + ttl if ttl else None)
+        self.ttls[result_id] = ttl
+        return result_id
+
+    def get(self, result_id):
+        entry = self.entries.get(result_id)
+        if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+            return None
+        return entry[0]
+
+def make_flight(store=None):
+    return SingleFlight(LocalLockBackend(), store or MemoryStore(), lock_ttl=5, result_ttl=60,
+                        poll_interval=0.01, is_failure=is_generation_error)
+
+def run_concurrently(flight, fn, callers=4):
+    """Call flight.run from several threads once the first has become the leader."""
+    started = threading.Event()
+    release = threading.Event()
+    outcomes = [None] * callers
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def call(index):
+        try:
+            outcomes[index] = ('value', flight.run('key', leader_fn))
+        except Exception as e:
+            outcomes[index] = ('error', e)
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    assert started.wait(5)
+    threads.extend(threading.Thread(target=call, args=(index,)) for index in range(1, callers))
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+def test_followers_share_the_leaders_result():
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return "the document"
+
+    outcomes = run_concurrently(make_flight(), generate)
+    assert len(calls) == 1
+    assert outcomes == [('value', "the document")] * 4
+
+def test_raised_error_reaches_every_caller():
+    def generate():
+        raise ValueError("openai is down")
+
+    outcomes = run_concurrently(make_flight(), generate)
+    assert isinstance(outcomes[0][1], ValueError)
+    for kind, error in outcomes[1:]:
+        assert kind == 'error'
+        assert isinstance(error, RuntimeError)
+        assert "openai is down" in str(error)
+
+def test_returned_error_is_a_short_lived_failure():
+    store = MemoryStore()
+    flight = make_flight(store)
+    failure = f"{GENERATION_ERROR_PREFIX}: rate limited"
+
+    outcomes = run_concurrently(flight, lambda: failure)
+    # The leader's caller gets the text as before; followers see a failure, not a shared document
+    assert outcomes[0] == ('value', failure)
+    for kind, error in outcomes[1:]:
+        assert kind == 'error'
+        assert "rate limited" in str(error)
+    assert store.entries['flight:key'][0]['ok'] is False
+    assert store.ttls['flight:key'] < flight.result_ttl
+
+def test_failure_is_not_served_to_a_later_retry():
+    store = MemoryStore()
+    flight = make_flight(store)
+
+    def failing():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.run('key', failing)
+    # Expire the short-lived failure as the store would after its TTL
+    store.entries.clear()
+    assert flight.run('key', lambda: "fresh document") == "fresh document"
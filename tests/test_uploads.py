@@ -0,0 +1,58 @@
+import io
+import hashlib
+from flask import Flask, request
+from app.services.uploads import HashingSpooledFile, SpoolingRequest, upload_content_hash, open_upload_view, MappedFile
+
+def write_in_pieces(spooled, data, piece=1000):
+    for start in range(0, len(data), piece):
+        spooled.write(data[start:start + piece])
+
+def test_digest_matches_the_bytes_written_while_in_memory():
+    data = b"small upload " * 10
+    with HashingSpooledFile(max_size=4096) as spooled:
+        write_in_pieces(spooled, data, piece=7)
+        assert not spooled.on_disk
+        assert spooled.size == len(data)
+        assert spooled.content_hash == hashlib.sha256(data).hexdigest()
+
+def test_digest_covers_bytes_written_before_and_after_spilling(tmp_path):
+    data = bytes(range(256)) * 100
+    with HashingSpooledFile(max_size=1024, dir=str(tmp_path)) as spooled:
+        write_in_pieces(spooled, data)
+        assert spooled.on_disk
+        assert spooled.content_hash == hashlib.sha256(data).hexdigest()
+        spooled.seek(0)
+        assert spooled.read() == data
+
+def test_upload_view_maps_spilled_files_and_rewinds_in_memory_ones(tmp_path):
+    data = b"x" * 5000
+    with HashingSpooledFile(max_size=1024, dir=str(tmp_path)) as spooled:
+        spooled.write(data)
+        with open_upload_view(spooled) as view:
+            assert isinstance(view, MappedFile)
+            assert view[:] == data
+
+    with HashingSpooledFile(max_size=1024 * 1024) as spooled:
+        spooled.write(b"in memory")
+        with open_upload_view(spooled) as view:
+            assert view is spooled
+            assert view.read() == b"in memory"
+        assert spooled.tell() == 0
+
+def test_upload_content_hash_is_none_for_unspooled_streams():
+    assert upload_content_hash(io.BytesIO(b"data")) is None
+
+def test_spooling_request_hashes_multipart_uploads(tmp_path):
+    app = Flask(__name__)
+    app.request_class = SpoolingRequest
+    app.config.update(UPLOAD_SPOOL_THRESHOLD=1024, UPLOAD_FOLDER=str(tmp_path))
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        f = request.files['file']
+        return {'hash': upload_content_hash(f), 'on_disk': f.stream.on_disk}
+
+    data = b"spooled upload " * 500
+    response = app.test_client().post('/upload', data={'file': (io.BytesIO(data), 'doc.txt')},
+                                      content_type='multipart/form-data')
+    assert response.json == {'hash': hashlib.sha256(data).hexdigest(), 'on_disk': True}
@@ -0,0 +1,42 @@
+import os
+import time
+import numpy as np
+import faiss
+from app.services.vector_index import IndexCache
+
+def build_index(count=10, dim=8):
+    index = faiss.IndexFlatL2(dim)
+    index.add(np.random.default_rng(0).random((count, dim), dtype=np.float32))
+    return index
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+def test_saved_index_is_loaded_from_disk(tmp_path):
+    IndexCache(str(tmp_path), purge_interval=0).put('ab' * 32, build_index())
+    index = IndexCache(str(tmp_path)).get('ab' * 32)
+    assert index is not None and index.ntotal == 10
+
+def test_purge_removes_indexes_unused_for_the_ttl(tmp_path):
+    cache = IndexCache(str(tmp_path), ttl=60, purge_interval=0)
+    cache.put('aa' * 32, build_index())
+    cache.put('bb' * 32, build_index())
+    age(cache.path('aa' * 32), 120)
+    assert cache.purge_expired() == 1
+    assert not os.path.exists(cache.path('aa' * 32))
+    assert os.path.exists(cache.path('bb' * 32))
+
+def test_purge_keeps_the_directory_under_max_bytes(tmp_path):
+    cache = IndexCache(str(tmp_path), max_bytes=None, purge_interval=0)
+    keys = ['aa' * 32, 'bb' * 32, 'cc' * 32]
+    for n, key in enumerate(keys):
+        cache.put(key, build_index())
+        age(cache.path(key), 30 - n * 10)
+    size = os.path.getsize(cache.path(keys[0]))
+    cache.max_bytes = 2 * size
+    # Reading an index marks it as used, so the oldest unused one goes first
+    IndexCache(str(tmp_path)).get(keys[0])
+    assert cache.purge_expired() == 1
+    assert not os.path.exists(cache.path(keys[1]))
+    assert os.path.exists(cache.path(keys[0])) and os.path.exists(cache.path(keys[2]))